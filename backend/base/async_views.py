@@ -0,0 +1,298 @@
+# base/async_views.py
+"""
+Async versions of the chat and TTS views, for serving myproj.asgi under an ASGI server, e.g.
+    gunicorn myproj.asgi:application -k uvicorn.workers.UvicornWorker
+
+DRF's APIView is sync-only, so these are plain async Django views that do JWT auth
+themselves. The slow part, waiting on Gemini / ElevenLabs, goes through the shared
+httpx.AsyncClient, so one process can hold many upstream waits without a thread each.
+The short DB work reuses the sync helpers from views.py through sync_to_async.
+base/urls.py routes to these instead of the DRF views when ASYNC_UPSTREAM_VIEWS is on.
+"""
+
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_POST
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .chat import abuild_prompt_history, save_ai_reply
+from .elevenlabs import (
+    ELABS_API_KEY,
+    VOICE_ID,
+    TTS_MODEL_ID,
+    TTS_TIMEOUT,
+    TTS_VOICE_SETTINGS,
+    SLOW_TTS_VOICE_SETTINGS,
+    open_stream,
+    tts_request,
+)
+from .gemini import (
+    GOOGLE_API_KEY,
+    CIRCUIT_OPEN_MESSAGE,
+    gemini_breaker,
+    _acall_gemini_api_with_history,
+    _astream_gemini_api_with_history,
+)
+from .models import Chat
+from .serializers import JobSerializer, MessageSerializer
+from . import idempotency, jobs, ratelimit, tts_cache, tts_chunks
+from .upstream import ASYNC_HTTP_ERRORS, async_http_client
+from .views import (
+    ChatMessageCreateView,
+    QUEUE_FULL_MESSAGE,
+    _accepted_headers,
+    _check_chat_limits,
+    _chunked_tts_plan,
+    _queue_chat_reply,
+    _queue_tts,
+    _sse_event,
+    _wants_background,
+    _wants_fresh,
+    _wants_stream,
+    handle_tts_usage_limit,
+)
+
+logger = logging.getLogger(__name__)
+
+_list_chat_messages = ChatMessageCreateView.as_view()
+
+
+async def _authenticate(request):
+    """Returns the user for the request's Bearer token, or None."""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def _unauthorized():
+    return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+def _request_data(request):
+    # The frontend posts JSON; fall back to form data like DRF's parsers would
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def chat_message_create(request, session_id):
+    if request.method == "GET":
+        # Reading a page of history is a quick DB query; the sync view handles it fine
+        return await sync_to_async(_list_chat_messages)(request, session_id=session_id)
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    # Retries with the same Idempotency-Key get the first response back
+    record, replay = await idempotency.abegin(request, user, _request_data(request))
+    if replay is not None:
+        return replay
+    try:
+        response = await _create_chat_message(request, user, session_id)
+    except BaseException:
+        if record is not None:
+            await sync_to_async(idempotency.release)(record)
+        raise
+    return await sync_to_async(idempotency.finish)(record, response)
+
+
+async def _create_chat_message(request, user, session_id):
+    try:
+        chat_session = await Chat.objects.aget(pk=session_id, user=user)
+    except Chat.DoesNotExist:
+        return JsonResponse({"error": "Chat session not found or access denied."}, status=status.HTTP_404_NOT_FOUND)
+
+    if await sync_to_async(gemini_breaker.is_open)():
+        response = JsonResponse({"error": CIRCUIT_OPEN_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response["Retry-After"] = str(await sync_to_async(gemini_breaker.retry_after)())
+        return response
+
+    user_message_content = _request_data(request).get('content')
+    if not isinstance(user_message_content, str) or not user_message_content.strip():
+        return JsonResponse({"error": "Message content cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+    limit_error, rate_limit = await sync_to_async(_check_chat_limits)(user, chat_session)
+    if limit_error:
+        error_message, error_status = limit_error
+        return rate_limit.apply(JsonResponse({"error": error_message}, status=error_status))
+
+    if _wants_background(request):
+        try:
+            user_message, job = await sync_to_async(_queue_chat_reply)(
+                user, chat_session, user_message_content.strip(), fresh=_wants_fresh(request)
+            )
+        except jobs.QueueFull:
+            return rate_limit.apply(JsonResponse({"error": QUEUE_FULL_MESSAGE}, status=status.HTTP_429_TOO_MANY_REQUESTS))
+        response = JsonResponse(
+            {"user_message": MessageSerializer(user_message).data, "job": JobSerializer(job).data},
+            status=status.HTTP_202_ACCEPTED,
+        )
+        for header, value in _accepted_headers(job).items():
+            response[header] = value
+        return rate_limit.apply(response)
+
+    user_message = await sync_to_async(chat_session.add_message)('user', user_message_content.strip())
+    user_message_data = MessageSerializer(user_message).data
+
+    if not GOOGLE_API_KEY:
+        logger.error("GOOGLE_API_KEY is not configured.")
+        return JsonResponse({"error": "AI service configuration error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    gemini_prompt_history = await abuild_prompt_history(chat_session)
+
+    use_cache = not _wants_fresh(request)
+    if _wants_stream(request):
+        return rate_limit.apply(_stream_response(chat_session, user_message_data, gemini_prompt_history, use_cache))
+
+    ai_response_content = await _acall_gemini_api_with_history(gemini_prompt_history, GOOGLE_API_KEY, use_cache=use_cache)
+    ai_message = await sync_to_async(save_ai_reply)(chat_session, ai_response_content)
+
+    return rate_limit.apply(JsonResponse({
+        "user_message": user_message_data,
+        "ai_message": MessageSerializer(ai_message).data
+    }, status=status.HTTP_201_CREATED))
+
+
+def _stream_response(chat_session, user_message_data, gemini_prompt_history, use_cache=True):
+    async def event_stream():
+        yield _sse_event("user_message", user_message_data)
+        chunks = []
+        try:
+            async for delta in _astream_gemini_api_with_history(gemini_prompt_history, GOOGLE_API_KEY, use_cache):
+                chunks.append(delta)
+                yield _sse_event("delta", {"text": delta})
+        finally:
+            # Runs even if the client disconnects mid-stream so the reply isn't lost
+            ai_message = await sync_to_async(save_ai_reply)(chat_session, "".join(chunks))
+        yield _sse_event("ai_message", MessageSerializer(ai_message).data)
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream", status=status.HTTP_201_CREATED)
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def _text_to_speech(request, voice_settings):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    request.user = user
+
+    record, replay = await idempotency.abegin(request, user, _request_data(request))
+    if replay is not None:
+        return replay
+    try:
+        response = await _synthesize(request, voice_settings)
+    except BaseException:
+        if record is not None:
+            await sync_to_async(idempotency.release)(record)
+        raise
+    return await sync_to_async(idempotency.finish)(record, response)
+
+
+async def _synthesize(request, voice_settings):
+    text = _request_data(request).get("text")
+    if not text:
+        return JsonResponse({"error": "Text is required"}, status=400)
+
+    audio_cache_key = tts_cache.cache_key(text, VOICE_ID, TTS_MODEL_ID, voice_settings)
+    cached_path = await sync_to_async(tts_cache.lookup)(audio_cache_key)
+    if cached_path:
+        # Cache hits are free, so they don't count against the usage limit
+        return tts_cache.file_response(request, cached_path)
+
+    if _wants_background(request):
+        return await sync_to_async(_queue_tts)(request, text, slow=voice_settings is SLOW_TTS_VOICE_SETTINGS)
+
+    segments_plan = await sync_to_async(_chunked_tts_plan)(text, voice_settings)
+    if segments_plan:
+        return await _chunked_tts_response(request, segments_plan, voice_settings)
+
+    # Checked before claiming the fill, so a refused request never holds it
+    limit_response, rate_limit = await sync_to_async(handle_tts_usage_limit)(request)
+    if limit_response:
+        return limit_response
+
+    fill = await sync_to_async(tts_cache.begin_fill)(audio_cache_key)
+    if fill is None:
+        # Someone is already downloading this clip; stream along with their download, which is free
+        await sync_to_async(ratelimit.refund)("tts", request.user)
+        return StreamingHttpResponse(tts_cache.afollow(audio_cache_key), content_type="audio/mpeg")
+
+    if not ELABS_API_KEY or not VOICE_ID:
+        fill.abort()
+        logger.error("ElevenLabs API Key or Voice ID is not configured.")
+        return JsonResponse({"error": "TTS service configuration error."}, status=500)
+
+    url, headers, data = tts_request(text, voice_settings)
+    client = async_http_client()
+    try:
+        response = await client.send(
+            client.build_request("POST", url, json=data, headers=headers),
+            stream=True,
+            timeout=TTS_TIMEOUT,
+        )
+    except ASYNC_HTTP_ERRORS as e:
+        fill.abort()
+        logger.error(f"Error generating audio with ElevenLabs: {e}")
+        return JsonResponse({"error": "Error generating the audio"}, status=500)
+
+    if response.status_code >= 400:
+        body = (await response.aread()).decode("utf-8", "replace")
+        await response.aclose()
+        fill.abort()
+        logger.error(f"ElevenLabs HTTP error: {response.status_code} - {body[:500]}")
+        return JsonResponse({"error": f"TTS service error: {response.status_code}"}, status=response.status_code)
+
+    async def audio_stream():
+        try:
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    # Written to the cache as it streams; published only if the whole clip arrives
+    return rate_limit.apply(StreamingHttpResponse(fill.atee(audio_stream()), content_type="audio/mpeg"))
+
+
+async def _chunked_tts_response(request, segments_plan, voice_settings):
+    """Async twin of views._chunked_tts_response."""
+    rate_limit = ratelimit.UNLIMITED
+    if not all(cached for _, _, cached in segments_plan):
+        limit_response, rate_limit = await sync_to_async(handle_tts_usage_limit)(request)
+        if limit_response:
+            return limit_response
+        if not ELABS_API_KEY or not VOICE_ID:
+            logger.error("ElevenLabs API Key or Voice ID is not configured.")
+            return JsonResponse({"error": "TTS service configuration error."}, status=500)
+    # The segment downloads run in threads with the sync client, so they don't block the loop
+    response = await tts_chunks.astreaming_response(
+        segments_plan, lambda segment: open_stream(segment, voice_settings)
+    )
+    if response is None:
+        return JsonResponse({"error": "Error generating the audio"}, status=502)
+    return rate_limit.apply(response)
+
+
+@csrf_exempt
+@require_POST
+async def text_to_speech(request):
+    return await _text_to_speech(request, TTS_VOICE_SETTINGS)
+
+
+@csrf_exempt
+@require_POST
+async def text_to_speech_slow(request):
+    return await _text_to_speech(request, SLOW_TTS_VOICE_SETTINGS)
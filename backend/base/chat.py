@@ -0,0 +1,46 @@
+# base/chat.py
+"""
+Chat helpers shared by the chat views (base/views.py, base/async_views.py) and the
+chat_reply job (base/tasks.py): building the prompt sent to Gemini and saving its reply.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+
+from .context import plan_context
+from .gemini import EMPTY_REPLY_MESSAGE, GOOGLE_API_KEY, _agenerate_content, _generate_content
+
+logger = logging.getLogger(__name__)
+
+
+def build_prompt_history(chat_session):
+    """
+    Rolling summary plus recent messages within the context budget (see base/context.py).
+    Folds older messages into the summary first when the chat has outgrown the budget;
+    if that fails they are sent verbatim for this turn and folding is retried next turn.
+    """
+    plan = plan_context(chat_session)
+    if plan.to_fold:
+        summary_text, ok = _generate_content(plan.summary_prompt(), GOOGLE_API_KEY)
+        if ok:
+            plan.apply_summary(summary_text)
+        else:
+            logger.warning(f"Could not refresh summary for chat {chat_session.id}: {summary_text}")
+    return plan.prompt_history()
+
+
+async def abuild_prompt_history(chat_session):
+    """Async twin of build_prompt_history."""
+    plan = await sync_to_async(plan_context)(chat_session)
+    if plan.to_fold:
+        summary_text, ok = await _agenerate_content(plan.summary_prompt(), GOOGLE_API_KEY)
+        if ok:
+            await sync_to_async(plan.apply_summary)(summary_text)
+        else:
+            logger.warning(f"Could not refresh summary for chat {chat_session.id}: {summary_text}")
+    return plan.prompt_history()
+
+
+def save_ai_reply(chat_session, content):
+    return chat_session.add_message('ai', content or EMPTY_REPLY_MESSAGE)
@@ -0,0 +1,100 @@
+# base/circuit.py
+"""
+A circuit breaker whose state lives in the Django cache, so every worker sees the same
+state. While an upstream is failing, requests fail fast instead of each one sitting
+through its own timeouts and retries.
+
+    closed    -> requests go through; failures within failure_window are counted
+    open      -> after failure_threshold failures: requests are refused for recovery_timeout
+    half-open -> after recovery_timeout: a single probe request is let through;
+                 success closes the circuit, failure opens it again, and a probe that
+                 ends with neither (e.g. a 400 for our own request) gives the slot back
+"""
+
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, recovery_timeout, failure_window=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_window = failure_window
+        self._opened_at_key = f"circuit_{name}_opened_at"
+        self._failures_key = f"circuit_{name}_failures"
+        self._probe_key = f"circuit_{name}_probe"
+
+    def state(self):
+        opened_at = cache.get(self._opened_at_key)
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at < self.recovery_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def is_open(self):
+        """
+        True while requests are being refused: open, or half-open with the probe already
+        in flight. Does not claim the probe, so views can check it before doing any work.
+        """
+        state = self.state()
+        return state == OPEN or (state == HALF_OPEN and cache.get(self._probe_key) is not None)
+
+    def retry_after(self):
+        """Seconds until the circuit will let a probe request through."""
+        opened_at = cache.get(self._opened_at_key)
+        if opened_at is None:
+            return 0
+        return max(1, int(opened_at + self.recovery_timeout - time.time()) + 1)
+
+    def allow_request(self):
+        """
+        False while requests are refused. Otherwise truthy: HALF_OPEN when this request took
+        the probe slot, which it must give back with release_probe() if it ends without
+        record_success() or record_failure().
+        """
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        # Half-open: only one request at a time gets to test the upstream
+        return HALF_OPEN if cache.add(self._probe_key, 1, timeout=self.recovery_timeout) else False
+
+    def release_probe(self):
+        cache.delete(self._probe_key)
+
+    def record_success(self):
+        if cache.get(self._opened_at_key) is not None:
+            logger.info(f"Circuit '{self.name}' closed after a successful probe.")
+            cache.delete_many([self._opened_at_key, self._probe_key, self._failures_key])
+        elif cache.get(self._failures_key):
+            cache.delete(self._failures_key)
+
+    def record_failure(self):
+        if self.state() == HALF_OPEN:
+            self._trip()
+            return
+        cache.add(self._failures_key, 0, timeout=self.failure_window)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError: # Expired between add and incr
+            cache.set(self._failures_key, 1, timeout=self.failure_window)
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        logger.warning(f"Circuit '{self.name}' opened; failing fast for {self.recovery_timeout}s.")
+        # Keep the timestamp well past the recovery window so half-open state is observable
+        cache.set(self._opened_at_key, time.time(), timeout=self.recovery_timeout * 10)
+        cache.delete_many([self._failures_key, self._probe_key])
@@ -0,0 +1,137 @@
+# base/context.py
+"""
+Context-window budgeting for the chat history sent to Gemini.
+
+Instead of replaying every Message on every turn, a chat's prompt is its rolling summary
+(Chat.summary) plus the most recent messages that fit in CHAT_CONTEXT_TOKEN_BUDGET.
+When the unsummarized part of the chat no longer fits, the older messages are folded
+into the summary with one extra Gemini call. Only the newly folded messages and the
+previous summary are sent for that, so the summary is refreshed incrementally and the
+cost of a turn stays flat however long the chat gets.
+
+Token counts are estimated once when a Message is inserted (Message.token_count), so
+planning a prompt never re-tokenizes history.
+"""
+
+import logging
+import math
+
+from django.conf import settings
+
+from .models import Chat, Message
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4 # Rough average for Gemini's tokenizer on English text
+SUMMARY_ACK = "Understood, I'll keep that context in mind."
+
+
+def estimate_tokens(text):
+    return max(1, math.ceil(len(text or "") / CHARS_PER_TOKEN))
+
+
+def _to_gemini(sender, content):
+    # Gemini expects 'user' for user messages and 'model' for AI's previous responses
+    role = "model" if sender == "ai" else "user"
+    return {'role': role, 'parts': [{'text': content}]}
+
+
+class ContextPlan:
+    """
+    What to send for the next turn: the chat's current summary, the recent messages
+    kept verbatim and, if compaction is due, the older messages to fold into the summary.
+    """
+
+    def __init__(self, chat_session, recent, to_fold):
+        self.chat_session = chat_session
+        self.recent = recent # list of message value dicts, oldest first
+        self.to_fold = to_fold
+
+    def prompt_history(self):
+        """
+        Summary exchange followed by the verbatim messages. Messages still in to_fold
+        (the summary call failed or lost a race) are sent as-is so the turn loses nothing,
+        and consecutive turns from the same side are merged to keep roles alternating.
+        """
+        history = []
+        if self.chat_session.summary:
+            # Presented as an earlier exchange so roles keep alternating user/model
+            history.append(_to_gemini('user', f"Summary of our conversation so far:\n{self.chat_session.summary}"))
+            history.append(_to_gemini('ai', SUMMARY_ACK))
+        for msg in self.to_fold + self.recent:
+            turn = _to_gemini(msg['sender'], msg['content'])
+            if history and history[-1]['role'] == turn['role']:
+                # e.g. an AI message right after SUMMARY_ACK
+                history[-1]['parts'].extend(turn['parts'])
+            else:
+                history.append(turn)
+        return history
+
+    def summary_prompt(self):
+        """Prompt asking Gemini to merge to_fold into the existing summary."""
+        transcript = "\n".join(
+            f"{'AI' if msg['sender'] == 'ai' else 'User'}: {msg['content']}" for msg in self.to_fold
+        )
+        instructions = (
+            "You maintain a running summary of a conversation between a user and an AI study assistant. "
+            "Update the summary with the new messages below. Keep facts, names, terms, decisions and open "
+            f"questions; drop small talk. Answer with the updated summary only, in under {settings.CHAT_SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN} characters."
+        )
+        current = self.chat_session.summary or "(empty)"
+        text = f"{instructions}\n\nCurrent summary:\n{current}\n\nNew messages:\n{transcript}"
+        return [_to_gemini('user', text)]
+
+    def apply_summary(self, summary_text):
+        """
+        Stores the refreshed summary and moves the chat's summary cursor past to_fold.
+        to_fold is only cleared if this plan's cursor update won; otherwise the chat keeps
+        the summary it was planned against and the messages stay in the prompt.
+        """
+        chat = self.chat_session
+        summary_text = summary_text.strip()
+        last_folded_id = self.to_fold[-1]['id']
+        # Only move the cursor forward from where this plan started, in case a concurrent
+        # turn already compacted the same messages.
+        updated = Chat.objects.filter(
+            pk=chat.pk, summarized_up_to_id=chat.summarized_up_to_id
+        ).update(
+            summary=summary_text,
+            summary_token_count=estimate_tokens(summary_text),
+            summarized_up_to_id=last_folded_id,
+        )
+        if updated:
+            chat.summary = summary_text
+            chat.summary_token_count = estimate_tokens(summary_text)
+            chat.summarized_up_to_id = last_folded_id
+            self.to_fold = []
+        return bool(updated)
+
+
+def plan_context(chat_session):
+    """
+    Picks the messages for the next prompt. Everything after the summary cursor is sent
+    if it fits the budget; otherwise the last CHAT_CONTEXT_RECENT_MESSAGES that fit are
+    kept and the rest is marked for folding into the summary.
+    """
+    budget = settings.CHAT_CONTEXT_TOKEN_BUDGET - chat_session.summary_token_count
+    unsummarized = chat_session.messages.all()
+    if chat_session.summarized_up_to_id:
+        unsummarized = unsummarized.filter(id__gt=chat_session.summarized_up_to_id)
+    messages = list(
+        unsummarized.order_by('timestamp', 'id').values('id', 'sender', 'content', 'token_count')
+    )
+
+    if sum(msg['token_count'] for msg in messages) <= budget:
+        return ContextPlan(chat_session, messages, [])
+
+    # Walk back from the newest message; the latest one is always kept.
+    kept = 0
+    used = 0
+    for msg in reversed(messages):
+        if kept and (kept >= settings.CHAT_CONTEXT_RECENT_MESSAGES or used + msg['token_count'] > budget):
+            break
+        kept += 1
+        used += msg['token_count']
+
+    split = len(messages) - kept
+    return ContextPlan(chat_session, messages[split:], messages[:split])
@@ -0,0 +1,159 @@
+# base/counters.py
+"""
+Shared counters for rate limits and usage quotas.
+
+Limiter state has to be visible to every worker and updated atomically; otherwise
+each gunicorn worker keeps its own count and concurrent requests race past the limit.
+The backend is chosen by settings.COUNTER_BACKEND, in the same shape as CACHES:
+
+    DatabaseCounterBackend  rows in the base_counter table; works with any database
+    RedisCounterBackend     Redis (or anything speaking its protocol), via Lua scripts
+
+Both implement:
+    incr(key, amount=1, ttl=None)                  -> the new value, atomically
+    get(key)                                       -> the current value, 0 if unset
+    compare_and_set(key, expected, new, ttl=None)  -> True if the value was `expected`
+                                                      (None meaning unset) and is now `new`
+    delete(key)
+
+ttl is in seconds. incr() only applies it when the key is created, so a counter started by
+incr() is a fixed window that resets when it expires; compare_and_set() applies it on
+every successful write.
+"""
+
+import logging
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseCounterBackend:
+    # Expired rows are replaced when their key is reused; this also clears out the rest now and then
+    PURGE_PROBABILITY = 0.01
+
+    def __init__(self, **options):
+        pass
+
+    def _live(self, now):
+        return Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+
+    def _expires_at(self, now, ttl):
+        return now + timedelta(seconds=ttl) if ttl else None
+
+    def incr(self, key, amount=1, ttl=None):
+        now = timezone.now()
+        for _ in range(3):
+            with transaction.atomic():
+                # The UPDATE holds the row lock until commit, so the read sees our increment
+                if Counter.objects.filter(self._live(now), key=key).update(value=F("value") + amount):
+                    return Counter.objects.values_list("value", flat=True).get(key=key)
+            if self._create(key, amount, now, ttl):
+                return amount
+            # Another request created the key first; increment theirs
+        raise RuntimeError(f"Could not increment counter {key} under contention.")
+
+    def get(self, key):
+        value = Counter.objects.filter(self._live(timezone.now()), key=key).values_list("value", flat=True).first()
+        return value or 0
+
+    def compare_and_set(self, key, expected, new, ttl=None):
+        now = timezone.now()
+        if expected is None:
+            return self._create(key, new, now, ttl)
+        updates = {"value": new}
+        if ttl:
+            updates["expires_at"] = self._expires_at(now, ttl)
+        return bool(Counter.objects.filter(self._live(now), key=key, value=expected).update(**updates))
+
+    def delete(self, key):
+        Counter.objects.filter(key=key).delete()
+
+    def _create(self, key, value, now, ttl):
+        """Creates key if it is unset (or expired); returns False if a live row already exists."""
+        if random.random() < self.PURGE_PROBABILITY:
+            self.purge_expired()
+        try:
+            with transaction.atomic():
+                Counter.objects.filter(key=key, expires_at__lte=now).delete()
+                Counter.objects.create(key=key, value=value, expires_at=self._expires_at(now, ttl))
+            return True
+        except IntegrityError:
+            return False
+
+    def purge_expired(self):
+        deleted, _ = Counter.objects.filter(expires_at__lte=timezone.now()).delete()
+        if deleted:
+            logger.info(f"Purged {deleted} expired counters.")
+
+
+class RedisCounterBackend:
+    # INCRBY, then set the expiry only if the key doesn't have one yet (i.e. was just created)
+    INCR_SCRIPT = """
+        local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+        if tonumber(ARGV[2]) > 0 and redis.call('TTL', KEYS[1]) == -1 then
+            redis.call('EXPIRE', KEYS[1], ARGV[2])
+        end
+        return value
+    """
+    # ARGV[1] is the expected value, or '' for "key must not exist"
+    CAS_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        if (ARGV[1] == '' and not current) or current == ARGV[1] then
+            if tonumber(ARGV[3]) > 0 then
+                redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+            elseif current then
+                redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+            else
+                redis.call('SET', KEYS[1], ARGV[2])
+            end
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, LOCATION, KEY_PREFIX="counter:", **options):
+        import redis # Only needed when this backend is configured
+
+        self.client = redis.Redis.from_url(LOCATION)
+        self.prefix = KEY_PREFIX
+        self._incr = self.client.register_script(self.INCR_SCRIPT)
+        self._cas = self.client.register_script(self.CAS_SCRIPT)
+
+    def incr(self, key, amount=1, ttl=None):
+        return int(self._incr(keys=[self.prefix + key], args=[amount, ttl or 0]))
+
+    def get(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def compare_and_set(self, key, expected, new, ttl=None):
+        expected = "" if expected is None else str(expected)
+        return bool(self._cas(keys=[self.prefix + key], args=[expected, new, ttl or 0]))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def counters():
+    """The configured counter backend, created once per process."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = dict(settings.COUNTER_BACKEND)
+                backend_class = import_string(config.pop("BACKEND"))
+                _backend = backend_class(**config)
+    return _backend
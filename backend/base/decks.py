@@ -0,0 +1,231 @@
+# base/decks.py
+"""
+Deck import and export in CSV, Anki-style TSV and JSON, streamed both ways.
+
+    csv   header row optional ("term,definition,..."); otherwise term and definition
+          are the first two columns
+    tsv   Anki's "Notes in Plain Text" export: tab-separated, with optional "#key:value"
+          header lines (#columns: names the columns, like a CSV header)
+    json  an array of {"term": ..., "definition": ...} objects
+
+Import reads the upload incrementally (Django spools large uploads to a temporary file)
+and inserts in IMPORT_BATCH_SIZE bulk_creates, so memory use doesn't grow with the file.
+Export is a generator over .iterator(chunk_size=...) for a StreamingHttpResponse. Exports
+include the cards' image URLs; imports ignore image columns, since images are uploads.
+"""
+
+import codecs
+import csv
+import itertools
+import json
+import logging
+
+from django.db import transaction
+
+from .models import Card
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values",
+    "json": "application/json",
+}
+EXTENSIONS = {".csv": "csv", ".tsv": "tsv", ".txt": "tsv", ".json": "json"}
+EXPORT_COLUMNS = ["term", "definition", "term_image", "definition_image"]
+IMPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+JSON_READ_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 20
+TERM_MAX_LENGTH = Card._meta.get_field("term").max_length
+
+
+class DeckFormatError(ValueError):
+    """The upload can't be parsed at all (as opposed to a bad row, which is skipped)."""
+
+
+def detect_format(filename, requested=None):
+    if requested:
+        if requested not in FORMATS:
+            raise DeckFormatError(f"Unsupported format {requested!r}; use one of {', '.join(FORMATS)}.")
+        return requested
+    for extension, fmt in EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    raise DeckFormatError("Can't tell the file's format from its name; pass ?type=csv, tsv or json.")
+
+
+def _text(uploaded_file):
+    # Decodes as it reads; utf-8-sig drops the BOM spreadsheet programs like to add
+    return codecs.getreader("utf-8-sig")(uploaded_file, errors="replace")
+
+
+def _delimited_rows(lines, delimiter, columns=None):
+    """Yields (line number, {"term", "definition"}) from csv.reader rows."""
+    reader = csv.reader(lines, delimiter=delimiter)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise DeckFormatError(f"line {reader.line_num}: {e}")
+        if not any(cell.strip() for cell in row):
+            continue
+        lowered = [cell.strip().lower() for cell in row]
+        if columns is None and "term" in lowered and "definition" in lowered:
+            columns = lowered # A header row
+            continue
+        if columns:
+            values = dict(zip(columns, row))
+            yield reader.line_num, {"term": values.get("term", ""), "definition": values.get("definition", "")}
+        else:
+            yield reader.line_num, {"term": row[0], "definition": row[1] if len(row) > 1 else ""}
+
+
+def _tsv_rows(text):
+    # Anki puts "#separator:tab", "#html:true", "#columns:..." lines before the notes
+    columns = None
+    header_lines = 0
+    lines = iter(text)
+    for line in lines:
+        if not line.startswith("#"):
+            break
+        header_lines += 1
+        key, _, value = line[1:].partition(":")
+        if key.strip().lower() == "columns":
+            columns = [name.strip().lower() for name in value.rstrip("\r\n").split("\t")]
+    else:
+        return # Nothing but header lines
+    for line_number, row in _delimited_rows(itertools.chain([line], lines), "\t", columns):
+        yield line_number + header_lines, row
+
+
+def _json_rows(text):
+    """Yields (item number, item) from a JSON array, decoding one item at a time."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    number = 0
+    eof = False
+    while True:
+        position = 0
+        while True:
+            # Skip whitespace and separators up to the next item
+            while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ",")):
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise DeckFormatError("A JSON deck must be an array of cards.")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise DeckFormatError(f"Invalid JSON after item {number}.")
+                break # The item continues in the next chunk
+            number += 1
+            if isinstance(item, dict):
+                yield number, {"term": item.get("term", ""), "definition": item.get("definition", "")}
+            else:
+                yield number, None
+        buffer = buffer[position:]
+        if eof:
+            raise DeckFormatError("The JSON array isn't closed.")
+        chunk = text.read(JSON_READ_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_rows(uploaded_file, fmt):
+    """Yields (line or item number, {"term", "definition"} or None for a malformed item)."""
+    text = _text(uploaded_file)
+    if fmt == "csv":
+        return _delimited_rows(text, ",")
+    if fmt == "tsv":
+        return _tsv_rows(text)
+    return _json_rows(text)
+
+
+def import_cards(card_set, rows):
+    """
+    Adds the rows to card_set in batches, in one transaction. Rows without a term or
+    definition, or with an over-long term, are skipped. Returns (created, skipped, errors),
+    errors being the first MAX_REPORTED_ERRORS problems, by line or item number.
+    """
+    created = skipped = 0
+    errors = []
+    batch = []
+
+    def skip(number, message):
+        nonlocal skipped
+        skipped += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": number, "error": message})
+
+    with transaction.atomic():
+        for number, row in rows:
+            if row is None:
+                skip(number, "Expected an object with term and definition.")
+                continue
+            term, definition = str(row["term"] or "").strip(), str(row["definition"] or "").strip()
+            if not term or not definition:
+                skip(number, "Term and definition are required.")
+                continue
+            if len(term) > TERM_MAX_LENGTH:
+                skip(number, f"Term is longer than {TERM_MAX_LENGTH} characters.")
+                continue
+            batch.append(Card(card_set=card_set, term=term, definition=definition))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                Card.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            Card.objects.bulk_create(batch)
+            created += len(batch)
+    logger.info(f"Imported {created} cards into set {card_set.id} ({skipped} skipped).")
+    return created, skipped, errors
+
+
+class _Echo:
+    """File-like object whose write() returns the text, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def _image_url(request, image):
+    return request.build_absolute_uri(image.url) if image else ""
+
+
+def export_chunks(queryset, fmt, request):
+    """Yields the deck as text, one card at a time."""
+    cards = queryset.only("id", *EXPORT_COLUMNS).order_by("id").iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if fmt == "json":
+        yield "["
+        for index, card in enumerate(cards):
+            yield ("," if index else "") + json.dumps({
+                "term": card.term,
+                "definition": card.definition,
+                "term_image": _image_url(request, card.term_image) or None,
+                "definition_image": _image_url(request, card.definition_image) or None,
+            }, ensure_ascii=False)
+        yield "]"
+        return
+
+    writer = csv.writer(_Echo(), delimiter="\t" if fmt == "tsv" else ",")
+    if fmt == "tsv":
+        yield "#separator:tab\n#html:false\n#columns:" + "\t".join(EXPORT_COLUMNS) + "\n"
+    else:
+        yield writer.writerow(EXPORT_COLUMNS)
+    for card in cards:
+        yield writer.writerow([
+            card.term, card.definition,
+            _image_url(request, card.term_image), _image_url(request, card.definition_image),
+        ])
@@ -0,0 +1,33 @@
+# base/elevenlabs.py
+"""
+ElevenLabs text-to-speech settings and request helpers, shared by the TTS views
+(base/views.py, base/async_views.py) and the background jobs (base/tasks.py).
+"""
+
+import os
+
+from .upstream import http_session
+
+# .env has been loaded by myproj/settings.py
+ELABS_API_KEY = os.getenv("ELABS_API_KEY")
+VOICE_ID = os.getenv("VOICE_ID")
+
+ELEVENLABS_TTS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_TIMEOUT = 20 # seconds
+TTS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.5}
+SLOW_TTS_VOICE_SETTINGS = {"stability": 0.3, "similarity_boost": 0.5, "style": 0.5, "use_speaker_boost": False, "speed": 0.7}
+
+
+def tts_request(text, voice_settings):
+    """Returns the (url, headers, json body) of an ElevenLabs text-to-speech call."""
+    url = ELEVENLABS_TTS_URL.format(voice_id=VOICE_ID)
+    headers = {"xi-api-key": ELABS_API_KEY, "Content-Type": "application/json", "Accept": "audio/mpeg"}
+    data = {"text": text, "model_id": TTS_MODEL_ID, "voice_settings": voice_settings}
+    return url, headers, data
+
+
+def open_stream(text, voice_settings):
+    """Starts a streamed text-to-speech call with the shared requests session."""
+    url, headers, data = tts_request(text, voice_settings)
+    return http_session().post(url, json=data, headers=headers, stream=True, timeout=TTS_TIMEOUT)
@@ -0,0 +1,537 @@
+# base/gemini.py
+"""
+Gemini API helpers used by the chat views.
+
+Every helper takes a prompt history, a list of dicts such as
+[{'role': 'user', 'parts': [{'text': 'Hello'}]}, {'role': 'model', 'parts': [{'text': 'Hi!'}]}]
+and never raises: upstream failures come back as a user-facing text reply.
+With settings.GEMINI_RESPONSE_CACHE_ENABLED, identical requests are answered from
+base/gemini_cache.py unless the caller passes use_cache=False.
+The sync helpers are used by the DRF views, the a-prefixed ones by base/async_views.py.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import gemini_cache
+from .circuit import HALF_OPEN, CircuitBreaker
+from .hedging import LatencyTracker, ahedged_call, hedged_call
+from .singleflight import asingle_flight, flight_key, single_flight
+from .upstream import ASYNC_HTTP_ERRORS, http_session, async_http_client
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") # .env has been loaded by myproj/settings.py
+EMPTY_REPLY_MESSAGE = "I received an empty response from the AI."
+
+# Use the v1beta endpoint for more features like system instructions if needed,
+# or v1 for general use. Flash is faster, Pro is more capable.
+GEMINI_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+GEMINI_API_URL = GEMINI_MODEL_URL.format(model="gemini-1.5-flash-latest")
+# GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-pro-latest:generateContent"
+# Slow calls are hedged to this endpoint (see base/hedging.py); None disables hedging.
+# Hedging to the primary's own model would only double the spend, so that is ignored.
+GEMINI_HEDGE_API_URL = (
+    GEMINI_MODEL_URL.format(model=settings.GEMINI_HEDGE_MODEL) if settings.GEMINI_HEDGE_MODEL else None
+)
+if GEMINI_HEDGE_API_URL == GEMINI_API_URL:
+    logger.warning("GEMINI_HEDGE_MODEL is the primary model; hedging is disabled.")
+    GEMINI_HEDGE_API_URL = None
+GEMINI_STREAM_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:streamGenerateContent"
+
+MAX_RETRIES = 3
+BASE_BACKOFF = 2  # seconds
+GEMINI_TIMEOUT = 45  # seconds, per attempt; all attempts share GEMINI_DEADLINE_SECONDS
+MIN_ATTEMPT_SECONDS = 2 # Don't start an attempt with less time than this left
+
+CIRCUIT_OPEN_MESSAGE = "The AI service is having trouble right now. Please try again in a minute."
+
+# Shared by all workers through the cache: after repeated upstream failures, chat
+# requests fail fast for a while instead of each waiting through timeouts and retries.
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=settings.GEMINI_CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=settings.GEMINI_CIRCUIT_RECOVERY_SECONDS,
+)
+
+gemini_latency = LatencyTracker(window=settings.GEMINI_HEDGE_WINDOW)
+
+RATE_LIMIT_MESSAGES = [
+    "You're going too fast! Try again in a few seconds.",
+    "Hold on! You're sending messages too quickly. Try again in 5-10 seconds.",
+    "Slow down! The AI needs a moment to respond properly.",
+]
+
+
+def _build_payload(prompt_history, generation_config=None):
+    payload = {
+        "contents": prompt_history,
+        # Optional: Add generationConfig for temperature, max tokens, etc.
+        # "generationConfig": {
+        #     "temperature": 0.7,
+        #     "topP": 1.0,
+        #     "maxOutputTokens": 2048,
+        # },
+        # Optional: Add safetySettings
+        # "safetySettings": [
+        #     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        #     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        #     # ... other settings
+        # ]
+    }
+    if generation_config:
+        # e.g. responseMimeType + responseSchema for structured output (see base/generation.py)
+        payload["generationConfig"] = generation_config
+    return payload
+
+
+def _text_from_response(data):
+    """
+    Turns a successful generateContent body into (text, ok). An empty, blocked or
+    unexpected reply gives a user-facing placeholder with ok False, so it isn't cached.
+    """
+    candidates = data.get("candidates", [])
+    if candidates and candidates[0].get("content") and candidates[0]["content"].get("parts"):
+        text_parts = candidates[0]["content"]["parts"]
+        # Concatenate if multiple parts, usually just one for text
+        full_text = "".join(part.get("text", "") for part in text_parts)
+        return (full_text, True) if full_text else (EMPTY_REPLY_MESSAGE, False)
+
+    # Check for blocked prompt
+    blocked = _blocked_prompt_message(data)
+    if blocked:
+        return blocked, False
+
+    logger.error(f"Unexpected Gemini API response structure: {data}")
+    return "I received an unexpected response from the AI.", False
+
+
+def _blocked_prompt_message(data):
+    prompt_feedback = data.get("promptFeedback")
+    if prompt_feedback and prompt_feedback.get("blockReason"):
+        reason = prompt_feedback["blockReason"]
+        details = prompt_feedback.get("safetyRatings")
+        logger.warning(f"Gemini API blocked prompt: {reason}. Details: {details}")
+        return f"My apologies, I cannot respond to that due to content restrictions ({reason})."
+    return None
+
+
+def _parse_stream_line(line):
+    """
+    Parses one line of an alt=sse stream. Returns (delta_text, final_text, finish_reason):
+    final_text is set when the stream should stop early, finish_reason on the last event.
+    """
+    # SSE frames look like "data: {...}"; blank lines separate events
+    if not line or not line.startswith("data:"):
+        return None, None, None
+    try:
+        data = json.loads(line[len("data:"):].strip())
+    except ValueError:
+        logger.error(f"Error parsing Gemini stream event: {line[:500]}")
+        return None, None, None
+
+    blocked = _blocked_prompt_message(data)
+    if blocked:
+        return None, blocked, None
+
+    candidates = data.get("candidates") or []
+    finish_reason = candidates[0].get("finishReason") if candidates else None
+    if candidates and candidates[0].get("content") and candidates[0]["content"].get("parts"):
+        return "".join(part.get("text", "") for part in candidates[0]["content"]["parts"]), None, finish_reason
+    return None, None, finish_reason
+
+
+def _retry_wait(attempt, status_code, headers):
+    wait_time = BASE_BACKOFF * (2 ** attempt)
+    if status_code == 429:
+        retry_after_str = headers.get("Retry-After")
+        if retry_after_str and retry_after_str.isdigit():
+            wait_time = max(wait_time, int(retry_after_str))
+    return wait_time
+
+
+def _error_reply(status_code):
+    if status_code == 429:
+        return random.choice(RATE_LIMIT_MESSAGES) # Or "AI service is currently busy."
+    return f"Sorry, I encountered an error trying to reach the AI service (Code: {status_code})."
+
+
+def _log_error_response(attempt, status_code, body):
+    if status_code == 429: # Rate limit / Quota exceeded
+        logger.warning(f"Gemini API quota hit (429) on attempt {attempt + 1}. Response: {body[:200]}")
+    else:
+        logger.error(f"Gemini API error {status_code} on attempt {attempt + 1}. Body: {body[:200]}")
+
+
+def _is_upstream_failure(status_code):
+    # Quota and server errors mean Gemini is struggling; other 4xx are problems with our request
+    return status_code == 429 or status_code >= 500
+
+
+def _attempt_timeout(deadline):
+    return max(MIN_ATTEMPT_SECONDS, min(GEMINI_TIMEOUT, deadline - time.monotonic()))
+
+
+def _time_left(attempt_end):
+    # Evaluated as each request starts, so a hedge sent later only gets what is left of the attempt
+    return max(0.1, attempt_end - time.monotonic())
+
+
+def _can_retry(attempt, deadline, wait_time):
+    # Only retry if the backoff plus a minimally useful attempt still fits in the deadline
+    return attempt < MAX_RETRIES - 1 and deadline - time.monotonic() - wait_time >= MIN_ATTEMPT_SECONDS
+
+
+def _flight_timeout():
+    # Covers the leader's whole retry budget, so waiters don't give up on a live call
+    return settings.GEMINI_DEADLINE_SECONDS + 5
+
+
+def _response_cache_key(payload, use_cache):
+    # The streaming endpoint runs the same model, so both kinds of call share entries
+    return gemini_cache.cache_key(GEMINI_API_URL, payload) if use_cache and gemini_cache.enabled() else None
+
+
+def _generate_and_cache(payload, api_key, cache_key):
+    text, ok = _generate_content_once(payload, api_key)
+    if ok and cache_key:
+        gemini_cache.put(cache_key, text)
+    return text, ok
+
+
+async def _agenerate_and_cache(payload, api_key, cache_key):
+    text, ok = await _agenerate_content_once(payload, api_key)
+    if ok and cache_key:
+        await sync_to_async(gemini_cache.put)(cache_key, text)
+    return text, ok
+
+
+def _generate_content(prompt_history, api_key, generation_config=None, use_cache=True):
+    """
+    Calls the Gemini API with a history of messages. Identical calls already in flight
+    (e.g. a double-clicked send) are coalesced onto one upstream request (base/singleflight.py),
+    and with the response cache on, repeats of an answered one are served from it.
+    use_cache=False skips the response cache and single-flight's recent results.
+    Returns (text, ok); when ok is False, text is a user-facing error reply.
+    """
+    payload = _build_payload(prompt_history, generation_config)
+    cache_key = _response_cache_key(payload, use_cache)
+    if cache_key:
+        cached = gemini_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+    return single_flight(
+        flight_key("gemini", [GEMINI_API_URL, payload]),
+        lambda: _generate_and_cache(payload, api_key, cache_key),
+        lock_timeout=_flight_timeout(),
+        reuse_result=use_cache, # A fresh request may join a call in flight, but not take a finished one
+    )
+
+
+async def _agenerate_content(prompt_history, api_key, generation_config=None, use_cache=True):
+    """Async twin of _generate_content."""
+    payload = _build_payload(prompt_history, generation_config)
+    cache_key = _response_cache_key(payload, use_cache)
+    if cache_key:
+        cached = await sync_to_async(gemini_cache.get)(cache_key)
+        if cached is not None:
+            return cached, True
+    return await asingle_flight(
+        flight_key("gemini", [GEMINI_API_URL, payload]),
+        lambda: _agenerate_and_cache(payload, api_key, cache_key),
+        lock_timeout=_flight_timeout(),
+        reuse_result=use_cache,
+    )
+
+
+def _generate_content_once(payload, api_key):
+    """
+    One logical Gemini call, hedging slow attempts to GEMINI_HEDGE_API_URL and retrying
+    network errors, 429s and other error statuses with exponential backoff. All attempts
+    and waits fit inside GEMINI_DEADLINE_SECONDS, and nothing is sent while gemini_breaker is open.
+    """
+    deadline = time.monotonic() + settings.GEMINI_DEADLINE_SECONDS
+
+    probe = False # Whether an attempt took the breaker's half-open probe slot
+    try:
+        for attempt in range(MAX_RETRIES):
+            allowed = gemini_breaker.allow_request()
+            if not allowed:
+                logger.warning("Gemini circuit is open; failing fast.")
+                return CIRCUIT_OPEN_MESSAGE, False
+            probe = probe or allowed == HALF_OPEN
+            attempt_end = time.monotonic() + _attempt_timeout(deadline)
+
+            def post(url):
+                return lambda: http_session().post(
+                    f"{url}?key={api_key}",
+                    headers={"Content-Type": "application/json"},
+                    json=payload,
+                    timeout=_time_left(attempt_end)
+                )
+
+            try:
+                resp = hedged_call(
+                    gemini_latency,
+                    post(GEMINI_API_URL),
+                    post(GEMINI_HEDGE_API_URL) if GEMINI_HEDGE_API_URL else None,
+                )
+            except requests.RequestException as e:
+                gemini_breaker.record_failure()
+                logger.error(f"Gemini API Network error on attempt {attempt + 1}: {e}")
+                wait_time = BASE_BACKOFF * (2 ** attempt)
+                if _can_retry(attempt, deadline, wait_time):
+                    time.sleep(wait_time)
+                    continue
+                return f"Sorry, I couldn't reach the AI service due to a network issue: {e}", False
+
+            if resp.status_code == 200:
+                gemini_breaker.record_success()
+                try:
+                    return _text_from_response(resp.json())
+                except (ValueError, KeyError, IndexError, TypeError) as e: # Added TypeError
+                    logger.error(f"Error parsing Gemini response: {e}. Response: {resp.text[:500]}")
+                    return "Sorry, I had trouble understanding the AI's response.", False
+
+            if _is_upstream_failure(resp.status_code):
+                gemini_breaker.record_failure()
+            elif allowed == HALF_OPEN:
+                gemini_breaker.release_probe() # Our own request was refused; the upstream is up
+            _log_error_response(attempt, resp.status_code, resp.text)
+            wait_time = _retry_wait(attempt, resp.status_code, resp.headers)
+            if _can_retry(attempt, deadline, wait_time):
+                logger.info(f"Retrying Gemini call after {wait_time} seconds.")
+                time.sleep(wait_time)
+                continue
+            return _error_reply(resp.status_code), False
+    finally:
+        if probe:
+            gemini_breaker.release_probe() # e.g. an exception recorded no outcome
+
+
+async def _agenerate_content_once(payload, api_key):
+    """
+    Async twin of _generate_content_once. Waits (including retry backoff)
+    yield to the event loop instead of holding a worker.
+    """
+    deadline = time.monotonic() + settings.GEMINI_DEADLINE_SECONDS
+    client = async_http_client()
+
+    probe = False # Whether an attempt took the breaker's half-open probe slot
+    try:
+        for attempt in range(MAX_RETRIES):
+            allowed = await sync_to_async(gemini_breaker.allow_request)()
+            if not allowed:
+                logger.warning("Gemini circuit is open; failing fast.")
+                return CIRCUIT_OPEN_MESSAGE, False
+            probe = probe or allowed == HALF_OPEN
+            attempt_end = time.monotonic() + _attempt_timeout(deadline)
+
+            def post(url):
+                return lambda: client.post(
+                    f"{url}?key={api_key}",
+                    headers={"Content-Type": "application/json"},
+                    json=payload,
+                    timeout=_time_left(attempt_end)
+                )
+
+            try:
+                resp = await ahedged_call(
+                    gemini_latency,
+                    post(GEMINI_API_URL),
+                    post(GEMINI_HEDGE_API_URL) if GEMINI_HEDGE_API_URL else None,
+                )
+            except ASYNC_HTTP_ERRORS as e:
+                await sync_to_async(gemini_breaker.record_failure)()
+                logger.error(f"Gemini API Network error on attempt {attempt + 1}: {e}")
+                wait_time = BASE_BACKOFF * (2 ** attempt)
+                if _can_retry(attempt, deadline, wait_time):
+                    await asyncio.sleep(wait_time)
+                    continue
+                return f"Sorry, I couldn't reach the AI service due to a network issue: {e}", False
+
+            if resp.status_code == 200:
+                await sync_to_async(gemini_breaker.record_success)()
+                try:
+                    return _text_from_response(resp.json())
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    logger.error(f"Error parsing Gemini response: {e}. Response: {resp.text[:500]}")
+                    return "Sorry, I had trouble understanding the AI's response.", False
+
+            if _is_upstream_failure(resp.status_code):
+                await sync_to_async(gemini_breaker.record_failure)()
+            elif allowed == HALF_OPEN:
+                await sync_to_async(gemini_breaker.release_probe)()
+            _log_error_response(attempt, resp.status_code, resp.text)
+            wait_time = _retry_wait(attempt, resp.status_code, resp.headers)
+            if _can_retry(attempt, deadline, wait_time):
+                logger.info(f"Retrying Gemini call after {wait_time} seconds.")
+                await asyncio.sleep(wait_time)
+                continue
+            return _error_reply(resp.status_code), False
+    finally:
+        if probe:
+            await sync_to_async(gemini_breaker.release_probe)()
+
+
+def _call_gemini_api_with_history(prompt_history, api_key, use_cache=True):
+    """
+    Returns the AI reply text for prompt_history (or a user-facing error message).
+    use_cache=False skips the response cache, for conversations that must stay fresh.
+    """
+    text, _ok = _generate_content(prompt_history, api_key, use_cache=use_cache)
+    return text
+
+
+async def _acall_gemini_api_with_history(prompt_history, api_key, use_cache=True):
+    """Async twin of _call_gemini_api_with_history."""
+    text, _ok = await _agenerate_content(prompt_history, api_key, use_cache=use_cache)
+    return text
+
+
+def _stream_gemini_api_with_history(prompt_history, api_key, use_cache=True):
+    """
+    Streams the Gemini reply for prompt_history, yielding text deltas as they arrive.
+    Uses streamGenerateContent with alt=sse, where every SSE event carries a partial
+    GenerateContentResponse. Errors are yielded as a single user-facing text chunk,
+    the same way _call_gemini_api_with_history returns them. A cached reply is yielded
+    whole, and a reply is cached only if Gemini finished it normally (finishReason STOP).
+    """
+    payload = _build_payload(prompt_history)
+    cache_key = _response_cache_key(payload, use_cache)
+    if cache_key:
+        cached = gemini_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    allowed = gemini_breaker.allow_request()
+    if not allowed:
+        logger.warning("Gemini circuit is open; failing fast.")
+        yield CIRCUIT_OPEN_MESSAGE
+        return
+    probe = allowed == HALF_OPEN
+    try:
+        resp = http_session().post(
+            f"{GEMINI_STREAM_API_URL}?alt=sse&key={api_key}",
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            stream=True,
+            timeout=GEMINI_TIMEOUT
+        )
+    except requests.RequestException as e:
+        gemini_breaker.record_failure()
+        logger.error(f"Gemini streaming API network error: {e}")
+        yield f"Sorry, I couldn't reach the AI service due to a network issue: {e}"
+        return
+    except BaseException:
+        if probe:
+            gemini_breaker.release_probe()
+        raise
+
+    try:
+        if resp.status_code != 200:
+            if _is_upstream_failure(resp.status_code):
+                gemini_breaker.record_failure()
+            elif probe:
+                gemini_breaker.release_probe() # Our own request was refused; the upstream is up
+            _log_error_response(0, resp.status_code, resp.text)
+            yield _error_reply(resp.status_code)
+            return
+        gemini_breaker.record_success()
+
+        deltas, finish_reason = [], None
+        for line in resp.iter_lines(decode_unicode=True):
+            delta, final_text, reason = _parse_stream_line(line)
+            finish_reason = reason or finish_reason
+            if final_text:
+                yield final_text
+                return
+            if delta:
+                deltas.append(delta)
+                yield delta
+
+        if not deltas:
+            yield EMPTY_REPLY_MESSAGE
+        elif cache_key and finish_reason == "STOP": # Not a reply cut short (length, safety, a dropped stream)
+            gemini_cache.put(cache_key, "".join(deltas))
+    except requests.RequestException as e:
+        logger.error(f"Gemini streaming API connection dropped: {e}")
+        yield "\n\n[The connection to the AI service was interrupted.]"
+    finally:
+        resp.close()
+
+
+async def _astream_gemini_api_with_history(prompt_history, api_key, use_cache=True):
+    """Async twin of _stream_gemini_api_with_history."""
+    payload = _build_payload(prompt_history)
+    cache_key = _response_cache_key(payload, use_cache)
+    if cache_key:
+        cached = await sync_to_async(gemini_cache.get)(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    allowed = await sync_to_async(gemini_breaker.allow_request)()
+    if not allowed:
+        logger.warning("Gemini circuit is open; failing fast.")
+        yield CIRCUIT_OPEN_MESSAGE
+        return
+    probe = allowed == HALF_OPEN
+    client = async_http_client()
+    request = client.build_request(
+        "POST",
+        f"{GEMINI_STREAM_API_URL}?alt=sse&key={api_key}",
+        headers={"Content-Type": "application/json"},
+        json=payload,
+    )
+    try:
+        resp = await client.send(request, stream=True, timeout=GEMINI_TIMEOUT)
+    except ASYNC_HTTP_ERRORS as e:
+        await sync_to_async(gemini_breaker.record_failure)()
+        logger.error(f"Gemini streaming API network error: {e}")
+        yield f"Sorry, I couldn't reach the AI service due to a network issue: {e}"
+        return
+    except BaseException:
+        if probe:
+            await sync_to_async(gemini_breaker.release_probe)()
+        raise
+
+    try:
+        if resp.status_code != 200:
+            if _is_upstream_failure(resp.status_code):
+                await sync_to_async(gemini_breaker.record_failure)()
+            elif probe:
+                await sync_to_async(gemini_breaker.release_probe)()
+            body = (await resp.aread()).decode("utf-8", "replace")
+            _log_error_response(0, resp.status_code, body)
+            yield _error_reply(resp.status_code)
+            return
+        await sync_to_async(gemini_breaker.record_success)()
+
+        deltas, finish_reason = [], None
+        async for line in resp.aiter_lines():
+            delta, final_text, reason = _parse_stream_line(line.rstrip("\r\n"))
+            finish_reason = reason or finish_reason
+            if final_text:
+                yield final_text
+                return
+            if delta:
+                deltas.append(delta)
+                yield delta
+
+        if not deltas:
+            yield EMPTY_REPLY_MESSAGE
+        elif cache_key and finish_reason == "STOP": # Not a reply cut short (length, safety, a dropped stream)
+            await sync_to_async(gemini_cache.put)(cache_key, "".join(deltas))
+    except ASYNC_HTTP_ERRORS as e:
+        logger.error(f"Gemini streaming API connection dropped: {e}")
+        yield "\n\n[The connection to the AI service was interrupted.]"
+    finally:
+        await resp.aclose()
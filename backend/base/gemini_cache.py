@@ -0,0 +1,184 @@
+# base/gemini_cache.py
+"""
+Opt-in cache of Gemini replies (settings.GEMINI_RESPONSE_CACHE_ENABLED).
+
+Many chats open with the same "explain this term" question about a shared card, and each
+one is a paid generateContent call. With the cache on, _generate_content (base/gemini.py)
+answers an identical request from a GeminiCacheEntry row instead, in one indexed query.
+
+    key     sha256 of the request payload (prompt history and generation config) with
+            each text part normalized (NFC, whitespace collapsed), plus the model URL
+    TTL     each entry expires GEMINI_RESPONSE_CACHE_TTL seconds after it was stored
+            (or after the ttl passed to put())
+    size    once the replies total more than GEMINI_RESPONSE_CACHE_MAX_BYTES, expired
+            entries and then the least recently used ones are deleted. The total is kept
+            as a running shared counter (TOTAL_BYTES_KEY), so storing a reply doesn't sum
+            the table; eviction re-syncs it
+
+Only successful replies are stored. Hits and misses are tallied in the process and added
+to the shared counters at most every STATS_FLUSH_INTERVAL seconds (see stats()), so a
+chat turn doesn't write the same counter row as every other turn. Callers pass use_cache=False for conversations that must stay fresh.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .counters import counters
+from .models import GeminiCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Don't write last_accessed_at on every hit of a hot prompt; LRU only needs rough order
+TOUCH_INTERVAL = timedelta(minutes=1)
+# Evict down to this fraction of the limit so we don't evict again on the next insert
+EVICT_LOW_WATER = 0.9
+HITS_KEY = "gemini_cache:hits"
+MISSES_KEY = "gemini_cache:misses"
+TOTAL_BYTES_KEY = "gemini_cache:bytes"
+STATS_FLUSH_INTERVAL = 30 # seconds; a crashed worker loses at most this much of its tally
+
+_pending = {HITS_KEY: 0, MISSES_KEY: 0}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def enabled():
+    return settings.GEMINI_RESPONSE_CACHE_ENABLED
+
+
+def _normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _normalize(value):
+    # Text parts are normalized wherever they appear; everything else is kept as is
+    if isinstance(value, dict):
+        return {
+            name: _normalize_text(item) if name == "text" and isinstance(item, str) else _normalize(item)
+            for name, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def cache_key(url, payload):
+    material = json.dumps([url, _normalize(payload)], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _count(counter_key):
+    global _last_flush
+    with _pending_lock:
+        _pending[counter_key] += 1
+        due = time.monotonic() - _last_flush >= STATS_FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Adds this process's pending hit and miss tallies to the shared counters."""
+    with _pending_lock:
+        tallies = {counter_key: count for counter_key, count in _pending.items() if count}
+        for counter_key in tallies:
+            _pending[counter_key] = 0
+    for counter_key, count in tallies.items():
+        try:
+            counters().incr(counter_key, count)
+        except Exception as e:
+            # Stats are best effort; put the tally back for the next flush
+            logger.warning(f"Could not flush Gemini cache stats: {e}")
+            with _pending_lock:
+                _pending[counter_key] += count
+
+
+def get(key):
+    """Returns the cached reply for key and marks it as used, or None (counting a hit or miss)."""
+    now = timezone.now()
+    entry = GeminiCacheEntry.objects.filter(key=key, expires_at__gt=now).only("response", "last_accessed_at").first()
+    if entry is None:
+        _count(MISSES_KEY)
+        return None
+    _count(HITS_KEY)
+    if entry.last_accessed_at < now - TOUCH_INTERVAL:
+        GeminiCacheEntry.objects.filter(pk=entry.pk).update(last_accessed_at=now)
+    return entry.response
+
+
+def put(key, response, ttl=None):
+    """Stores response for key for ttl seconds (default GEMINI_RESPONSE_CACHE_TTL), then evicts if over the limit."""
+    now = timezone.now()
+    size = len(response.encode("utf-8"))
+    previous = GeminiCacheEntry.objects.filter(key=key).values_list("size", flat=True).first() or 0
+    GeminiCacheEntry.objects.update_or_create(key=key, defaults={
+        "response": response,
+        "size": size,
+        "expires_at": now + timedelta(seconds=ttl or settings.GEMINI_RESPONSE_CACHE_TTL),
+        "last_accessed_at": now,
+    })
+    if _running_total(size - previous) > settings.GEMINI_RESPONSE_CACHE_MAX_BYTES:
+        evict()
+
+
+def _running_total(delta):
+    """Adds delta to the shared byte total and returns it, seeding it from the table if unset."""
+    total = counters().get(TOTAL_BYTES_KEY)
+    if not total:
+        # First store since the counter was created or lost; the table already includes delta
+        actual = GeminiCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+        if counters().compare_and_set(TOTAL_BYTES_KEY, None, actual):
+            return actual
+    return counters().incr(TOTAL_BYTES_KEY, delta)
+
+
+def _sync_total(actual):
+    # Other workers may have moved the counter meanwhile; close enough, the next eviction re-syncs
+    counters().incr(TOTAL_BYTES_KEY, actual - counters().get(TOTAL_BYTES_KEY))
+
+
+def evict():
+    total = GeminiCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+    if total <= settings.GEMINI_RESPONSE_CACHE_MAX_BYTES:
+        _sync_total(total)
+        return
+    expired, _ = GeminiCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    if expired:
+        total = GeminiCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+    target = settings.GEMINI_RESPONSE_CACHE_MAX_BYTES * EVICT_LOW_WATER
+    doomed = []
+    for entry_id, size in GeminiCacheEntry.objects.order_by("last_accessed_at").values_list("id", "size").iterator():
+        if total <= target:
+            break
+        doomed.append(entry_id)
+        total -= size
+    GeminiCacheEntry.objects.filter(id__in=doomed).delete()
+    _sync_total(total)
+    logger.info(f"Evicted {expired} expired and {len(doomed)} LRU Gemini cache entries, cache is now {total} bytes.")
+
+
+def stats():
+    """
+    Hits, misses and current size of the cache, e.g. for `manage.py shell` or a dashboard.
+    Other workers' tallies show up once they flush (within STATS_FLUSH_INTERVAL).
+    """
+    flush_stats()
+    hits, misses = counters().get(HITS_KEY), counters().get(MISSES_KEY)
+    size = GeminiCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+        "entries": GeminiCacheEntry.objects.count(),
+        "bytes": size,
+    }
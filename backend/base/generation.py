@@ -0,0 +1,174 @@
+# base/generation.py
+"""
+AI flashcard generation from pasted notes (POST /api/cardsets/<pk>/generate/).
+
+One Gemini call returns a whole batch of cards: the request uses structured output
+(responseMimeType application/json with a responseSchema), so the reply is a JSON array
+of {"term", "definition"} objects rather than prose. Notes longer than CHUNK_CHARS are
+split at paragraph boundaries and the chunks are sent concurrently (at most
+settings.CARD_GENERATION_CONCURRENCY at once), each asked for its share of the cards.
+
+Cards are validated with CardSerializer, and terms the set already has (or that repeat
+within the batch) are dropped, so running a generation twice doesn't duplicate the deck.
+Everything that survives is saved with one bulk_create in one transaction.
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .gemini import _generate_content
+from .models import Card
+from .serializers import CardSerializer
+from .versions import bump
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CHARS = 12000 # notes sent per Gemini call
+MAX_REPORTED_ERRORS = 20
+GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {"term": {"type": "STRING"}, "definition": {"type": "STRING"}},
+            "required": ["term", "definition"],
+        },
+    },
+    "temperature": 0.4,
+}
+PROMPT = (
+    "Create {count} flashcards from the notes below for a deck called \"{name}\". "
+    "Each card has a short term (a word, phrase or question) and a concise definition "
+    "(the meaning or answer). Cover the most important facts, don't repeat a term, and "
+    "write in the language of the notes.\n\nNotes:\n{notes}"
+)
+
+
+class GenerationFailed(Exception):
+    """No chunk of the notes produced any cards; the message is user-facing."""
+
+
+def split_notes(notes, limit=CHUNK_CHARS):
+    """Splits notes into chunks of at most limit characters, at blank lines where possible."""
+    chunks, current = [], ""
+    for paragraph in notes.split("\n\n"):
+        while len(paragraph) > limit: # A single huge paragraph: cut it at whitespace
+            cut = paragraph.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        if current and len(current) + 2 + len(paragraph) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _shares(chunks, count):
+    """Cards to ask for per chunk, in proportion to its length (at least one each)."""
+    total = sum(len(chunk) for chunk in chunks)
+    return [max(1, round(count * len(chunk) / total)) for chunk in chunks]
+
+
+def _parse_cards(text):
+    # Structured output is plain JSON, but tolerate a ```json fence around it anyway
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("cards", [])
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of cards.")
+    return data
+
+
+def _generate_chunk(api_key, name, notes, count):
+    """One Gemini call. Returns (card dicts, None) or ([], user-facing error)."""
+    prompt_history = [{"role": "user", "parts": [{"text": PROMPT.format(count=count, name=name, notes=notes)}]}]
+    # Not cached: generating from the same notes again should be able to give new cards
+    text, ok = _generate_content(prompt_history, api_key, GENERATION_CONFIG, use_cache=False)
+    if not ok:
+        return [], text
+    try:
+        return _parse_cards(text), None
+    except ValueError as e:
+        logger.error(f"Gemini returned unusable flashcard JSON: {e}")
+        return [], "Sorry, I had trouble understanding the AI's response."
+
+
+def _generate_chunk_in_thread(*args):
+    try:
+        return _generate_chunk(*args)
+    finally:
+        connections.close_all() # This thread's own connections (the breaker and single-flight use the DB)
+
+
+def _generate_all(api_key, card_set, chunks, count, on_progress):
+    results = [None] * len(chunks)
+    shares = _shares(chunks, count)
+    if len(chunks) == 1:
+        results[0] = _generate_chunk(api_key, card_set.name, chunks[0], shares[0])
+        on_progress(1, 1)
+        return results
+    with ThreadPoolExecutor(max_workers=min(len(chunks), settings.CARD_GENERATION_CONCURRENCY)) as executor:
+        futures = {
+            executor.submit(_generate_chunk_in_thread, api_key, card_set.name, chunk, share): index
+            for index, (chunk, share) in enumerate(zip(chunks, shares))
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            on_progress(done, len(chunks))
+    return results
+
+
+def generate_cards(card_set, notes, count, api_key, on_progress=lambda done, total: None):
+    """
+    Generates up to count cards from notes into card_set. Returns (created cards, skipped,
+    errors), errors being problems with single cards or chunks. Raises GenerationFailed
+    if no chunk succeeded. on_progress(done, total) is called as each chunk finishes.
+    """
+    chunks = split_notes(notes)
+    if not chunks:
+        raise GenerationFailed("There are no notes to generate cards from.")
+    results = _generate_all(api_key, card_set, chunks, count, on_progress)
+
+    chunk_errors = [error for _, error in results if error]
+    if len(chunk_errors) == len(chunks):
+        raise GenerationFailed(chunk_errors[0])
+
+    seen = {term.casefold() for term in card_set.cards.values_list("term", flat=True)}
+    cards, skipped, errors = [], 0, [{"chunk": index, "error": error} for index, (_, error) in enumerate(results) if error]
+    for item in (item for items, _ in results for item in items):
+        if len(cards) >= count:
+            break
+        # Only term and definition are validated (partial), so no set is looked up per card
+        fields = {key: item[key] for key in ("term", "definition") if key in item} if isinstance(item, dict) else {}
+        serializer = CardSerializer(data=fields, partial=True)
+        if not serializer.is_valid() or not {"term", "definition"} <= serializer.validated_data.keys():
+            skipped += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"card": item, "error": serializer.errors or "Term and definition are required."})
+            continue
+        term = serializer.validated_data["term"].strip()
+        if term.casefold() in seen:
+            skipped += 1
+            continue
+        seen.add(term.casefold())
+        cards.append(Card(card_set=card_set, term=term, definition=serializer.validated_data["definition"].strip()))
+
+    with transaction.atomic():
+        Card.objects.bulk_create(cards)
+    bump(card_set.user_id, "cards")
+    logger.info(f"Generated {len(cards)} cards for set {card_set.id} in {len(chunks)} call(s) ({skipped} skipped).")
+    return cards, skipped, errors
@@ -0,0 +1,166 @@
+# base/hedging.py
+"""
+Hedged requests to cut tail latency on upstream calls.
+
+The primary request is sent as usual. If it hasn't answered within the hedge delay, a
+second request goes to an alternate endpoint and whichever returns a usable (200)
+response first wins; the other is cancelled (async) or discarded (sync, where requests
+can't interrupt an in-flight call: it is cancelled if it hasn't started, else its response
+is closed as soon as it returns, so its connection isn't held).
+
+The hedge delay is the recent p95 latency of the primary, so only the slowest ~5% of calls
+are duplicated and the delay follows the upstream as it speeds up or slows down.
+Latency samples and win counts are kept per worker process; that is plenty to estimate a
+percentile and avoids a cache round trip on every call.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+class LatencyTracker:
+    """Rolling window of primary latencies and a tally of which request won."""
+
+    def __init__(self, window):
+        self._samples = deque(maxlen=window)
+        self._wins = {PRIMARY: 0, HEDGE: 0}
+        self._lock = threading.Lock()
+
+    def record(self, latency, winner):
+        # When the hedge wins, the primary's latency is only known to be at least this
+        # long; recording the lower bound keeps the percentile from drifting down.
+        with self._lock:
+            self._samples.append(latency)
+            self._wins[winner] += 1
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < settings.GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, math.ceil(pct / 100 * len(samples)) - 1)
+        return samples[index]
+
+    def hedge_delay(self):
+        observed = self.percentile(settings.GEMINI_HEDGE_PERCENTILE)
+        if observed is None:
+            return settings.GEMINI_HEDGE_INITIAL_DELAY
+        return min(settings.GEMINI_HEDGE_MAX_DELAY, max(settings.GEMINI_HEDGE_MIN_DELAY, observed))
+
+    def stats(self):
+        with self._lock:
+            return {"samples": len(self._samples), "wins": dict(self._wins)}
+
+
+def _succeeded(future):
+    # Only fast successes feed the latency window; quick 429s would drag the p95 down
+    return future.exception() is None and future.result().status_code == 200
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _hedge_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.UPSTREAM_KEEPALIVE_CONNECTIONS,
+                    thread_name_prefix="hedge",
+                )
+    return _executor
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _discard(future):
+    if not future.cancel():
+        future.add_done_callback(_close_response) # Runs right away if it has already finished
+
+
+def hedged_call(tracker, primary, hedge):
+    """
+    Runs primary(); if it is still pending after the hedge delay, also runs hedge().
+    Both are zero-argument callables returning a response with a status_code. Returns
+    the first 200 response, or the primary's outcome if neither succeeds. Exceptions
+    from the chosen call are re-raised.
+    """
+    if hedge is None:
+        return primary()
+
+    started = time.monotonic()
+    executor = _hedge_executor()
+    primary_future = executor.submit(primary)
+    done, _ = wait([primary_future], timeout=tracker.hedge_delay())
+    if done:
+        if _succeeded(primary_future):
+            tracker.record(time.monotonic() - started, PRIMARY)
+        return primary_future.result()
+
+    logger.info(f"Primary upstream call still pending after {time.monotonic() - started:.2f}s; sending hedge.")
+    hedge_future = executor.submit(hedge)
+    labels = {primary_future: PRIMARY, hedge_future: HEDGE}
+    pending = set(labels)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if _succeeded(future):
+                winner = labels[future]
+                tracker.record(time.monotonic() - started, winner)
+                logger.info(f"Hedged upstream call won by {winner}. Totals: {tracker.stats()['wins']}")
+                for other in labels.keys() - {future}:
+                    _discard(other)
+                return future.result()
+    _discard(hedge_future) # Neither succeeded; the primary's outcome is reported
+    return primary_future.result()
+
+
+async def ahedged_call(tracker, primary, hedge):
+    """Async twin of hedged_call; primary and hedge return awaitables, and the loser is cancelled."""
+    if hedge is None:
+        return await primary()
+
+    started = time.monotonic()
+    primary_task = asyncio.ensure_future(primary())
+    tasks = {primary_task: PRIMARY}
+    try:
+        done, _ = await asyncio.wait([primary_task], timeout=tracker.hedge_delay())
+        if done:
+            if _succeeded(primary_task):
+                tracker.record(time.monotonic() - started, PRIMARY)
+            return primary_task.result()
+
+        logger.info(f"Primary upstream call still pending after {time.monotonic() - started:.2f}s; sending hedge.")
+        tasks[asyncio.ensure_future(hedge())] = HEDGE
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if _succeeded(task):
+                    winner = tasks[task]
+                    tracker.record(time.monotonic() - started, winner)
+                    logger.info(f"Hedged upstream call won by {winner}. Totals: {tracker.stats()['wins']}")
+                    return task.result()
+        return primary_task.result()
+    finally:
+        # Also runs if our caller is cancelled, so no request is left running unowned
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,248 @@
+# base/idempotency.py
+"""
+Idempotency-Key support for the chat message and TTS POSTs.
+
+Clients that retry a POST on a flaky network send the same Idempotency-Key header each
+time. The first request with a key claims an IdempotencyRecord (unique per user and key)
+and runs; its response is stored when it completes, and retries get that stored response
+back, marked with Idempotent-Replayed: true, instead of saving messages and calling the
+upstream again. A retry that arrives while the first request is still running waits for
+it, polling the record every POLL_INTERVAL, and replays its response once stored (or runs
+itself if the original released the key). If the original is still running after
+IDEMPOTENCY_WAIT_SECONDS, the retry gets 409 with Retry-After.
+
+Only outcomes worth replaying are stored: successes and client errors. On 429 / 5xx, or if
+a streamed response is cut off, the record is released so the next retry runs for real.
+Audio is not stored either: it is already in the TTS cache (base/tts_cache.py), so a retry
+that runs again is served from there. Records expire after IDEMPOTENCY_TTL_SECONDS.
+
+DRF view methods use the @idempotent decorator; the async views call abegin() and
+finish() around their body themselves, since they authenticate inside the view.
+"""
+
+import functools
+import hashlib
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+RETRY_AFTER = 2 # seconds; the Retry-After of a 409 while the original is still running
+POLL_INTERVAL = 0.25 # seconds between checks of the record while waiting on the original
+# Requests still "in progress" after this long are assumed to have died with their worker
+ABANDONED_AFTER = timedelta(minutes=5)
+
+
+def _fingerprint(request, data):
+    material = json.dumps(
+        [request.method, request.get_full_path(), data], sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _replay(record):
+    response = HttpResponse(record.body, status=record.status_code, content_type=record.content_type)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _claim(user, key, fingerprint):
+    """
+    Returns (record, response): our new in-progress record, or a response to send
+    instead (a replay or an error). (None, None) means the original is still running.
+    """
+    now = timezone.now()
+    # Expired records no longer protect their key; abandoned ones are taken over
+    IdempotencyRecord.objects.filter(user=user, key=key, created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)).delete()
+    IdempotencyRecord.objects.filter(user=user, key=key, status_code__isnull=True, created_at__lt=now - ABANDONED_AFTER).delete()
+    try:
+        # In a savepoint, so a duplicate key doesn't break an enclosing transaction
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(user=user, key=key, fingerprint=fingerprint), None
+    except IntegrityError:
+        pass
+
+    existing = IdempotencyRecord.objects.filter(user=user, key=key).first()
+    if existing is None:
+        return _claim(user, key, fingerprint) # Released between our insert and this read
+    if existing.fingerprint != fingerprint:
+        return None, JsonResponse(
+            {"error": "This Idempotency-Key was already used for a different request."}, status=422
+        )
+    if existing.status_code is not None:
+        logger.info(f"Replaying stored response for Idempotency-Key {key} (user {user.id}).")
+        return None, _replay(existing)
+    return None, None
+
+
+def _still_running():
+    response = JsonResponse(
+        {"error": "A request with this Idempotency-Key is still being processed. Retry shortly."}, status=409
+    )
+    response["Retry-After"] = str(RETRY_AFTER)
+    return response
+
+
+def _key(request):
+    key = request.headers.get("Idempotency-Key", "").strip()
+    return key or None
+
+
+def _invalid_key():
+    return JsonResponse({"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters."}, status=400)
+
+
+def begin(request, user, data):
+    """
+    Returns (record, replay). replay is a response to return as-is (stored response,
+    or an error); otherwise pass record to finish(). Both are None without the header.
+    Waits up to IDEMPOTENCY_WAIT_SECONDS for a request with the same key that is in flight.
+    """
+    key = _key(request)
+    if key is None:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        return None, _invalid_key()
+    fingerprint = _fingerprint(request, data)
+    give_up_at = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    record, response = _claim(user, key, fingerprint)
+    while record is None and response is None:
+        if time.monotonic() >= give_up_at:
+            return None, _still_running()
+        time.sleep(POLL_INTERVAL)
+        record, response = _claim(user, key, fingerprint)
+    return record, response
+
+
+async def abegin(request, user, data):
+    """Async twin of begin()."""
+    key = _key(request)
+    if key is None:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        return None, _invalid_key()
+    fingerprint = _fingerprint(request, data)
+    give_up_at = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    record, response = await sync_to_async(_claim)(user, key, fingerprint)
+    while record is None and response is None:
+        if time.monotonic() >= give_up_at:
+            return None, _still_running()
+        await asyncio.sleep(POLL_INTERVAL)
+        record, response = await sync_to_async(_claim)(user, key, fingerprint)
+    return record, response
+
+
+def _should_store(status_code):
+    # 206 bodies are only part of the resource, so those aren't replayed either
+    return status_code < 500 and status_code not in (206, 429)
+
+
+def _cache_backed(response):
+    # Cached clips are served from files; fresh audio is written to the TTS cache as it streams
+    return (
+        isinstance(response, FileResponse)
+        or response.get("X-TTS-Cache") == "HIT"
+        or (settings.TTS_CACHE_ENABLED and response.get("Content-Type", "").startswith("audio/"))
+    )
+
+
+def _store(record, status_code, content_type, body):
+    if len(body) > settings.IDEMPOTENCY_MAX_BODY_BYTES:
+        logger.info(f"Response for Idempotency-Key {record.key} is too large to store; releasing the key.")
+        release(record)
+        return
+    IdempotencyRecord.objects.filter(pk=record.pk).update(
+        status_code=status_code, content_type=content_type, body=body
+    )
+
+
+def release(record):
+    """Forgets record so the next request with its key runs for real."""
+    IdempotencyRecord.objects.filter(pk=record.pk).delete()
+
+
+def finish(record, response):
+    """Stores response for replay (once it is complete, for streams) and returns it."""
+    if record is None:
+        return response
+    if not _should_store(response.status_code):
+        release(record)
+        return response
+
+    content_type = response.get("Content-Type", "")
+    # Audio isn't stored; its key is freed once it has been sent, and a retry then runs against the cache
+    store = not _cache_backed(response)
+    if response.streaming:
+        capture = _acapture if response.is_async else _capture
+        response.streaming_content = capture(record, response.status_code, content_type, response.streaming_content, store)
+    elif not store:
+        release(record)
+    elif hasattr(response, "add_post_render_callback") and not response.is_rendered:
+        # DRF Responses are rendered after the view returns
+        response.add_post_render_callback(
+            lambda rendered: _store(record, rendered.status_code, rendered.get("Content-Type", ""), rendered.content)
+        )
+    else:
+        _store(record, response.status_code, content_type, response.content)
+    return response
+
+
+def _capture(record, status_code, content_type, chunks, store=True):
+    body = []
+    completed = False
+    try:
+        for chunk in chunks:
+            if store:
+                body.append(bytes(chunk))
+            yield chunk
+        completed = True
+    finally:
+        if completed and store:
+            _store(record, status_code, content_type, b"".join(body))
+        else:
+            release(record)
+
+
+async def _acapture(record, status_code, content_type, chunks, store=True):
+    body = []
+    completed = False
+    try:
+        async for chunk in chunks:
+            if store:
+                body.append(bytes(chunk))
+            yield chunk
+        completed = True
+    finally:
+        if completed and store:
+            await sync_to_async(_store)(record, status_code, content_type, b"".join(body))
+        else:
+            await sync_to_async(release)(record)
+
+
+def idempotent(view_method):
+    """Decorator for DRF APIView methods: replays or stores responses by Idempotency-Key."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        record, replay = begin(request, request.user, request.data)
+        if replay is not None:
+            return replay
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            if record is not None:
+                release(record) # Let a retry run instead of waiting on a request that died
+            raise
+        return finish(record, response)
+    return wrapper
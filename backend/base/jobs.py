@@ -0,0 +1,225 @@
+# base/jobs.py
+"""
+Database-backed job queue for slow AI and TTS work.
+
+Views enqueue() a Job and answer 202 Accepted with its id; clients poll
+GET /api/jobs/<id>/ for the status, progress and result. `manage.py run_jobs` runs the
+jobs with the handlers registered here by @handler (see base/tasks.py). Only the
+existing database (and the shared counters) is needed, so it runs on a single box.
+
+Each kind of job is configured in settings.JOB_TYPES:
+
+    "chat_reply": {"concurrency": 4, "max_attempts": 3, "timeout": 120}
+
+    concurrency   at most this many run at once, across all workers (a slot in the
+                  shared counters is taken for each running job)
+    max_attempts  a failing job is retried this many times in all, with exponential
+                  backoff (JOB_RETRY_BASE_DELAY doubling, capped at JOB_RETRY_MAX_DELAY)
+    timeout       the job's lease: if its worker dies, another worker picks the job up
+                  once the lease runs out, so handlers should be safe to run again.
+                  Handlers that may run longer renew it with heartbeat() (set_progress()
+                  renews it too, as does record())
+
+Enqueueing is a single INSERT and never waits on the workers. If a user already has
+JOB_MAX_PENDING_PER_USER jobs waiting, enqueue() raises QueueFull instead, so a backlog
+can't grow without bound.
+"""
+
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .counters import counters
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+CLAIM_BATCH = 20 # candidates looked at per claim attempt
+_handlers = {}
+
+
+class QueueFull(Exception):
+    """The user has too many jobs waiting to add another."""
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying won't help; the job fails straight away."""
+
+
+def handler(kind):
+    """Registers the decorated function(job) -> result (JSON-serializable) for kind."""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def _config(kind):
+    return {"concurrency": 1, "max_attempts": 3, "timeout": 120, **settings.JOB_TYPES.get(kind, {})}
+
+
+def enqueue(user, kind, payload):
+    if kind not in settings.JOB_TYPES:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    pending = Job.objects.filter(user=user, status__in=[Job.QUEUED, Job.RUNNING]).count()
+    if pending >= settings.JOB_MAX_PENDING_PER_USER:
+        raise QueueFull(f"User {user.id} already has {pending} jobs pending.")
+    job = Job.objects.create(user=user, kind=kind, payload=payload)
+    logger.info(f"Queued {job}.")
+    return job
+
+
+def _renew(job, **fields):
+    """Extends the job's lease (and its concurrency slot) while we still hold it; returns False if not."""
+    timeout = _config(job.kind)["timeout"]
+    renewed = Job.objects.filter(pk=job.pk, status=Job.RUNNING, lease_token=job.lease_token).update(
+        leased_until=timezone.now() + timedelta(seconds=timeout), **fields
+    )
+    if renewed and getattr(job, "slot", None) is not None:
+        counters().compare_and_set(_slot_key(job.kind, job.slot), job.id, job.id, ttl=timeout)
+    if not renewed:
+        logger.warning(f"{job} lost its lease; another worker may have taken it over.")
+    return bool(renewed)
+
+
+def heartbeat(job):
+    """
+    For handlers that may outlive the kind's timeout: renews the lease for another
+    timeout. Returns False if the lease was lost, in which case the handler should stop.
+    """
+    return _renew(job)
+
+
+def record(job, **values):
+    """
+    For handlers: adds values to the job's payload, so a later attempt can see what an
+    earlier one already did (and renews the lease). Returns False if the lease was lost.
+    """
+    job.payload = {**job.payload, **values}
+    return _renew(job, payload=job.payload)
+
+
+def set_progress(job, done, total):
+    """For handlers: reports how far along the job is (and renews the lease, like heartbeat())."""
+    job.progress = {"done": done, "total": total}
+    return _renew(job, progress=job.progress)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# --- Concurrency slots: counters that exist while a job of that kind holds them ---
+
+def _slot_key(kind, index):
+    return f"jobslot:{kind}:{index}"
+
+
+def _acquire_slot(kind, job_id):
+    config = _config(kind)
+    for index in range(config["concurrency"]):
+        # Expires with the lease, so a dead worker's slot frees itself
+        if counters().compare_and_set(_slot_key(kind, index), None, job_id, ttl=config["timeout"]):
+            return index
+    return None
+
+
+def _release_slot(kind, index, job_id):
+    key = _slot_key(kind, index)
+    # Unless the slot expired and went to another job meanwhile
+    if counters().get(key) == job_id:
+        counters().delete(key)
+
+
+def claim(worker, kinds=None):
+    """
+    Leases the next runnable job and returns (job, slot), or (None, None). Runnable means
+    queued and due, or running on a lease that ran out (its worker died).
+    """
+    now = timezone.now()
+    runnable = Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, leased_until__lt=now)
+    candidates = Job.objects.filter(runnable)
+    if kinds:
+        candidates = candidates.filter(kind__in=kinds)
+    full = set() # kinds with no free slot right now
+    for job_id, kind, status, leased_until in (
+        candidates.order_by("run_after", "id").values_list("id", "kind", "status", "leased_until")[:CLAIM_BATCH]
+    ):
+        if kind in full or kind not in _handlers:
+            continue
+        slot = _acquire_slot(kind, job_id)
+        if slot is None:
+            full.add(kind)
+            continue
+        # Only one worker's UPDATE can match the row as it was when we read it
+        claimed = Job.objects.filter(pk=job_id, status=status, leased_until=leased_until).update(
+            status=Job.RUNNING,
+            leased_until=now + timedelta(seconds=_config(kind)["timeout"]),
+            worker=worker,
+            lease_token=uuid.uuid4().hex,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            job = Job.objects.get(pk=job_id)
+            job.slot = slot # For heartbeat()
+            return job, slot
+        _release_slot(kind, slot, job_id)
+    return None, None
+
+
+def _backoff(attempts):
+    delay = min(settings.JOB_RETRY_MAX_DELAY, settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _finish(job, **fields):
+    # Only while this claim still holds the lease; otherwise another worker (or another
+    # thread of this one) has taken the job over
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, lease_token=job.lease_token).update(
+        leased_until=None, lease_token="", **fields
+    )
+
+
+def run(job, slot):
+    """Runs a claimed job to completion, failure or its next retry."""
+    config = _config(job.kind)
+    finished = False
+    try:
+        if job.attempts > config["max_attempts"]:
+            raise PermanentJobError("The job's worker stopped responding too many times.")
+        result = _handlers[job.kind](job)
+    except Exception as e:
+        permanent = isinstance(e, PermanentJobError) or job.attempts >= config["max_attempts"]
+        if permanent:
+            logger.error(f"{job} failed after {job.attempts} attempt(s): {e}")
+            finished = _finish(job, status=Job.FAILED, error=str(e), finished_at=timezone.now())
+        else:
+            delay = _backoff(job.attempts)
+            logger.warning(f"{job} attempt {job.attempts} failed ({e}); retrying in {delay:.0f}s.")
+            finished = _finish(job, status=Job.QUEUED, error=str(e), run_after=timezone.now() + timedelta(seconds=delay))
+    else:
+        finished = _finish(job, status=Job.SUCCEEDED, result=result, error="", finished_at=timezone.now())
+        if finished:
+            logger.info(f"{job} succeeded.")
+    finally:
+        # A claim that lost its lease leaves the slot alone: it may have gone to the job's
+        # new claim, and otherwise it expires by itself
+        if finished:
+            _release_slot(job.kind, slot, job.id)
+        else:
+            logger.warning(f"{job} finished after losing its lease; the outcome was discarded.")
+
+
+def purge_finished():
+    """Deletes finished jobs older than JOB_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    deleted, _ = Job.objects.filter(status__in=[Job.SUCCEEDED, Job.FAILED], finished_at__lt=cutoff).delete()
+    if deleted:
+        logger.info(f"Purged {deleted} finished jobs.")
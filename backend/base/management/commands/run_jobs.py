@@ -0,0 +1,84 @@
+# base/management/commands/run_jobs.py
+"""
+Runs queued background jobs (base/jobs.py):
+
+    python manage.py run_jobs --concurrency 4
+
+Start one or more of these next to the web server, e.g. as a systemd service. Each runs up
+to --concurrency jobs at once in threads; settings.JOB_TYPES caps each kind across all of
+them. SIGTERM or Ctrl+C stops it taking new jobs and waits for the running ones to finish.
+"""
+
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from base import jobs
+from base import tasks  # noqa: F401 (registers the handlers)
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 60 * 60 # seconds between deletions of old finished jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (chat replies, audio) until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=4, help="Jobs run at once by this worker.")
+        parser.add_argument("--kinds", default="", help="Comma-separated job kinds to run (default: all).")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once there is nothing left to run.")
+
+    def handle(self, *args, concurrency, kinds, poll_interval, once, **options):
+        kinds = [kind.strip() for kind in kinds.split(",") if kind.strip()] or None
+        worker = jobs.worker_name()
+        stopping = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.set())
+
+        running = set()
+        last_purge = 0
+        logger.info(f"Worker {worker} started ({concurrency} threads, kinds: {kinds or 'all'}).")
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job") as executor:
+            while not stopping.is_set():
+                running = {future for future in running if not future.done()}
+                if len(running) >= concurrency:
+                    stopping.wait(0.1)
+                    continue
+
+                close_old_connections()
+                try:
+                    if time.monotonic() - last_purge > PURGE_INTERVAL:
+                        jobs.purge_finished()
+                        last_purge = time.monotonic()
+                    job, slot = jobs.claim(worker, kinds)
+                except Exception as e:
+                    # e.g. the database restarting; keep the worker alive and try again
+                    logger.error(f"Worker {worker} could not claim a job: {e}")
+                    stopping.wait(poll_interval)
+                    continue
+
+                if job is not None:
+                    running.add(executor.submit(self._run, job, slot, worker))
+                elif once and not running:
+                    break
+                else:
+                    stopping.wait(poll_interval)
+            # Leaving the with block waits for the running jobs
+        logger.info(f"Worker {worker} stopped.")
+
+    @staticmethod
+    def _run(job, slot, worker):
+        close_old_connections()
+        try:
+            jobs.run(job, slot)
+        except Exception:
+            logger.exception(f"Worker {worker} crashed running {job}.")
+        finally:
+            close_old_connections()
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_token_counts(apps, schema_editor):
+    # Same estimate as base.context.estimate_tokens (~4 chars per token)
+    Message = apps.get_model('base', 'Message')
+    batch = []
+    for message in Message.objects.only('id', 'content').iterator(chunk_size=2000):
+        message.token_count = max(1, -(-len(message.content or '') // 4))
+        batch.append(message)
+        if len(batch) >= 2000:
+            Message.objects.bulk_update(batch, ['token_count'])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ['token_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_alter_chat_options_alter_message_options_chat_title_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='summarized_up_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='base.message'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='summary_token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_token_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_message_message_chat_ts_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['card_set', 'id'], name='card_set_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['card_set', 'term', 'id'], name='card_set_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cardset',
+            index=models.Index(fields=['user', 'name', 'id'], name='cardset_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='chat_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+def backfill_chat_counters(apps, schema_editor):
+    # Same preview as base.models._preview
+    Chat = apps.get_model('base', 'Chat')
+    Message = apps.get_model('base', 'Message')
+    for chat in Chat.objects.only('id').iterator(chunk_size=500):
+        messages = Message.objects.filter(chat_id=chat.id)
+        last = messages.order_by('-timestamp', '-id').only('timestamp', 'content').first()
+        if last is None:
+            continue
+        preview = ' '.join(last.content.split())
+        if len(preview) > 120:
+            preview = preview[:117] + '...'
+        Chat.objects.filter(pk=chat.id).update(
+            message_count=messages.count(), last_message_at=last.timestamp, last_message_preview=preview
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_card_card_set_id_idx_card_card_set_term_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=120),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_chat_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Full-text search index for base/search.py: tsvector columns + GIN on PostgreSQL, FTS5 tables on SQLite.
+# The DDL is a frozen copy of what base/search.py's install() created at the time, so later
+# changes there don't change what this migration does.
+
+from django.db import migrations
+
+# (table, indexed columns with their tsvector weights)
+INDEXED = [
+    ("base_card", [("term", "A"), ("definition", "B")]),
+    ("base_cardset", [("name", "A"), ("description", "B")]),
+    ("base_message", [("content", "A")]),
+]
+
+
+def install(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, columns in INDEXED:
+        names = [column for column, _ in columns]
+        if vendor == "postgresql":
+            vector = " || ".join(
+                f"setweight(to_tsvector('simple'::regconfig, coalesce({column}, '')), '{weight}')"
+                for column, weight in columns
+            )
+            schema_editor.execute(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ({vector}) STORED"
+            )
+            schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)")
+        elif vendor == "sqlite":
+            fts = f"{table}_fts"
+            column_list = ", ".join(names)
+            new_values = ", ".join(f"new.{name}" for name in names)
+            old_values = ", ".join(f"old.{name}" for name in names)
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column_list}, content='{table}', "
+                f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            insert = f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});"
+            delete = f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+            schema_editor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END")
+            schema_editor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END")
+            schema_editor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END"
+            )
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, _ in INDEXED:
+        if vendor == "postgresql":
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+        elif vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_tombstone_card_updated_at_cardset_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
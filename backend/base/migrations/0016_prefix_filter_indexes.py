@@ -0,0 +1,42 @@
+# Indexes for the case-insensitive prefix filters (?name_prefix=, ?term_prefix=, ?title_prefix=).
+# istartswith compiles to UPPER(col::text) LIKE UPPER(%s) on PostgreSQL and to
+# col LIKE %s (case-insensitive for ASCII) on SQLite, so a plain index on the column
+# serves neither: PostgreSQL needs an UPPER() expression index with text_pattern_ops,
+# SQLite an index with COLLATE NOCASE.
+
+from django.db import migrations
+
+# (index name, table, owner column, filtered column)
+PREFIX_INDEXES = [
+    ("cardset_name_prefix_idx", "base_cardset", "user_id", "name"),
+    ("card_term_prefix_idx", "base_card", "card_set_id", "term"),
+    ("chat_title_prefix_idx", "base_chat", "user_id", "title"),
+]
+
+
+def create(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name, table, owner, column in PREFIX_INDEXES:
+        if vendor == "postgresql":
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({owner}, (UPPER("{column}"::text)) text_pattern_ops)'
+            )
+        elif vendor == "sqlite":
+            schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({owner}, "{column}" COLLATE NOCASE)')
+
+
+def drop(apps, schema_editor):
+    if schema_editor.connection.vendor in ("postgresql", "sqlite"):
+        for name, *_ in PREFIX_INDEXES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_geminicacheentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create, drop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_prefix_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='lease_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
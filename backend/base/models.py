@@ -1,14 +1,22 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.db.models import Case, F, Q, Value, When
 from django.contrib.auth.models import User
 
 class Category(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="categories")  # Ensures categories belong to a user
     name = models.CharField(max_length=255)
     color = models.CharField(max_length=7, default="#FFFFFF")  # HEX color format
+    updated_at = models.DateTimeField(auto_now=True) # For delta sync (see base/sync.py)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "updated_at"], name="category_user_updated_idx"),
+        ]
+
 class CardSet(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cardsets")  # Ensures card sets belong to a user
     name = models.CharField(max_length=255)
@@ -16,10 +24,17 @@ class CardSet(models.Model):
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, related_name="sets", null=True, blank=True
     )  # 🛠️ Changed to CASCADE so deleting a category deletes all related sets
+    updated_at = models.DateTimeField(auto_now=True) # For delta sync (see base/sync.py)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "name", "id"], name="cardset_user_name_idx"), # ?ordering=name (?name_prefix=: migration 0016)
+            models.Index(fields=["user", "updated_at"], name="cardset_user_updated_idx"),
+        ]
+
 class Card(models.Model):
     card_set = models.ForeignKey(
         CardSet, related_name="cards", on_delete=models.CASCADE
@@ -28,33 +43,91 @@ class Card(models.Model):
     term_image = models.ImageField(upload_to="cards/images/", null=True, blank=True)
     definition = models.TextField()
     definition_image = models.ImageField(upload_to="cards/images/", null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True) # For delta sync (see base/sync.py)
 
     def __str__(self):
         return self.term
 
+    class Meta:
+        indexes = [
+            # Keyset pages of a set by id (the default) or term. ?term_prefix= is case-insensitive
+            # and has its own expression index (migration 0016_prefix_filter_indexes)
+            models.Index(fields=["card_set", "id"], name="card_set_id_idx"),
+            models.Index(fields=["card_set", "term", "id"], name="card_set_term_idx"),
+            models.Index(fields=["card_set", "updated_at"], name="card_set_updated_idx"),
+        ]
+
+PREVIEW_LENGTH = 120
+TITLE_WORDS = 7
+
+
+def _preview(content):
+    content = " ".join(content.split())
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 3] + "..."
+
+
+def _title_from(content):
+    # First few words of the first user message
+    words = content.split()
+    title = " ".join(words[:TITLE_WORDS]) + ("..." if len(words) > TITLE_WORDS else "")
+    return title[:100]
+
+
 class Chat(models.Model): # This will be our "Chat Session"
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chats") # related_name is good
     title = models.CharField(max_length=100, blank=True, null=True) # For displaying on /chats page
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True) # To sort by recent activity
+    # Rolling summary of the older part of the conversation, maintained by base/context.py
+    summary = models.TextField(blank=True, default="")
+    summary_token_count = models.PositiveIntegerField(default=0)
+    summarized_up_to = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    ) # Last message folded into the summary
+    # Kept up to date by add_message() so the send path and the chat list don't query messages
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default="")
 
     def __str__(self):
         return self.title or f"Chat {self.id} with {self.user.username}"
 
-    def save(self, *args, **kwargs):
-        # Auto-generate a title from the first message if not set
-        if not self.title and self.pk: # Check if instance is saved and has messages
-            first_message = self.messages.order_by('timestamp').first()
-            if first_message:
-                # Take first 5-7 words of the first USER message as title
-                if first_message.sender == 'user':
-                     self.title = ' '.join(first_message.content.split()[:7])
-                     if len(first_message.content.split()) > 7:
-                        self.title += "..."
-        super().save(*args, **kwargs)
+    def add_message(self, sender, content):
+        """
+        Saves a message in this chat and, in the same transaction, bumps the denormalized
+        message_count / last_message_at / last_message_preview with a single UPDATE.
+        The first user message also names an untitled chat.
+        """
+        with transaction.atomic():
+            message = Message.objects.create(chat=self, sender=sender, content=content)
+            updates = {
+                "message_count": F("message_count") + 1,
+                "last_message_at": message.timestamp,
+                "last_message_preview": _preview(content),
+                "updated_at": message.timestamp, # .update() skips auto_now
+            }
+            title = None
+            if sender == 'user' and not self.title:
+                title = _title_from(content)
+                # Conditional in SQL, so a title set meanwhile (e.g. by a concurrent turn) is kept
+                updates["title"] = Case(
+                    When(Q(title__isnull=True) | Q(title=""), then=Value(title)), default=F("title")
+                )
+            Chat.objects.filter(pk=self.pk).update(**updates)
+
+        # Keep this instance in step without reading the row back
+        self.message_count += 1
+        self.last_message_at = self.updated_at = message.timestamp
+        self.last_message_preview = updates["last_message_preview"]
+        if title:
+            self.title = title
+        return message
 
     class Meta:
         ordering = ['-updated_at'] # Show most recently updated chats first
+        indexes = [
+            models.Index(fields=["user", "updated_at", "id"], name="chat_user_updated_idx"),
+        ]
 
 class Message(models.Model):
     chat = models.ForeignKey(Chat, related_name='messages', on_delete=models.CASCADE)
@@ -66,9 +139,114 @@ class Message(models.Model):
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES) # Changed max_length
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    token_count = models.PositiveIntegerField(default=0) # Estimated once at insert, see base/context.py
 
     def __str__(self):
         return f"{self.get_sender_display()} in Chat {self.chat.id}: {self.content[:30]}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.token_count:
+            from .context import estimate_tokens
+            self.token_count = estimate_tokens(self.content)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        ordering = ['timestamp'] # Messages within a chat should be chronological
+        indexes = [
+            # Keyset pagination and context planning walk a chat's messages in (timestamp, id) order
+            models.Index(fields=["chat", "timestamp", "id"], name="message_chat_ts_id_idx"),
+        ]
+
+class AudioCacheEntry(models.Model):
+    # Index of the on-disk TTS audio cache (see base/tts_cache.py); the MP3 itself lives under MEDIA_ROOT
+    key = models.CharField(max_length=64, unique=True) # sha256 of text + voice + model + voice_settings
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(db_index=True) # For LRU eviction
+
+    def __str__(self):
+        return f"{self.key} ({self.size} bytes)"
+
+class GeminiCacheEntry(models.Model):
+    # A cached Gemini reply (see base/gemini_cache.py)
+    key = models.CharField(max_length=64, unique=True) # sha256 of the normalized request payload
+    response = models.TextField()
+    size = models.PositiveIntegerField() # bytes of response, for the size bound
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    last_accessed_at = models.DateTimeField(db_index=True) # For LRU eviction
+
+    def __str__(self):
+        return f"{self.key} ({self.size} bytes)"
+
+class Counter(models.Model):
+    # Rows of the database counter backend (see base/counters.py), shared by every worker
+    key = models.CharField(max_length=200, unique=True)
+    value = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True) # None means it never expires
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+class IdempotencyRecord(models.Model):
+    # First response to a POST sent with an Idempotency-Key, replayed to retries (see base/idempotency.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64) # sha256 of method + path + body, to catch reused keys
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True) # None while the request is in progress
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
     class Meta:
-        ordering = ['timestamp'] # Messages within a chat should be chronological
\ No newline at end of file
+        unique_together = ("user", "key")
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status_code or 'in progress'})"
+
+class Tombstone(models.Model):
+    # A deleted Category / CardSet / Card / Chat, so delta sync can tell clients to drop it (see base/sync.py)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    collection = models.CharField(max_length=20) # "categories", "cardsets", "cards" or "chats"
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "deleted_at"], name="tombstone_user_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.collection}:{self.object_id} deleted at {self.deleted_at}"
+
+class Job(models.Model):
+    # Background work queued by the API and run by `manage.py run_jobs` (see base/jobs.py)
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    kind = models.CharField(max_length=50) # Handler name, a key of settings.JOB_TYPES
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now) # Pushed back after a failed attempt
+    leased_until = models.DateTimeField(null=True, blank=True) # A running job whose lease ran out is retried
+    worker = models.CharField(max_length=100, blank=True)
+    lease_token = models.CharField(max_length=32, blank=True) # New for every claim; only its holder may finish the job
+    progress = models.JSONField(null=True, blank=True) # e.g. {"done": 3, "total": 10}, set by the handler
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+            models.Index(fields=["user", "status"], name="job_user_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
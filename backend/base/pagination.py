@@ -0,0 +1,158 @@
+# base/pagination.py
+"""
+Keyset (cursor) pagination: MessageKeysetPagination for chat messages, and
+KeysetPagination (further down) for the card, card set and chat session lists.
+
+Pages are cut on (timestamp, id) rather than with OFFSET, so every page, including the
+first screen of a very long chat, is one index range scan on
+base_message(chat_id, timestamp, id) however deep into the history it is.
+
+    GET ...?limit=50              the newest page
+    GET ...?before=<cursor>       the page of older messages just before the cursor
+    GET ...?after=<cursor>        messages newer than the cursor (incremental loading)
+
+Results are always oldest first. Cursors are opaque strings taken from the response:
+"before" pages further back (null once the start of the chat is reached), "after"
+points at the newest message returned, to ask for anything newer later on.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def encode_cursor(message):
+    raw = json.dumps([message.timestamp.isoformat(), message.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        parsed = parse_datetime(timestamp)
+        if parsed is None:
+            raise ValueError
+        return parsed, int(message_id)
+    except (ValueError, TypeError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+
+
+def _get_limit(request, default_limit, max_limit):
+    try:
+        limit = int(request.query_params.get("limit", default_limit))
+    except ValueError:
+        raise ValidationError({"limit": "Must be an integer."})
+    return max(1, min(limit, max_limit))
+
+
+class MessageKeysetPagination(BasePagination):
+    default_limit = 50
+    max_limit = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = _get_limit(request, self.default_limit, self.max_limit)
+        before = request.query_params.get("before")
+        after = request.query_params.get("after")
+        if before and after:
+            raise ValidationError({"cursor": "Use either before or after, not both."})
+
+        self.has_newer = False
+        self.after_cursor = after
+        if after:
+            timestamp, message_id = decode_cursor(after)
+            rows = list(
+                queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+                .order_by("timestamp", "id")[:limit + 1]
+            )
+            self.has_newer = len(rows) > limit
+            page = rows[:limit]
+            # Whatever is older than `after` the client already has
+            self.before_cursor = None
+        else:
+            if before:
+                timestamp, message_id = decode_cursor(before)
+                queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+            # Paging back from a cursor, the newer messages are the ones the client came from
+            self.has_newer = bool(before)
+            rows = list(queryset.order_by("-timestamp", "-id")[:limit + 1])
+            page = rows[:limit][::-1]
+            self.before_cursor = encode_cursor(page[0]) if len(rows) > limit else None
+
+        if page:
+            self.after_cursor = encode_cursor(page[-1])
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            "results": data,
+            "before": self.before_cursor,
+            "after": self.after_cursor,
+            "has_newer": self.has_newer,
+        })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination for the list endpoints, ordered by the queryset's
+    first ordering field (set by DRF's OrderingFilter) with id as the tiebreaker.
+
+    Opt-in: a request without ?limit= or ?cursor= gets the plain, unpaginated list the
+    frontend has always received. Otherwise the response is {"results": [...], "next": cursor},
+    where "next" is null on the last page.
+    """
+    default_limit = 100
+    max_limit = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if "limit" not in params and "cursor" not in params:
+            return None
+        limit = _get_limit(request, self.default_limit, self.max_limit)
+
+        ordering = queryset.query.order_by[0] if queryset.query.order_by else "id"
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        queryset = queryset.order_by(ordering, "-id" if descending else "id")
+        # Make sure the cursor field is loaded when the view narrowed the columns (?fields=)
+        names, defer = queryset.query.deferred_loading
+        if names and not defer:
+            queryset = queryset.only(*names, field)
+
+        cursor = params.get("cursor")
+        if cursor:
+            cursor_ordering, value, last_id = self.decode(cursor)
+            if cursor_ordering != ordering:
+                raise ValidationError({"cursor": "Cursor was issued for a different ordering."})
+            op = "lt" if descending else "gt"
+            if field == "id":
+                queryset = queryset.filter(**{f"id__{op}": last_id})
+            else:
+                value = queryset.model._meta.get_field(field).to_python(value)
+                queryset = queryset.filter(Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": last_id}))
+
+        rows = list(queryset[:limit + 1])
+        page = rows[:limit]
+        self.next_cursor = self.encode(ordering, getattr(page[-1], field), page[-1].id) if len(rows) > limit else None
+        return page
+
+    def encode(self, ordering, value, last_id):
+        value = value.isoformat() if hasattr(value, "isoformat") else value
+        raw = json.dumps([ordering, value, last_id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            ordering, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return ordering, value, int(last_id)
+        except (ValueError, TypeError):
+            raise ValidationError({"cursor": "Invalid cursor."})
+
+    def get_paginated_response(self, data):
+        return Response({"results": data, "next": self.next_cursor})
@@ -0,0 +1,228 @@
+# base/ratelimit.py
+"""
+Rate limits and usage quotas for the chat and TTS endpoints.
+
+Each endpoint has a list of policies in settings.RATE_LIMITS, applied per user:
+
+    {"algorithm": "token_bucket", "rate": "20/min", "burst": 1}
+        Smooth rate with bursts of up to `burst` requests (GCRA, one counter per user).
+    {"algorithm": "sliding_window", "rate": "10/min"}
+        At most N requests in any window of that length (weighted current + previous window).
+    {"algorithm": "quota", "limit": 200, "period": "day"}
+        N requests per calendar day or month (UTC), resetting on its own when the period ends.
+
+A request must pass every policy for its endpoint; if a later one refuses it, what the
+earlier ones took is given back. All state lives in the shared counters (base/counters.py),
+so limits hold across workers. Call check() before doing any DB writes or upstream calls,
+then apply() the returned RateLimit to the response to send the RateLimit-* headers.
+"""
+
+import calendar
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .counters import counters
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+RATE = "rate"   # kind of refusal: slow down and retry shortly
+QUOTA = "quota" # kind of refusal: the allowance for the period is used up
+CAS_ATTEMPTS = 5
+
+
+def parse_rate(rate):
+    """'20/min' -> (20, 60)"""
+    count, period = rate.split("/")
+    return int(count), PERIODS[period]
+
+
+class RateLimit:
+    """Outcome of a check: whether the request may go ahead, and what to tell the client."""
+
+    def __init__(self, allowed, limit=None, remaining=None, reset=None, policy=None, kind=RATE, retry_after=0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset # seconds until the limit is fully restored
+        self.policy = policy # RateLimit-Policy value, e.g. "20;w=60"
+        self.kind = kind
+        self.retry_after = retry_after
+
+    def apply(self, response):
+        """Adds the RateLimit-* (and, when refused, Retry-After) headers to response."""
+        if self.limit is not None:
+            response["RateLimit-Limit"] = str(self.limit)
+            response["RateLimit-Remaining"] = str(max(0, self.remaining))
+            response["RateLimit-Reset"] = str(max(0, math.ceil(self.reset)))
+            response["RateLimit-Policy"] = self.policy
+        if not self.allowed:
+            response["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return response
+
+
+UNLIMITED = RateLimit(True)
+
+
+class TokenBucket:
+    """
+    GCRA: the counter holds the bucket's "theoretical arrival time" in ms. Each request
+    pushes it forward by one interval, and is refused if that would put it more than
+    `burst` intervals ahead of now.
+    """
+
+    def __init__(self, name, rate, burst=1):
+        self.name = name
+        count, period = parse_rate(rate)
+        self.interval = period * 1000 / count
+        self.burst = burst
+        self.policy = f"{burst};w={math.ceil(self.interval * burst / 1000)}"
+
+    def acquire(self, key):
+        key = f"rl:{self.name}:{key}"
+        for _ in range(CAS_ATTEMPTS):
+            now = int(time.time() * 1000)
+            stored = counters().get(key)
+            new_tat = max(stored, now) + self.interval
+            allow_at = new_tat - self.burst * self.interval
+            if now < allow_at:
+                return RateLimit(
+                    False, self.burst, 0, (new_tat - self.interval - now) / 1000, self.policy,
+                    retry_after=(allow_at - now) / 1000,
+                )
+            new_tat = int(new_tat)
+            if counters().compare_and_set(key, stored or None, new_tat, ttl=math.ceil((new_tat - now) / 1000) + 1):
+                remaining = int((now - allow_at) // self.interval)
+                return RateLimit(True, self.burst, remaining, (new_tat - now) / 1000, self.policy)
+        # Lost the race every time: treat it like a full bucket
+        return RateLimit(False, self.burst, 0, self.interval / 1000, self.policy, retry_after=self.interval / 1000)
+
+    def refund(self, key):
+        key = f"rl:{self.name}:{key}"
+        stored = counters().get(key)
+        if stored:
+            counters().compare_and_set(key, stored, int(stored - self.interval))
+
+
+class SlidingWindow:
+    """
+    Counts requests in fixed windows and estimates the sliding count as the current
+    window plus the overlapping share of the previous one.
+    """
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.limit, self.period = parse_rate(rate)
+        self.policy = f"{self.limit};w={self.period}"
+
+    def _keys(self, key, now):
+        window = int(now // self.period)
+        return f"rl:{self.name}:{key}:{window}", f"rl:{self.name}:{key}:{window - 1}"
+
+    def acquire(self, key):
+        now = time.time()
+        current_key, previous_key = self._keys(key, now)
+        elapsed = (now % self.period) / self.period
+        current = counters().incr(current_key, ttl=2 * self.period)
+        previous = counters().get(previous_key)
+        estimated = previous * (1 - elapsed) + current
+        window_left = self.period * (1 - elapsed)
+        if estimated > self.limit:
+            counters().incr(current_key, -1)
+            if current > self.limit or not previous:
+                retry_after = window_left
+            else:
+                # Wait until enough of the previous window has slid out
+                retry_after = self.period * (estimated - self.limit) / previous
+            return RateLimit(False, self.limit, 0, window_left, self.policy, retry_after=retry_after)
+        return RateLimit(True, self.limit, int(self.limit - estimated), window_left, self.policy)
+
+    def refund(self, key):
+        counters().incr(self._keys(key, time.time())[0], -1)
+
+
+class Quota:
+    """A fixed allowance per calendar day or month (UTC)."""
+
+    def __init__(self, name, limit, period):
+        if period not in ("day", "month"):
+            raise ValueError(f"Quota period must be 'day' or 'month', not {period!r}")
+        self.name = name
+        self.limit = limit
+        self.period = period
+
+    def _window(self):
+        """Returns (label, seconds until the window ends, window length in seconds)."""
+        now = timezone.now()
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.period == "day":
+            return now.strftime("%Y%m%d"), 86400 - (now - start).total_seconds(), 86400
+        length = calendar.monthrange(now.year, now.month)[1] * 86400
+        elapsed = (now - start.replace(day=1)).total_seconds()
+        return now.strftime("%Y%m"), length - elapsed, length
+
+    def acquire(self, key):
+        label, left, length = self._window()
+        policy = f"{self.limit};w={length}"
+        counter_key = f"rl:{self.name}:{key}:{label}"
+        used = counters().incr(counter_key, ttl=math.ceil(left) + 60)
+        if used > self.limit:
+            counters().incr(counter_key, -1)
+            return RateLimit(False, self.limit, 0, left, policy, kind=QUOTA, retry_after=left)
+        return RateLimit(True, self.limit, self.limit - used, left, policy, kind=QUOTA)
+
+    def refund(self, key):
+        label, _, _ = self._window()
+        counters().incr(f"rl:{self.name}:{key}:{label}", -1)
+
+
+ALGORITHMS = {"token_bucket": TokenBucket, "sliding_window": SlidingWindow, "quota": Quota}
+_policies = {}
+
+
+def _policies_for(endpoint):
+    if endpoint not in _policies:
+        policies = []
+        for config in settings.RATE_LIMITS.get(endpoint, []):
+            config = dict(config)
+            algorithm = config.pop("algorithm")
+            # Name counters after the policy itself so editing one policy doesn't reset the others
+            name = f"{endpoint}:{algorithm}:{config.get('rate') or config.get('limit')}/{config.get('period', '')}"
+            policies.append(ALGORITHMS[algorithm](name, **config))
+        _policies[endpoint] = policies
+    return _policies[endpoint]
+
+
+def check(endpoint, user):
+    """
+    Takes one request's worth from every policy for endpoint. Returns the refusing
+    RateLimit if any policy refuses, otherwise the one with the least room left.
+    """
+    if user.is_superuser:
+        return UNLIMITED
+
+    acquired = []
+    tightest = UNLIMITED
+    for policy in _policies_for(endpoint):
+        result = policy.acquire(user.id)
+        if not result.allowed:
+            for granted in acquired:
+                granted.refund(user.id)
+            logger.warning(f"User {user.username} hit the {endpoint} {result.kind} limit ({result.policy}).")
+            return result
+        acquired.append(policy)
+        if tightest.limit is None or result.remaining < tightest.remaining:
+            tightest = result
+    return tightest
+
+
+def refund(endpoint, user):
+    """Gives back what check() took for a request that turned out not to need it."""
+    if user.is_superuser:
+        return
+    for policy in _policies_for(endpoint):
+        policy.refund(user.id)
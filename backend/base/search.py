@@ -0,0 +1,168 @@
+# base/search.py
+"""
+Full-text search over a user's cards, card sets and chat messages (GET /api/search/?q=).
+
+The index lives in the database and is kept up to date by the database itself, so bulk
+inserts, bulk updates, imports and CASCADE deletes are covered like any other write:
+
+    PostgreSQL  a generated tsvector column (search_vector) on base_card, base_cardset and
+                base_message, each with a GIN index
+    SQLite      FTS5 external-content tables (base_card_fts, ...) kept in step by triggers
+
+The 0013_search_index migration created these from a frozen copy of install(); a change to
+INDEXED needs a new migration. Django rebuilds SQLite tables for some schema changes, which
+drops their triggers; run install() again after such a migration on SQLite, it only
+creates what is missing.
+
+Queries use the "simple" configuration / unicode61 tokenizer, without stemming, since
+decks mix languages. Every word in q must match; the last one also matches as a prefix,
+so results come up while the user is still typing.
+"""
+
+import html
+import re
+
+from django.db import connection
+
+# (table, indexed columns with weights, FTS5 bm25 weights follow the same order)
+INDEXED = {
+    "base_card": [("term", "A"), ("definition", "B")],
+    "base_cardset": [("name", "A"), ("description", "B")],
+    "base_message": [("content", "A")],
+}
+# Snippets are marked with control characters, then HTML-escaped and given <mark> tags
+START, STOP = "\x02", "\x03"
+SNIPPET_WORDS = 16
+
+
+class SearchUnavailable(Exception):
+    """The configured database has no full-text index support here."""
+
+
+def _postgres_vector(columns):
+    return " || ".join(
+        f"setweight(to_tsvector('simple'::regconfig, coalesce({column}, '')), '{weight}')"
+        for column, weight in columns
+    )
+
+
+def install(schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, columns in INDEXED.items():
+        names = [column for column, _ in columns]
+        if vendor == "postgresql":
+            schema_editor.execute(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ({_postgres_vector(columns)}) STORED"
+            )
+            schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)")
+        elif vendor == "sqlite":
+            fts = f"{table}_fts"
+            column_list = ", ".join(names)
+            new_values = ", ".join(f"new.{name}" for name in names)
+            old_values = ", ".join(f"old.{name}" for name in names)
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column_list}, content='{table}', "
+                f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            insert = f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});"
+            delete = f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+            schema_editor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END")
+            schema_editor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END")
+            schema_editor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END"
+            )
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall(schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in INDEXED:
+        if vendor == "postgresql":
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+        elif vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+def _terms(q):
+    return re.findall(r"\w+", q.lower())[:20]
+
+
+_POSTGRES_QUERY = f"""
+    WITH q AS (SELECT to_tsquery('simple', %s) AS query)
+    SELECT hits.kind, hits.id, hits.parent_id, hits.rank,
+           ts_headline('simple', hits.text, q.query,
+                       'StartSel={START}, StopSel={STOP}, MaxWords={SNIPPET_WORDS}, MinWords=5, MaxFragments=2, FragmentDelimiter=" … "')
+    FROM (
+        SELECT 'card' AS kind, c.id, c.card_set_id AS parent_id, ts_rank(c.search_vector, q.query) AS rank,
+               c.term || E'\\n' || c.definition AS text
+        FROM base_card c JOIN base_cardset s ON s.id = c.card_set_id, q
+        WHERE s.user_id = %s AND c.search_vector @@ q.query
+        UNION ALL
+        SELECT 'card_set', s.id, NULL::bigint, ts_rank(s.search_vector, q.query),
+               s.name || E'\\n' || coalesce(s.description, '')
+        FROM base_cardset s, q
+        WHERE s.user_id = %s AND s.search_vector @@ q.query
+        UNION ALL
+        SELECT 'message', m.id, m.chat_id, ts_rank(m.search_vector, q.query), m.content
+        FROM base_message m JOIN base_chat ch ON ch.id = m.chat_id, q
+        WHERE ch.user_id = %s AND m.search_vector @@ q.query
+        ORDER BY rank DESC, kind, id
+        LIMIT %s OFFSET %s
+    ) hits, q
+    ORDER BY hits.rank DESC, hits.kind, hits.id
+"""
+
+# bm25() is lower for better matches; it is negated so rank means the same on both databases
+_SQLITE_QUERY = f"""
+    SELECT 'card' AS kind, c.id, c.card_set_id AS parent_id, -bm25(base_card_fts, 2.0, 1.0) AS rank,
+           snippet(base_card_fts, -1, '{START}', '{STOP}', '…', {SNIPPET_WORDS})
+    FROM base_card_fts JOIN base_card c ON c.id = base_card_fts.rowid JOIN base_cardset s ON s.id = c.card_set_id
+    WHERE base_card_fts MATCH %s AND s.user_id = %s
+    UNION ALL
+    SELECT 'card_set', s.id, NULL, -bm25(base_cardset_fts, 2.0, 1.0),
+           snippet(base_cardset_fts, -1, '{START}', '{STOP}', '…', {SNIPPET_WORDS})
+    FROM base_cardset_fts JOIN base_cardset s ON s.id = base_cardset_fts.rowid
+    WHERE base_cardset_fts MATCH %s AND s.user_id = %s
+    UNION ALL
+    SELECT 'message', m.id, m.chat_id, -bm25(base_message_fts),
+           snippet(base_message_fts, -1, '{START}', '{STOP}', '…', {SNIPPET_WORDS})
+    FROM base_message_fts JOIN base_message m ON m.id = base_message_fts.rowid JOIN base_chat ch ON ch.id = m.chat_id
+    WHERE base_message_fts MATCH %s AND ch.user_id = %s
+    ORDER BY rank DESC, kind, id
+    LIMIT %s OFFSET %s
+"""
+
+
+def _highlight(snippet):
+    return html.escape(snippet or "").replace(START, "<mark>").replace(STOP, "</mark>")
+
+
+def search(user, q, limit, offset):
+    """
+    Ranked hits for q among user's cards, sets and messages, best first, as dicts with
+    "type", "id", "parent" (the card's set or the message's chat), "rank" and "snippet"
+    (HTML-escaped text with the matches in <mark>).
+    """
+    terms = _terms(q)
+    if not terms:
+        return []
+    if connection.vendor == "postgresql":
+        query = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+        sql, params = _POSTGRES_QUERY, [query, user.id, user.id, user.id, limit, offset]
+    elif connection.vendor == "sqlite":
+        query = " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        sql, params = _SQLITE_QUERY, [query, user.id, query, user.id, query, user.id, limit, offset]
+    else:
+        raise SearchUnavailable(f"Full-text search isn't supported on {connection.vendor}.")
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [
+        {"type": kind, "id": pk, "parent": parent, "rank": round(rank, 4), "snippet": _highlight(snippet)}
+        for kind, pk, parent, rank, snippet in rows
+    ]
@@ -1,25 +1,47 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Category, CardSet,Chat, Card, Message
+from .models import Category, CardSet,Chat, Card, Job, Message
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 
+class SparseFieldsMixin:
+    """
+    Lets GET requests ask for a subset of fields, e.g. ?fields=id,term. Views pass the
+    same set to queryset.only() (see requested_fields) so unused columns aren't even selected.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get("request"))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        """The valid field names in ?fields=, or None to return every field."""
+        if request is None or request.method != "GET" or not request.query_params.get("fields"):
+            return None
+        requested = {name.strip() for name in request.query_params["fields"].split(",")}
+        return (requested & set(cls.Meta.fields)) or None
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'color', 'user']
+        fields = ['id', 'name', 'color', 'user', 'updated_at']
         extra_kwargs = {'user': {'read_only': True}}  # Ensures user is auto-assigned
 
 
-class CardSetSerializer(serializers.ModelSerializer):
+class CardSetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = CardSet
-        fields = ["id", "name", "description", "category", "user"]
+        fields = ["id", "name", "description", "category", "user", "updated_at"]
         extra_kwargs = {'user': {'read_only': True}}  # Ensures user is auto-assigned
 
 
 
-class CardSerializer(serializers.ModelSerializer):
+class CardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Card
         fields = [
@@ -29,30 +51,67 @@ class CardSerializer(serializers.ModelSerializer):
             "term_image",
             "definition",
             "definition_image",
+            "updated_at",
         ]
         extra_kwargs = {'user': {'read_only': True}}  # Ensures user is auto-assigned
 
 
 
+class CardBulkItemSerializer(serializers.Serializer):
+    """
+    One create or update in a bulk card request (CardBulkView). card_set is a plain id
+    here, so validating hundreds of items doesn't look each set up; the view checks
+    ownership of all of them in one query. Images aren't part of the bulk API.
+    """
+    id = serializers.IntegerField(required=False) # Required for updates, ignored for creates
+    card_set = serializers.IntegerField()
+    term = serializers.CharField(max_length=Card._meta.get_field("term").max_length)
+    definition = serializers.CharField()
+
+
+class DashboardCardSetSerializer(serializers.ModelSerializer):
+    card_count = serializers.IntegerField(read_only=True) # Annotated by DashboardView
+
+    class Meta:
+        model = CardSet
+        fields = ["id", "name", "description", "category", "card_count"]
+
+
+class DashboardCategorySerializer(serializers.ModelSerializer):
+    sets = DashboardCardSetSerializer(many=True, read_only=True) # Prefetched by DashboardView
+
+    class Meta:
+        model = Category
+        fields = ["id", "name", "color", "sets"]
+
+
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ["id", "sender", "content", "timestamp"]
 
-class ChatSessionListSerializer(serializers.ModelSerializer):
+class ChatSessionListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Chat
-        fields = ['id', 'title', 'user', 'created_at', 'updated_at']
-        read_only_fields = ['user'] # User will be set from request
+        fields = ['id', 'title', 'user', 'created_at', 'updated_at', 'message_count', 'last_message_at', 'last_message_preview']
+        read_only_fields = ['user', 'message_count', 'last_message_at', 'last_message_preview'] # User will be set from request
 
 class ChatSessionDetailSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True) # Nested messages
+    # Messages aren't nested here: ChatSessionDetailView adds one page of them (see base/pagination.py)
 
     class Meta:
         model = Chat
-        fields = ['id', 'title', 'user', 'created_at', 'updated_at', 'messages']
-        read_only_fields = ['user']
+        fields = ['id', 'title', 'user', 'created_at', 'updated_at', 'message_count', 'last_message_at', 'last_message_preview']
+        read_only_fields = ['user', 'message_count', 'last_message_at', 'last_message_preview']
         
+class JobSerializer(serializers.ModelSerializer):
+    # Status of background work queued with ?background=1 (see base/jobs.py)
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'progress', 'result', 'error', 'created_at', 'finished_at']
+        read_only_fields = fields
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(
         write_only=True, required=True, style={"input_type": "password"}
@@ -0,0 +1,108 @@
+# base/singleflight.py
+"""
+Single-flight coalescing for identical upstream calls.
+
+The first request for a key (the leader) makes the call; identical requests that arrive
+while it is in flight wait for it and get the same result instead of calling upstream
+again. Coordination goes through the Django cache, so with a shared cache (REDIS_URL)
+it spans every worker; with the default LocMemCache it covers one process.
+
+The result is kept for RESULT_TTL seconds after the call finishes, so a duplicate that
+arrives just after (a double-clicked send) is also answered from it. Callers that must
+not get an earlier answer pass reuse_result=False: they still join a call in flight, but
+only take the result of that call. If the leader dies without publishing, its lock
+expires and the next waiter takes over.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RESULT_TTL = 5 # seconds
+POLL_INTERVAL = 0.05 # seconds between cache checks while waiting on the leader
+
+
+def flight_key(namespace, payload):
+    """Canonical key for a JSON-serializable payload."""
+    material = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"sf:{namespace}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+
+def _claim(key, lock_timeout, reuse_result, joined):
+    """
+    Returns ('result', value) if a usable result is ready, ('leader', token) if we should
+    make the call, else ('waiting', token of the call in flight). Results are stored with
+    their call's token; without reuse_result only the joined call's result is usable.
+    """
+    result = cache.get(f"{key}:result")
+    if result is not None and (reuse_result or result[0] == joined):
+        return "result", result[1]
+    token = uuid.uuid4().hex
+    if cache.add(f"{key}:lock", token, timeout=lock_timeout):
+        return "leader", token
+    return "waiting", joined or cache.get(f"{key}:lock")
+
+
+def _publish(key, token, value):
+    cache.set(f"{key}:result", (token, value), timeout=RESULT_TTL)
+    cache.delete(f"{key}:lock")
+
+
+def single_flight(key, call, lock_timeout, reuse_result=True):
+    """
+    Returns call()'s result, or the result of an identical call already in flight
+    (or, with reuse_result, one that finished within RESULT_TTL).
+    lock_timeout should cover the longest call; waiters give up and call themselves after it.
+    """
+    give_up_at = time.monotonic() + lock_timeout
+    joined = None
+    while True:
+        role, value = _claim(key, lock_timeout, reuse_result, joined)
+        if role == "result":
+            logger.info(f"Coalesced duplicate upstream call {key}.")
+            return value
+        if role == "leader":
+            try:
+                result = call()
+            except BaseException:
+                cache.delete(f"{key}:lock") # Let a waiter take over
+                raise
+            _publish(key, value, result)
+            return result
+        joined = value
+        if time.monotonic() > give_up_at:
+            logger.warning(f"Gave up waiting on in-flight call {key}; calling upstream directly.")
+            return call()
+        time.sleep(POLL_INTERVAL)
+
+
+async def asingle_flight(key, call, lock_timeout, reuse_result=True):
+    """Async twin of single_flight; call returns an awaitable."""
+    give_up_at = time.monotonic() + lock_timeout
+    joined = None
+    while True:
+        role, value = await sync_to_async(_claim)(key, lock_timeout, reuse_result, joined)
+        if role == "result":
+            logger.info(f"Coalesced duplicate upstream call {key}.")
+            return value
+        if role == "leader":
+            try:
+                result = await call()
+            except BaseException:
+                await sync_to_async(cache.delete)(f"{key}:lock")
+                raise
+            await sync_to_async(_publish)(key, value, result)
+            return result
+        joined = value
+        if time.monotonic() > give_up_at:
+            logger.warning(f"Gave up waiting on in-flight call {key}; calling upstream directly.")
+            return await call()
+        await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,152 @@
+# base/sync.py
+"""
+Delta sync for offline-capable clients: GET /api/sync/?since=<token> (SyncView).
+
+The response holds the categories, card sets, cards and chats created or updated since the
+token (by their updated_at), the ids deleted since then (from Tombstone rows), and the token
+for the next call. Without ?since=, or with a token older than the tombstone retention, it
+is a full snapshot instead, marked "full": true, and the client should replace its copy.
+
+Tombstones are written by delete signal receivers, in the same transaction as the delete,
+with one bulk insert per delete. When a category or set is deleted, the rows the database
+CASCADE-deletes with it get tombstones too.
+
+Tokens are opaque; they encode the time the previous sync started. Each sync looks back
+OVERLAP further than that, so a write that committed late (with an updated_at just before
+the previous sync) is still picked up. A row can therefore come back twice; clients apply
+rows as upserts and deletes by id, which makes that harmless.
+"""
+
+import base64
+import json
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, pre_delete
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Card, CardSet, Category, Chat, Tombstone
+
+logger = logging.getLogger(__name__)
+
+OVERLAP = timedelta(seconds=5)
+PURGE_PROBABILITY = 0.01
+COLLECTIONS = {"categories": Category, "cardsets": CardSet, "cards": Card, "chats": Chat}
+_COLLECTION_OF = {model: name for name, model in COLLECTIONS.items()}
+
+
+def encode_token(moment):
+    return base64.urlsafe_b64encode(json.dumps([moment.isoformat()]).encode()).decode().rstrip("=")
+
+
+def decode_token(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        (moment,) = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        parsed = parse_datetime(moment)
+        if parsed is None:
+            raise ValueError
+        return parsed
+    except (ValueError, TypeError):
+        raise ValidationError({"since": "Invalid sync token."})
+
+
+def retention():
+    return timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+
+
+def changes(user, since):
+    """
+    Returns (querysets by collection, deleted ids by collection, full) for changes after
+    since (a datetime, or None for a full snapshot).
+    """
+    querysets = {
+        "categories": Category.objects.filter(user=user),
+        "cardsets": CardSet.objects.filter(user=user),
+        "cards": Card.objects.filter(card_set__user=user),
+        "chats": Chat.objects.filter(user=user),
+    }
+    full = since is None or since < timezone.now() - retention()
+    deleted = {name: [] for name in COLLECTIONS}
+    if full:
+        return {name: qs.order_by("id") for name, qs in querysets.items()}, deleted, True
+
+    since = since - OVERLAP
+    querysets = {name: qs.filter(updated_at__gt=since).order_by("id") for name, qs in querysets.items()}
+    for collection, object_id in (
+        Tombstone.objects.filter(user=user, deleted_at__gt=since).values_list("collection", "object_id")
+    ):
+        deleted[collection].append(object_id)
+    return querysets, deleted, False
+
+
+def _started_here(instance, origin):
+    # The delete was called on this row, or on a queryset of rows like it, rather than
+    # reaching it through a CASCADE (whose origin has already recorded it)
+    if isinstance(origin, QuerySet):
+        return origin.model is type(instance)
+    return origin is instance
+
+
+def _cascaded(instance):
+    """Ids of the synced rows the database will delete along with instance, by collection."""
+    if isinstance(instance, Category):
+        return {
+            "cardsets": CardSet.objects.filter(category=instance).values_list("id", flat=True),
+            "cards": Card.objects.filter(card_set__category=instance).values_list("id", flat=True),
+        }
+    if isinstance(instance, CardSet):
+        return {"cards": Card.objects.filter(card_set=instance).values_list("id", flat=True)}
+    return {}
+
+
+def collect_tombstones(sender, instance, origin=None, **kwargs):
+    """
+    pre_delete: queues tombstones on the delete's origin. Django sends every pre_delete of
+    a delete before any post_delete, so write_tombstones can insert them all at once.
+    """
+    if not _started_here(instance, origin):
+        return
+    pending = origin.__dict__.setdefault("_pending_tombstones", [])
+    # Cards don't have a user column; their set's owner is looked up when writing
+    owner = ("card_set", instance.card_set_id) if isinstance(instance, Card) else ("user", instance.user_id)
+    pending.append((_COLLECTION_OF[sender], instance.pk, owner))
+    for collection, ids in _cascaded(instance).items():
+        pending.extend((collection, pk, owner) for pk in ids)
+
+
+def write_tombstones(sender, instance, origin=None, **kwargs):
+    """post_delete: the first one for an origin writes everything collect_tombstones queued."""
+    pending = origin.__dict__.pop("_pending_tombstones", None) if origin is not None else None
+    if not pending:
+        return
+    set_ids = {value for _, _, (kind, value) in pending if kind == "card_set"}
+    set_owners = dict(CardSet.objects.filter(id__in=set_ids).values_list("id", "user_id")) if set_ids else {}
+    Tombstone.objects.bulk_create(
+        [
+            Tombstone(
+                user_id=set_owners[value] if kind == "card_set" else value,
+                collection=collection,
+                object_id=object_id,
+            )
+            for collection, object_id, (kind, value) in pending
+        ],
+        batch_size=1000,
+    )
+
+    if random.random() < PURGE_PROBABILITY:
+        purged, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - retention()).delete()
+        if purged:
+            logger.info(f"Purged {purged} expired tombstones.")
+
+
+# Connected per model: a receiver for every sender would stop Django from fast-deleting
+# anything else (chat messages, counters) and make it load each row first
+for _model in COLLECTIONS.values():
+    pre_delete.connect(collect_tombstones, sender=_model, dispatch_uid=f"tombstones:{_model.__name__}")
+    post_delete.connect(write_tombstones, sender=_model, dispatch_uid=f"tombstones:{_model.__name__}")
@@ -0,0 +1,192 @@
+# base/tasks.py
+"""
+Job handlers for the background queue (base/jobs.py), run by `manage.py run_jobs`.
+
+    chat_reply  generates and saves the AI reply to a chat's latest user message
+    tts         synthesizes a clip into the TTS cache; the client then POSTs the same
+                text to the TTS endpoint and gets the cached audio straight away
+    generate_cards
+                writes AI flashcards from notes into a set (base/generation.py),
+                reporting progress per chunk of notes
+    tts_prewarm synthesizes the audio of a whole set's cards into the TTS cache, a few
+                clips at a time, so study mode plays each card without waiting
+
+Handlers may run more than once for the same job (a retry, or a worker that died after
+doing the work), so each checks first whether its work is already done.
+"""
+
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import generation, jobs, ratelimit, tts_cache, tts_chunks
+from .chat import build_prompt_history, save_ai_reply
+from .elevenlabs import SLOW_TTS_VOICE_SETTINGS, TTS_MODEL_ID, TTS_VOICE_SETTINGS, VOICE_ID, open_stream
+from .gemini import GOOGLE_API_KEY, _generate_content
+from .models import CardSet, Chat
+from .serializers import CardSerializer, MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+
+@jobs.handler("chat_reply")
+def chat_reply(job):
+    try:
+        chat_session = Chat.objects.get(pk=job.payload["chat_id"], user_id=job.user_id)
+    except Chat.DoesNotExist:
+        raise jobs.PermanentJobError("The chat session was deleted.")
+
+    # An earlier attempt may have saved the reply before its worker went away
+    ai_message_id = job.payload.get("ai_message_id")
+    existing = chat_session.messages.filter(pk=ai_message_id).first() if ai_message_id else None
+    if existing is None:
+        text, ok = _generate_content(
+            build_prompt_history(chat_session), GOOGLE_API_KEY, use_cache=not job.payload.get("fresh"),
+        )
+        if not ok:
+            raise RuntimeError(text) # A user-facing message, kept as the job's error if retries run out
+        with transaction.atomic():
+            existing = save_ai_reply(chat_session, text)
+            # Saved together with the reply, so a retry finds it; without the lease, another
+            # worker owns the job and the reply is rolled back
+            if not jobs.record(job, ai_message_id=existing.id):
+                raise RuntimeError("Lost the job's lease before the reply was saved.")
+    return {"ai_message": MessageSerializer(existing).data}
+
+
+def synthesize_to_cache(text, voice_settings):
+    """
+    Makes sure the clip for text is in the TTS cache. Returns False if another request
+    is downloading it right now (it will be cached once that finishes).
+    """
+    key = tts_cache.cache_key(text, VOICE_ID, TTS_MODEL_ID, voice_settings)
+    if tts_cache.lookup(key):
+        return True
+    fill = tts_cache.begin_fill(key)
+    if fill is None:
+        return False
+
+    try:
+        response = open_stream(text, voice_settings)
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as http_err:
+        fill.abort()
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise jobs.PermanentJobError(f"TTS service error: {http_err}")
+        raise
+    except Exception:
+        fill.abort()
+        raise
+    for _chunk in fill.tee(response.iter_content(chunk_size=8192)):
+        pass # tee() writes the clip to the cache as it is read
+    return True
+
+
+@jobs.handler("tts")
+def tts(job):
+    voice_settings = SLOW_TTS_VOICE_SETTINGS if job.payload.get("slow") else TTS_VOICE_SETTINGS
+    # Long texts are cached sentence by sentence, the way the TTS endpoints play them
+    for segment in tts_chunks.segments(job.payload["text"]):
+        if not synthesize_to_cache(segment, voice_settings):
+            raise RuntimeError("The clip is being downloaded by another request.") # Retried after a short backoff
+    return {"cached": True}
+
+
+@jobs.handler("generate_cards")
+def generate_cards(job):
+    card_set = CardSet.objects.filter(pk=job.payload["card_set_id"], user_id=job.user_id).first()
+    if card_set is None:
+        raise jobs.PermanentJobError("The card set was deleted.")
+    # A re-run skips the terms an earlier attempt already saved
+    cards, skipped, errors = generation.generate_cards(
+        card_set, job.payload["notes"], job.payload["count"], GOOGLE_API_KEY,
+        on_progress=lambda done, total: jobs.set_progress(job, done, total),
+    )
+    return {
+        "card_set": card_set.id,
+        "created": len(cards),
+        "skipped": skipped,
+        "errors": errors,
+        "cards": CardSerializer(cards, many=True).data,
+    }
+
+
+def _synthesize_in_thread(text, voice_settings):
+    try:
+        return synthesize_to_cache(text, voice_settings)
+    finally:
+        connections.close_all() # This thread's own connections (the cache index is in the DB)
+
+
+@jobs.handler("tts_prewarm")
+def tts_prewarm(job):
+    """
+    Clips already in the cache are skipped. Each new one counts against the user's
+    "tts_prewarm" quota, given back if the clip fails or another request turns out to be
+    downloading it; when the quota runs out the job stops and reports quota_exhausted.
+    A re-run redoes only what's missing. Progress updates renew the job's lease, so a big
+    set can take longer than its timeout; if the lease is lost anyway, the job stops.
+    """
+    card_set = CardSet.objects.filter(pk=job.payload["card_set_id"], user_id=job.user_id).first()
+    if card_set is None:
+        raise jobs.PermanentJobError("The card set was deleted.")
+    voice_settings = SLOW_TTS_VOICE_SETTINGS if job.payload.get("slow") else TTS_VOICE_SETTINGS
+    fields = ["term", "definition"] if job.payload.get("definitions") else ["term"]
+
+    texts = {} # cache key -> clip text (a sentence, for long texts), in card order
+    for values in card_set.cards.order_by("id").values_list(*fields):
+        for text in values:
+            if text and text.strip():
+                for segment in tts_chunks.segments(text):
+                    texts.setdefault(tts_cache.cache_key(segment, VOICE_ID, TTS_MODEL_ID, voice_settings), segment)
+    missing = [text for key, text in texts.items() if not tts_cache.lookup(key)]
+    cached = len(texts) - len(missing)
+    done = cached
+    jobs.set_progress(job, done, len(texts))
+
+    futures = []
+    quota_exhausted = lease_lost = False
+    with ThreadPoolExecutor(max_workers=settings.TTS_PREWARM_CONCURRENCY) as executor:
+        running = set()
+        for text in missing:
+            if len(running) >= settings.TTS_PREWARM_CONCURRENCY:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                done += len(finished)
+                if not jobs.set_progress(job, done, len(texts)):
+                    lease_lost = True # Another worker has the job now; let it carry on
+                    break
+            # Quota is taken one clip at a time, just before the clip is requested
+            if not ratelimit.check("tts_prewarm", job.user).allowed:
+                quota_exhausted = True
+                break
+            future = executor.submit(_synthesize_in_thread, text, voice_settings)
+            futures.append(future)
+            running.add(future)
+
+    synthesized = in_progress = failed = 0
+    for future in futures:
+        if future.exception() is not None:
+            failed += 1
+            logger.warning(f"Pre-warming audio for set {card_set.id} failed for one clip: {future.exception()}")
+        elif future.result():
+            synthesized += 1
+            continue
+        else:
+            in_progress += 1 # Another request is downloading it; it'll be cached when that finishes
+        ratelimit.refund("tts_prewarm", job.user) # Only clips we synthesized count
+    if lease_lost:
+        raise jobs.PermanentJobError("The job was taken over by another worker.") # Its outcome is discarded
+    jobs.set_progress(job, cached + len(futures), len(texts))
+    if failed and failed == len(futures):
+        raise RuntimeError(f"None of the {failed} clips could be generated.") # Retried; cached clips are skipped
+    return {
+        "total": len(texts),
+        "already_cached": cached,
+        "synthesized": synthesized,
+        "in_progress": in_progress,
+        "failed": failed,
+        "quota_exhausted": quota_exhausted,
+    }
@@ -0,0 +1,81 @@
+# base/tests/fakes.py
+"""Stand-ins for the upstream HTTP responses (Gemini, ElevenLabs) and fixtures shared by the tests."""
+
+import json
+import shutil
+import tempfile
+
+import requests
+from django.test import override_settings
+
+
+def use_temp_tts_cache(testcase, **overrides):
+    """Points the TTS cache at a fresh directory for the duration of testcase's test."""
+    cache_dir = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+    settings_override = override_settings(TTS_CACHE_ENABLED=True, TTS_CACHE_DIR=cache_dir, **overrides)
+    settings_override.enable()
+    testcase.addCleanup(settings_override.disable)
+    return cache_dir
+
+
+def gemini_body(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": "STOP"}]}
+
+
+def gemini_sse(*texts, finish=True):
+    """alt=sse lines streaming texts, ending with a finishReason unless finish is False."""
+    lines = []
+    for i, text in enumerate(texts):
+        candidate = {"content": {"parts": [{"text": text}]}}
+        if finish and i == len(texts) - 1:
+            candidate["finishReason"] = "STOP"
+        lines += [f"data: {json.dumps({'candidates': [candidate]})}", ""]
+    return lines
+
+
+class FakeResponse:
+    """The parts of requests.Response the upstream helpers use."""
+
+    def __init__(self, status_code=200, json_body=None, lines=None, content=b"", headers=None):
+        self.status_code = status_code
+        self._json = json_body
+        self._lines = lines or []
+        self.content = content
+        self.headers = headers or {}
+        self.text = json.dumps(json_body) if json_body is not None else content.decode("utf-8", "replace")
+        self.closed = False
+
+    def json(self):
+        if self._json is None:
+            raise ValueError("No JSON body")
+        return self._json
+
+    def iter_lines(self, decode_unicode=False):
+        yield from self._lines
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """http_session() replacement: answers each post() with the next of responses (or calls it)."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response(url, **kwargs) if callable(response) else response
@@ -0,0 +1,70 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from base import async_views, upstream
+from base.models import Chat
+
+
+class AsyncChatViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("async", password="pw")
+        self.chat = Chat.objects.create(user=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        patcher = mock.patch("base.async_views.GOOGLE_API_KEY", "test-key")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _request(self, data, query="", token=True):
+        headers = {"Authorization": f"Bearer {self.token}"} if token else {}
+        return AsyncRequestFactory().post(
+            f"/api/chats/{self.chat.id}/messages/{query}", json.dumps(data),
+            content_type="application/json", headers=headers,
+        )
+
+    async def test_requires_a_bearer_token(self):
+        response = await async_views.chat_message_create(self._request({"content": "Hi"}, token=False), self.chat.id)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_saves_both_messages_and_returns_the_reply(self):
+        with mock.patch("base.async_views._acall_gemini_api_with_history", mock.AsyncMock(return_value="Hello")) as call:
+            response = await async_views.chat_message_create(self._request({"content": "Hi"}), self.chat.id)
+        self.assertEqual(response.status_code, 201)
+        body = json.loads(response.content)
+        self.assertEqual((body["user_message"]["content"], body["ai_message"]["content"]), ("Hi", "Hello"))
+        history = call.call_args[0][0]
+        self.assertEqual(history[-1], {"role": "user", "parts": [{"text": "Hi"}]})
+        self.assertEqual(await self.chat.messages.acount(), 2)
+
+    async def test_streams_deltas(self):
+        async def deltas(*args):
+            for delta in ("Hel", "lo"):
+                yield delta
+
+        with mock.patch("base.async_views._astream_gemini_api_with_history", deltas):
+            response = await async_views.chat_message_create(self._request({"content": "Hi"}, "?stream=1"), self.chat.id)
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body.count("event: delta"), 2)
+        self.assertTrue(body.rstrip().startswith("event: user_message"))
+        self.assertIn('"content": "Hello"', body.split("event: ai_message")[1])
+
+    async def test_other_users_chat_is_not_found(self):
+        other = await User.objects.acreate(username="other")
+        foreign = await Chat.objects.acreate(user=other)
+        response = await async_views.chat_message_create(self._request({"content": "Hi"}), foreign.id)
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncClientPoolTests(TestCase):
+    async def test_one_client_per_event_loop(self):
+        client = upstream.async_http_client()
+        self.assertIs(upstream.async_http_client(), client)
+        await client.aclose()
+
+    def test_sync_session_is_shared(self):
+        self.assertIs(upstream.http_session(), upstream.http_session())
@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from base.models import Card, CardSet, Tombstone
+
+
+class CardBulkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("bulk", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.card_set = CardSet.objects.create(user=self.user, name="French")
+        self.other_set = CardSet.objects.create(user=User.objects.create_user("other", password="pw"), name="Theirs")
+        self.cards = [Card.objects.create(card_set=self.card_set, term=t, definition=t) for t in ("un", "deux", "trois")]
+
+    def _post(self, body):
+        return self.client.post("/api/cards/bulk/", body, format="json")
+
+    def test_create_update_and_delete_in_one_request(self):
+        response = self._post({
+            "create": [{"card_set": self.card_set.id, "term": "quatre", "definition": "four"}],
+            "update": [{"id": self.cards[0].id, "definition": "one"}],
+            "delete": [self.cards[2].id],
+        })
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["create"][0]["status"], 201)
+        self.assertEqual(body["create"][0]["card"]["term"], "quatre")
+        self.assertEqual(body["update"][0]["card"]["definition"], "one")
+        self.assertEqual(body["delete"], [{"status": 204, "id": self.cards[2].id}])
+        self.assertEqual(
+            sorted(Card.objects.values_list("term", "definition")), [("deux", "deux"), ("quatre", "four"), ("un", "one")]
+        )
+        self.assertTrue(Tombstone.objects.filter(collection="cards", object_id=self.cards[2].id).exists())
+
+    def test_one_invalid_item_applies_nothing(self):
+        response = self._post({
+            "create": [
+                {"card_set": self.card_set.id, "term": "quatre", "definition": "four"},
+                {"card_set": self.other_set.id, "term": "cinq", "definition": "five"}, # Not ours
+            ],
+            "update": [{"id": self.cards[0].id, "term": ""}], # Blank term
+            "delete": [self.cards[1].id, 999999],
+        })
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual([item["status"] for item in body["create"]], [424, 400])
+        self.assertIn("card_set", body["create"][1]["errors"])
+        self.assertIn("term", body["update"][0]["errors"])
+        self.assertEqual([item["status"] for item in body["delete"]], [424, 400])
+        self.assertEqual(Card.objects.count(), 3)
+        self.assertEqual(Card.objects.get(id=self.cards[0].id).term, "un")
+
+    def test_same_card_twice_is_rejected(self):
+        response = self._post({"update": [{"id": self.cards[0].id, "term": "a"}], "delete": [self.cards[0].id]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("more than once", response.json()["delete"][0]["errors"]["id"][0])
+
+    def test_update_needs_an_id(self):
+        response = self._post({"update": [{"term": "orphan"}]})
+        self.assertEqual(response.json()["update"][0]["errors"]["id"], ["This field is required."])
+
+    def test_other_users_cards_are_not_found(self):
+        theirs = Card.objects.create(card_set=self.other_set, term="x", definition="y")
+        response = self._post({"delete": [theirs.id]})
+        self.assertEqual(response.json()["delete"][0]["errors"]["id"], ["Card not found."])
+        self.assertTrue(Card.objects.filter(id=theirs.id).exists())
+
+    def test_malformed_bodies(self):
+        self.assertEqual(self._post([1, 2]).status_code, 400)
+        self.assertEqual(self._post({"create": {"term": "x"}}).status_code, 400)
+        with override_settings(CARD_BULK_MAX_OPERATIONS=2):
+            self.assertEqual(self._post({"delete": [c.id for c in self.cards]}).status_code, 400)
@@ -0,0 +1,63 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base.models import PREVIEW_LENGTH, Chat
+
+
+class AddMessageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("writer", password="pw")
+        self.chat = Chat.objects.create(user=self.user)
+
+    def test_counters_follow_each_message(self):
+        self.chat.add_message("user", "How do I say   hello?")
+        reply = self.chat.add_message("ai", "Bonjour!")
+        stored = Chat.objects.get(pk=self.chat.pk)
+        self.assertEqual(stored.message_count, 2)
+        self.assertEqual(stored.last_message_at, reply.timestamp)
+        self.assertEqual(stored.last_message_preview, "Bonjour!")
+        self.assertEqual(self.chat.message_count, 2) # The instance is kept in step too
+
+    def test_long_preview_is_cut(self):
+        self.chat.add_message("user", "word " * 100)
+        preview = Chat.objects.get(pk=self.chat.pk).last_message_preview
+        self.assertEqual(len(preview), PREVIEW_LENGTH)
+        self.assertTrue(preview.endswith("..."))
+
+    def test_first_user_message_names_the_chat_once(self):
+        self.chat.add_message("ai", "Welcome!") # AI messages don't name it
+        self.assertIsNone(Chat.objects.get(pk=self.chat.pk).title)
+        self.chat.add_message("user", "one two three four five six seven eight")
+        self.chat.add_message("user", "Something else entirely")
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).title, "one two three four five six seven...")
+
+    def test_title_set_by_a_concurrent_turn_is_kept(self):
+        Chat.objects.filter(pk=self.chat.pk).update(title="Named elsewhere")
+        self.chat.add_message("user", "Our first message") # This instance still thinks it is untitled
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).title, "Named elsewhere")
+
+
+class SessionCapTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("capped", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_free_tier_cap_reads_the_stored_count(self):
+        chat = Chat.objects.create(user=self.user, message_count=50)
+        with mock.patch("base.views.FREE_LIMIT_MESSAGES", ["Session limit reached."]):
+            response = self.client.post(f"/api/chats/{chat.id}/messages/", {"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()["error"], "Session limit reached.")
+        self.assertEqual(chat.messages.count(), 0)
+
+    def test_list_shows_the_preview(self):
+        chat = Chat.objects.create(user=self.user)
+        chat.add_message("user", "Hello there")
+        row = self.client.get("/api/chats/").json()[0]
+        self.assertEqual(
+            (row["message_count"], row["last_message_preview"], row["title"]), (1, "Hello there", "Hello there")
+        )
@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base import gemini
+from base.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from base.models import Chat
+
+from .fakes import FakeResponse, FakeSession, gemini_body
+
+PROMPT = [{"role": "user", "parts": [{"text": "Hi"}]}]
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+        patcher = mock.patch("base.circuit.time.time", return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _trip(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertIs(self.breaker.allow_request(), True)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.retry_after(), 31)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        self._trip()
+        self.clock.return_value = 1031.0
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertFalse(self.breaker.is_open())
+        self.assertEqual(self.breaker.allow_request(), HALF_OPEN)
+        self.assertTrue(self.breaker.is_open()) # The probe is in flight
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_released_probe_can_be_taken_again(self):
+        self._trip()
+        self.clock.return_value = 1031.0
+        self.breaker.allow_request()
+        self.breaker.release_probe()
+        self.assertEqual(self.breaker.allow_request(), HALF_OPEN)
+
+    def test_probe_outcome_closes_or_reopens(self):
+        self._trip()
+        self.clock.return_value = 1031.0
+        self.breaker.allow_request()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+
+        self.clock.return_value = 1062.0
+        self.breaker.allow_request()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+
+class GeminiCircuitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for target in ("base.gemini.time.sleep", "base.gemini.gemini_latency.record"):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _call(self, session):
+        with mock.patch("base.gemini.http_session", return_value=session):
+            return gemini._generate_content_once(gemini._build_payload(PROMPT), "key")
+
+    def test_success(self):
+        self.assertEqual(self._call(FakeSession(FakeResponse(json_body=gemini_body("Hello")))), ("Hello", True))
+
+    def test_repeated_failures_open_the_circuit_and_then_fail_fast(self):
+        session = FakeSession(FakeResponse(status_code=503, json_body={}))
+        for _ in range(2): # 3 attempts each, threshold 5
+            text, ok = self._call(session)
+            self.assertFalse(ok)
+        self.assertTrue(gemini.gemini_breaker.is_open())
+        calls = len(session.calls)
+        self.assertEqual(self._call(session), (gemini.CIRCUIT_OPEN_MESSAGE, False))
+        self.assertEqual(len(session.calls), calls)
+
+    def test_client_error_does_not_count_as_an_upstream_failure(self):
+        session = FakeSession(FakeResponse(status_code=400, json_body={}))
+        for _ in range(3):
+            self._call(session)
+        self.assertFalse(gemini.gemini_breaker.is_open())
+
+    def test_probe_that_gets_a_client_error_gives_the_slot_back(self):
+        with mock.patch.object(gemini.gemini_breaker, "state", return_value=HALF_OPEN):
+            self._call(FakeSession(FakeResponse(status_code=400, json_body={})))
+            self.assertEqual(gemini.gemini_breaker.allow_request(), HALF_OPEN)
+
+    def test_retries_stop_at_the_deadline(self):
+        session = FakeSession(FakeResponse(status_code=500, json_body={}))
+        with self.settings(GEMINI_DEADLINE_SECONDS=3):
+            # The first backoff (2s) plus a minimal attempt (2s) doesn't fit in 3s
+            text, ok = self._call(session)
+        self.assertFalse(ok)
+        self.assertEqual(len(session.calls), 1)
+
+
+class ChatCircuitOpenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("chatter", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat = Chat.objects.create(user=self.user)
+
+    def test_open_circuit_refuses_before_saving_the_message(self):
+        with mock.patch.object(gemini.gemini_breaker, "is_open", return_value=True), \
+                mock.patch.object(gemini.gemini_breaker, "retry_after", return_value=12):
+            response = self.client.post(f"/api/chats/{self.chat.id}/messages/", {"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "12")
+        self.assertEqual(self.chat.messages.count(), 0)
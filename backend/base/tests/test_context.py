@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from base import chat
+from base.context import SUMMARY_ACK, estimate_tokens, plan_context
+from base.models import Chat
+
+
+def _texts(history):
+    return [[part["text"] for part in turn["parts"]] for turn in history]
+
+
+@override_settings(CHAT_CONTEXT_TOKEN_BUDGET=100, CHAT_CONTEXT_RECENT_MESSAGES=3)
+class ContextPlanTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("talker", password="pw")
+        self.chat = Chat.objects.create(user=user)
+
+    def _add(self, count, start=0, words=10):
+        for i in range(start, start + count):
+            # ~40 characters: 10 tokens each
+            self.chat.add_message("user" if i % 2 == 0 else "ai", f"m{i} " + "x" * (words * 4 - 4))
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 1)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(estimate_tokens("abcdefghi"), 3)
+
+    def test_everything_is_sent_while_it_fits(self):
+        self._add(4)
+        plan = plan_context(self.chat)
+        self.assertEqual(plan.to_fold, [])
+        self.assertEqual([turn["role"] for turn in plan.prompt_history()], ["user", "model", "user", "model"])
+
+    def test_older_messages_are_folded_once_over_budget(self):
+        self._add(12)
+        plan = plan_context(self.chat)
+        self.assertEqual(len(plan.recent), 3) # CHAT_CONTEXT_RECENT_MESSAGES
+        self.assertEqual(len(plan.to_fold), 9)
+        self.assertIn("m0 ", plan.summary_prompt()[0]["parts"][0]["text"])
+        self.assertIn("m8 ", plan.summary_prompt()[0]["parts"][0]["text"])
+
+    def test_applied_summary_replaces_the_folded_messages(self):
+        self._add(12)
+        plan = plan_context(self.chat)
+        last_folded = plan.to_fold[-1]["id"]
+        self.assertTrue(plan.apply_summary("  The user asked about x.  "))
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.summary, "The user asked about x.")
+        self.assertEqual(self.chat.summarized_up_to_id, last_folded)
+
+        history = plan_context(self.chat).prompt_history()
+        self.assertEqual(history[0]["parts"][0]["text"], "Summary of our conversation so far:\nThe user asked about x.")
+        self.assertEqual(len(history), 4) # Summary exchange plus 3 recent messages, 2 merged
+
+    def test_leading_model_turn_after_the_summary_is_merged(self):
+        self._add(12)
+        plan = plan_context(self.chat)
+        plan.apply_summary("Summary")
+        self.assertEqual(plan.recent[0]["sender"], "ai") # m9
+        history = plan.prompt_history()
+        roles = [turn["role"] for turn in history]
+        self.assertEqual(roles, ["user", "model", "user", "model"])
+        self.assertEqual(_texts(history)[1][0], SUMMARY_ACK)
+        self.assertTrue(_texts(history)[1][1].startswith("m9 "))
+
+    def test_unfolded_messages_stay_in_the_prompt_when_the_summary_fails(self):
+        self._add(12)
+        plan = plan_context(self.chat)
+        history = plan.prompt_history() # apply_summary() never ran
+        self.assertEqual(len(history), 12)
+        self.assertTrue(_texts(history)[0][0].startswith("m0 "))
+
+    def test_summary_that_lost_a_race_keeps_the_messages(self):
+        self._add(12)
+        plan = plan_context(self.chat)
+        other = plan_context(Chat.objects.get(pk=self.chat.pk))
+        self.assertTrue(other.apply_summary("From a concurrent turn"))
+        self.assertFalse(plan.apply_summary("Ours"))
+        self.assertEqual(len(plan.to_fold), 9)
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).summary, "From a concurrent turn")
+
+    def test_view_folds_with_one_summary_call(self):
+        self._add(12)
+        with mock.patch("base.chat._generate_content", return_value=("Summary", True)) as generate:
+            history = chat.build_prompt_history(self.chat)
+        generate.assert_called_once()
+        self.assertEqual(len(history), 4)
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).summary, "Summary")
+
+    def test_view_sends_everything_when_the_summary_call_fails(self):
+        self._add(12)
+        with mock.patch("base.chat._generate_content", return_value=("Sorry, error", False)):
+            history = chat.build_prompt_history(self.chat)
+        self.assertEqual(len(history), 12)
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).summary, "")
@@ -0,0 +1,62 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from base.counters import DatabaseCounterBackend, counters
+from base.models import Counter
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.counters = DatabaseCounterBackend()
+
+    def test_incr_creates_then_increments(self):
+        self.assertEqual(self.counters.get("c"), 0)
+        self.assertEqual(self.counters.incr("c"), 1)
+        self.assertEqual(self.counters.incr("c", 5), 6)
+        self.assertEqual(self.counters.get("c"), 6)
+
+    def test_compare_and_set(self):
+        self.assertTrue(self.counters.compare_and_set("c", None, 3))
+        self.assertFalse(self.counters.compare_and_set("c", None, 4)) # Already set
+        self.assertFalse(self.counters.compare_and_set("c", 2, 4))
+        self.assertTrue(self.counters.compare_and_set("c", 3, 4))
+        self.assertEqual(self.counters.get("c"), 4)
+
+    def test_expired_key_reads_as_unset_and_restarts(self):
+        self.counters.incr("c", 7, ttl=60)
+        Counter.objects.filter(key="c").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.counters.get("c"), 0)
+        self.assertEqual(self.counters.incr("c", ttl=60), 1)
+        self.assertTrue(self.counters.compare_and_set("c", 1, 2))
+
+    def test_ttl_is_set_on_create_only(self):
+        self.counters.incr("c", ttl=60)
+        expires_at = Counter.objects.get(key="c").expires_at
+        self.counters.incr("c", ttl=3600)
+        self.assertEqual(Counter.objects.get(key="c").expires_at, expires_at) # Still a fixed window
+
+    def test_losing_the_create_race_increments_the_winners_row(self):
+        real_create = self.counters._create
+
+        def create_after_someone_else(key, value, now, ttl):
+            Counter.objects.create(key=key, value=10)
+            return real_create(key, value, now, ttl)
+
+        with mock.patch.object(self.counters, "_create", side_effect=create_after_someone_else):
+            self.assertEqual(self.counters.incr("c"), 11)
+
+    def test_purge_and_delete(self):
+        self.counters.incr("old", ttl=60)
+        self.counters.incr("live")
+        Counter.objects.filter(key="old").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.counters.purge_expired()
+        self.assertEqual(list(Counter.objects.values_list("key", flat=True)), ["live"])
+        self.counters.delete("live")
+        self.assertEqual(self.counters.get("live"), 0)
+
+    def test_configured_backend_is_shared(self):
+        self.assertIsInstance(counters(), DatabaseCounterBackend)
+        self.assertIs(counters(), counters())
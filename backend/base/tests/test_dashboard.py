@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base.models import Card, CardSet, Category, Chat
+from base.views import DASHBOARD_RECENT_CHATS
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("home", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        languages = Category.objects.create(user=self.user, name="Languages")
+        Category.objects.create(user=self.user, name="Empty")
+        french = CardSet.objects.create(user=self.user, name="French", category=languages)
+        CardSet.objects.create(user=self.user, name="Dutch", category=languages)
+        loose = CardSet.objects.create(user=self.user, name="Loose ends")
+        for i in range(3):
+            Card.objects.create(card_set=french, term=f"mot {i}", definition=f"word {i}")
+        Card.objects.create(card_set=loose, term="x", definition="y")
+        for i in range(DASHBOARD_RECENT_CHATS + 2):
+            Chat.objects.create(user=self.user, title=f"Chat {i}").add_message("user", f"message {i}")
+        # Someone else's data stays out of it
+        other = User.objects.create_user("other", password="pw")
+        CardSet.objects.create(user=other, name="Not mine")
+
+    def test_everything_in_one_response(self):
+        body = self.client.get("/api/dashboard/").json()
+        self.assertEqual([c["name"] for c in body["categories"]], ["Empty", "Languages"])
+        languages = body["categories"][1]
+        self.assertEqual([(s["name"], s["card_count"]) for s in languages["sets"]], [("Dutch", 0), ("French", 3)])
+        self.assertEqual([(s["name"], s["card_count"]) for s in body["uncategorized_sets"]], [("Loose ends", 1)])
+        self.assertEqual(len(body["recent_chats"]), DASHBOARD_RECENT_CHATS)
+        self.assertEqual(body["recent_chats"][0]["last_message_preview"], f"message {DASHBOARD_RECENT_CHATS + 1}")
+        self.assertEqual(body["totals"], {"categories": 2, "sets": 3, "cards": 4})
+
+    def test_query_count_does_not_grow_with_sets(self):
+        with self.assertNumQueries(4):
+            self.client.get("/api/dashboard/")
+        category = Category.objects.get(name="Languages")
+        for i in range(10):
+            CardSet.objects.create(user=self.user, name=f"Extra {i}", category=category)
+        with self.assertNumQueries(4):
+            self.client.get("/api/dashboard/")
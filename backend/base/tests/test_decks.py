@@ -0,0 +1,94 @@
+import io
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base import decks
+from base.models import Card, CardSet
+
+
+def _rows(content, fmt):
+    return list(decks.iter_rows(io.BytesIO(content.encode("utf-8")), fmt))
+
+
+class DeckParsingTests(TestCase):
+    def test_format_detection(self):
+        self.assertEqual(decks.detect_format("Deck.TXT"), "tsv")
+        self.assertEqual(decks.detect_format("deck.csv", "json"), "json")
+        with self.assertRaises(decks.DeckFormatError):
+            decks.detect_format("deck.xlsx")
+
+    def test_csv_with_and_without_a_header(self):
+        with_header = _rows("\ufeffnotes,definition,term\nx,cat,chat\n\n", "csv")
+        self.assertEqual(with_header, [(2, {"term": "chat", "definition": "cat"})])
+        self.assertEqual(_rows("chat,cat\nchien\n", "csv")[1], (2, {"term": "chien", "definition": ""}))
+
+    def test_anki_tsv_header_lines(self):
+        rows = _rows("#separator:tab\n#columns:Definition\tTerm\ncat\tchat\n", "tsv")
+        self.assertEqual(rows, [(3, {"term": "chat", "definition": "cat"})])
+
+    def test_json_is_read_item_by_item(self):
+        content = json.dumps([{"term": f"mot {i}", "definition": "x" * 50} for i in range(20)] + ["oops"])
+        with mock.patch("base.decks.JSON_READ_SIZE", 64): # Items span several reads
+            rows = _rows(content, "json")
+        self.assertEqual(len(rows), 21)
+        self.assertEqual(rows[19], (20, {"term": "mot 19", "definition": "x" * 50}))
+        self.assertEqual(rows[20], (21, None))
+
+    def test_broken_json(self):
+        for content in ('{"term": "x"}', '[{"term": "x"', '[{"term": }]'):
+            with self.assertRaises(decks.DeckFormatError):
+                _rows(content, "json")
+
+
+class DeckImportExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("importer", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _import(self, name, content, **data):
+        upload = SimpleUploadedFile(name, content.encode("utf-8"))
+        return self.client.post("/api/cardsets/import/", {"file": upload, **data}, format="multipart")
+
+    def test_import_into_a_new_set_skips_bad_rows(self):
+        response = self._import("Verbs.csv", "term,definition\nêtre,to be\n,missing term\navoir,to have\n")
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["created"], body["skipped"]), (2, 1))
+        self.assertEqual(body["errors"], [{"row": 3, "error": "Term and definition are required."}])
+        card_set = CardSet.objects.get(id=body["card_set"])
+        self.assertEqual(card_set.name, "Verbs")
+        self.assertEqual(sorted(card_set.cards.values_list("term", flat=True)), ["avoir", "être"])
+
+    def test_unreadable_file_creates_nothing(self):
+        response = self._import("deck.json", '[{"term": "a", "definition": "b"}, {')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardSet.objects.exists())
+        self.assertFalse(Card.objects.exists())
+
+    def test_import_into_someone_elses_set_is_refused(self):
+        theirs = CardSet.objects.create(user=User.objects.create_user("other", password="pw"), name="Theirs")
+        self.assertEqual(self._import("deck.csv", "a,b\n", card_set=theirs.id).status_code, 404)
+
+    def test_export_round_trips(self):
+        card_set = CardSet.objects.create(user=self.user, name="Mes mots")
+        Card.objects.create(card_set=card_set, term="chat, le", definition='a "cat"')
+        Card.objects.create(card_set=card_set, term="chien", definition="dog")
+
+        response = self.client.get(f"/api/cardsets/{card_set.id}/export/", {"type": "csv"})
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="mes-mots.csv"')
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(_rows(content, "csv"), [
+            (2, {"term": "chat, le", "definition": 'a "cat"'}), (3, {"term": "chien", "definition": "dog"}),
+        ])
+
+        exported = json.loads(b"".join(self.client.get(f"/api/cardsets/{card_set.id}/export/", {"type": "json"}).streaming_content))
+        self.assertEqual(exported[1], {"term": "chien", "definition": "dog", "term_image": None, "definition_image": None})
+
+        tsv = b"".join(self.client.get(f"/api/cardsets/{card_set.id}/export/", {"type": "tsv"}).streaming_content).decode()
+        self.assertEqual(len(_rows(tsv, "tsv")), 2)
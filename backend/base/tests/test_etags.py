@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from base import versions
+from base.models import Card, CardSet
+
+
+class ETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("cacher", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.card_set = CardSet.objects.create(user=self.user, name="French")
+        Card.objects.create(card_set=self.card_set, term="chat", definition="cat")
+        self.url = f"/api/cards/?card_set={self.card_set.id}"
+
+    def _get(self, url=None, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(url or self.url, **headers)
+
+    def test_unchanged_collection_answers_304_without_reading_it(self):
+        etag = self._get()["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self._get(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse([q for q in queries if "base_card" in q["sql"]])
+
+    def test_writes_change_the_etag(self):
+        etag = self._get()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/cards/", {"card_set": self.card_set.id, "term": "chien", "definition": "dog"})
+        response = self._get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_deleting_a_set_also_changes_its_cards(self):
+        etag = self._get()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/cardsets/{self.card_set.id}/")
+        self.assertEqual(self._get(etag=etag).status_code, 200)
+
+    def test_etag_differs_per_query_and_per_user(self):
+        etag = self._get()["ETag"]
+        self.assertNotEqual(self._get(self.url + "&fields=term")["ETag"], etag)
+        self.assertEqual(self._get(self.url + "&fields=term", etag=etag).status_code, 200)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("other", password="pw"))
+        response = other.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_version_starts_from_the_clock_and_bumps_on_commit(self):
+        first = versions.current(self.user.id, "cards")
+        self.assertGreater(first, 1_000_000_000_000) # Milliseconds since the epoch
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            versions.bump(self.user.id, "cards")
+        self.assertEqual(versions.current(self.user.id, "cards"), first) # Not before the commit
+        for callback in callbacks:
+            callback()
+        self.assertEqual(versions.current(self.user.id, "cards"), first + 1)
@@ -0,0 +1,162 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import gemini, gemini_cache
+from base.counters import counters
+from base.models import Chat, GeminiCacheEntry
+
+from .fakes import FakeResponse, FakeSession, gemini_body, gemini_sse
+
+PROMPT = [{"role": "user", "parts": [{"text": "Explain 'photosynthesis'."}]}]
+
+
+@override_settings(GEMINI_RESPONSE_CACHE_MAX_BYTES=100)
+class GeminiCacheStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_key_ignores_whitespace_and_unicode_form_but_not_config(self):
+        key = gemini_cache.cache_key("url", {"contents": [{"parts": [{"text": "Café  au lait"}]}]})
+        same = gemini_cache.cache_key("url", {"contents": [{"parts": [{"text": " Café au\nlait "}]}]})
+        self.assertEqual(key, same)
+        configured = {"contents": [{"parts": [{"text": "Café au lait"}]}], "generationConfig": {"temperature": 0}}
+        self.assertNotEqual(gemini_cache.cache_key("url", configured), key)
+        self.assertNotEqual(gemini_cache.cache_key("other-url", {"contents": [{"parts": [{"text": "Café au lait"}]}]}), key)
+
+    def test_hit_miss_and_ttl(self):
+        self.assertIsNone(gemini_cache.get("k"))
+        gemini_cache.put("k", "Reply", ttl=60)
+        self.assertEqual(gemini_cache.get("k"), "Reply")
+        with mock.patch("base.gemini_cache.timezone.now", return_value=timezone.now() + timedelta(seconds=61)):
+            self.assertIsNone(gemini_cache.get("k"))
+
+    def test_stats_count_hits_and_misses(self):
+        before = gemini_cache.stats()
+        gemini_cache.put("k", "Reply")
+        gemini_cache.get("k")
+        gemini_cache.get("k")
+        gemini_cache.get("missing")
+        after = gemini_cache.stats()
+        self.assertEqual((after["hits"] - before["hits"], after["misses"] - before["misses"]), (2, 1))
+        self.assertEqual((after["entries"], after["bytes"]), (1, 5))
+
+    def test_size_is_kept_as_a_running_total(self):
+        gemini_cache.put("a", "x" * 30)
+        gemini_cache.put("b", "x" * 20)
+        gemini_cache.put("a", "x" * 10) # Replacing an entry counts only the difference
+        self.assertEqual(counters().get(gemini_cache.TOTAL_BYTES_KEY), 30)
+        with mock.patch("base.gemini_cache.evict") as evict:
+            gemini_cache.put("c", "x" * 40)
+        evict.assert_not_called() # 70 bytes: still under the limit, and the table wasn't summed
+        self.assertEqual(counters().get(gemini_cache.TOTAL_BYTES_KEY), 70)
+
+    def test_expired_then_least_recently_used_entries_are_evicted(self):
+        now = timezone.now()
+        for index, key in enumerate(["old", "used", "expired"]):
+            gemini_cache.put(key, "x" * 30)
+            GeminiCacheEntry.objects.filter(key=key).update(last_accessed_at=now - timedelta(hours=3 - index))
+        GeminiCacheEntry.objects.filter(key="expired").update(expires_at=now - timedelta(seconds=1))
+        GeminiCacheEntry.objects.filter(key="used").update(last_accessed_at=now)
+        gemini_cache.put("new", "x" * 40) # 130 bytes: over the limit, evicted down to 90
+        self.assertEqual(sorted(GeminiCacheEntry.objects.values_list("key", flat=True)), ["new", "used"])
+        self.assertEqual(counters().get(gemini_cache.TOTAL_BYTES_KEY), 70)
+
+
+@override_settings(GEMINI_RESPONSE_CACHE_ENABLED=True)
+class GeminiResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for target in ("base.gemini.time.sleep", "base.gemini.gemini_latency.record"):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _session(self, *responses):
+        session = FakeSession(*responses)
+        patcher = mock.patch("base.gemini.http_session", return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session
+
+    def test_identical_prompt_is_answered_from_the_cache(self):
+        session = self._session(FakeResponse(json_body=gemini_body("Plants make sugar from light.")))
+        self.assertEqual(gemini._generate_content(PROMPT, "key"), ("Plants make sugar from light.", True))
+        cache.clear() # Past single-flight's short-lived result
+        self.assertEqual(gemini._generate_content(PROMPT, "key"), ("Plants make sugar from light.", True))
+        self.assertEqual(len(session.calls), 1)
+
+    def test_use_cache_false_goes_upstream(self):
+        session = self._session(FakeResponse(json_body=gemini_body("Fresh")))
+        gemini._generate_content(PROMPT, "key")
+        gemini._generate_content(PROMPT, "key", use_cache=False)
+        self.assertEqual(len(session.calls), 2)
+
+    def test_placeholders_are_not_ok_and_not_cached(self):
+        for body in (gemini_body(""), {"promptFeedback": {"blockReason": "SAFETY"}}, {"unexpected": True}):
+            with self.subTest(body=body):
+                cache.clear()
+                self._session(FakeResponse(json_body=body))
+                text, ok = gemini._generate_content(PROMPT, "key")
+                self.assertFalse(ok)
+                self.assertTrue(text)
+        self.assertFalse(GeminiCacheEntry.objects.exists())
+
+    def _stream(self, response):
+        self._session(response)
+        return "".join(gemini._stream_gemini_api_with_history(PROMPT, "key"))
+
+    def test_stream_finished_normally_is_cached(self):
+        self.assertEqual(self._stream(FakeResponse(lines=gemini_sse("Plants ", "make sugar."))), "Plants make sugar.")
+        session = self._session(FakeResponse(status_code=500, json_body={}))
+        self.assertEqual("".join(gemini._stream_gemini_api_with_history(PROMPT, "key")), "Plants make sugar.")
+        self.assertEqual(session.calls, [])
+
+    def test_unfinished_stream_is_not_cached(self):
+        self.assertEqual(self._stream(FakeResponse(lines=gemini_sse("Plants ", "make", finish=False))), "Plants make")
+        cut_short = gemini_sse("Plants make sugar")
+        cut_short[-2] = cut_short[-2].replace('"STOP"', '"MAX_TOKENS"')
+        self._stream(FakeResponse(lines=cut_short))
+        self.assertFalse(GeminiCacheEntry.objects.exists())
+
+
+@override_settings(GEMINI_RESPONSE_CACHE_ENABLED=True)
+class ChatCacheBypassTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("asker", password="pw") # Not rate limited
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for patcher in (mock.patch("base.views.GOOGLE_API_KEY", "test-key"), mock.patch("base.gemini.gemini_latency.record")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.session = FakeSession(FakeResponse(json_body=gemini_body("Plants make sugar from light.")))
+        patcher = mock.patch("base.gemini.http_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ask(self, query="", **extra):
+        # A new chat each time, so the prompt history is the same
+        chat = Chat.objects.create(user=self.user)
+        cache.clear() # Past single-flight's short-lived result
+        response = self.client.post(
+            f"/api/chats/{chat.id}/messages/{query}", {"content": "Explain photosynthesis."}, format="json", **extra
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["ai_message"]["content"]
+
+    def test_repeat_question_is_served_from_the_cache(self):
+        self._ask()
+        self._ask()
+        self.assertEqual(len(self.session.calls), 1)
+
+    def test_fresh_flag_and_no_cache_header_bypass_the_cache(self):
+        self._ask()
+        self.assertEqual(self._ask("?fresh=1"), "Plants make sugar from light.")
+        self._ask(HTTP_CACHE_CONTROL="no-cache")
+        self.assertEqual(len(self.session.calls), 3)
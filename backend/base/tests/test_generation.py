@@ -0,0 +1,146 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from base import generation, jobs, ratelimit, tasks # tasks registers the job handlers
+from base.models import Card, CardSet, Job
+
+
+SPLIT = generation.split_notes
+
+
+def _cards(*terms):
+    return json.dumps([{"term": term, "definition": f"{term} means something"} for term in terms]), True
+
+
+class SplitNotesTests(TestCase):
+    def test_short_notes_are_one_chunk(self):
+        self.assertEqual(generation.split_notes("One.\n\nTwo."), ["One.\n\nTwo."])
+
+    def test_paragraphs_are_kept_together(self):
+        notes = "\n\n".join(["a" * 40, "b" * 40, "c" * 40])
+        self.assertEqual(generation.split_notes(notes, limit=90), ["a" * 40 + "\n\n" + "b" * 40, "c" * 40])
+
+    def test_a_huge_paragraph_is_cut_at_whitespace(self):
+        chunks = generation.split_notes("word " * 50, limit=42)
+        self.assertTrue(all(len(chunk) <= 42 for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), ["word"] * 50)
+
+    def test_cards_are_shared_out_by_length(self):
+        self.assertEqual(generation._shares(["x" * 300, "x" * 100], 20), [15, 5])
+
+
+class GenerateViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit._policies.clear()
+        self.addCleanup(ratelimit._policies.clear)
+        self.user = User.objects.create_user("author", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.card_set = CardSet.objects.create(user=self.user, name="Spanish")
+        patcher = mock.patch("base.views.GOOGLE_API_KEY", "test-key")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _generate(self, *replies):
+        patcher = mock.patch("base.generation._generate_content", side_effect=list(replies))
+        generate = patcher.start()
+        self.addCleanup(patcher.stop)
+        return generate
+
+    def _post(self, notes="Hola means hello.", count=3, query=""):
+        return self.client.post(
+            f"/api/cardsets/{self.card_set.id}/generate/{query}", {"notes": notes, "count": count}, format="json"
+        )
+
+    def test_one_call_creates_the_whole_batch(self):
+        generate = self._generate(_cards("hola", "adiós", "gracias"))
+        response = self._post()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["created"], response.data["skipped"]), (3, 0))
+        generate.assert_called_once()
+        prompt_history, _, config = generate.call_args.args
+        self.assertIn("Hola means hello.", prompt_history[0]["parts"][0]["text"])
+        self.assertEqual(config["responseMimeType"], "application/json")
+        self.assertEqual(sorted(self.card_set.cards.values_list("term", flat=True)), ["adiós", "gracias", "hola"])
+
+    def test_invalid_and_duplicate_cards_are_skipped(self):
+        Card.objects.create(card_set=self.card_set, term="Hola", definition="hello")
+        reply = json.dumps([
+            {"term": "hola", "definition": "Already in the set"},
+            {"term": "adiós", "definition": "goodbye"},
+            {"term": "ADIÓS", "definition": "Repeated in the batch"},
+            {"term": "sin definición"},
+            "not a card",
+        ])
+        self._generate((f"```json\n{reply}\n```", True))
+        response = self._post(count=5)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["created"], response.data["skipped"]), (1, 4))
+        self.assertEqual(len(response.data["errors"]), 2)
+        self.assertEqual(sorted(self.card_set.cards.values_list("term", flat=True)), ["Hola", "adiós"])
+
+    def test_no_more_than_count_cards_are_saved(self):
+        self._generate(_cards("uno", "dos", "tres", "cuatro"))
+        self.assertEqual(self._post(count=2).data["created"], 2)
+        self.assertEqual(self.card_set.cards.count(), 2)
+
+    @override_settings(CARD_GENERATION_CONCURRENCY=2)
+    def test_long_notes_are_sent_in_concurrent_chunks(self):
+        generate = self._generate(_cards("uno"), _cards("dos"), _cards("tres"))
+        notes = "\n\n".join(["a" * 40, "b" * 40, "c" * 40])
+        with mock.patch("base.generation.split_notes", lambda notes: SPLIT(notes, limit=50)):
+            response = self._post(notes=notes)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(generate.call_count, 3)
+        self.assertEqual(sorted(self.card_set.cards.values_list("term", flat=True)), ["dos", "tres", "uno"])
+
+    def test_a_failed_chunk_is_reported_with_the_others_saved(self):
+        self._generate(_cards("uno"), ("The AI is busy.", False))
+        with mock.patch("base.generation.split_notes", lambda notes: SPLIT(notes, limit=50)):
+            response = self._post(notes="a" * 40 + "\n\n" + "b" * 40, count=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual([error["error"] for error in response.data["errors"]], ["The AI is busy."])
+
+    def test_unusable_reply_is_a_bad_gateway(self):
+        self._generate(("Here are your cards!", True))
+        response = self._post()
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(self.card_set.cards.exists())
+
+    def test_bad_requests_make_no_call(self):
+        generate = self._generate()
+        self.assertEqual(self._post(notes="  ").status_code, 400)
+        self.assertEqual(self._post(count=-1).status_code, 400)
+        self.assertEqual(self._post(count=1000).status_code, 400)
+        other = CardSet.objects.create(user=User.objects.create_user("other", password="pw"), name="Theirs")
+        response = self.client.post(f"/api/cardsets/{other.id}/generate/", {"notes": "x"}, format="json")
+        self.assertEqual(response.status_code, 404)
+        generate.assert_not_called()
+
+    @override_settings(RATE_LIMITS={"generate": [{"algorithm": "quota", "limit": 1, "period": "day"}]})
+    def test_generation_is_rate_limited(self):
+        self._generate(_cards("uno"))
+        self.assertEqual(self._post().status_code, 201)
+        self.assertEqual(self._post().status_code, 429)
+
+    def test_background_generation_reports_progress(self):
+        self._generate(_cards("hola", "adiós"))
+        response = self._post(query="?background=1")
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(self.card_set.cards.exists())
+
+        job, slot = jobs.claim("w1")
+        with mock.patch("base.tasks.GOOGLE_API_KEY", "test-key"):
+            jobs.run(job, slot)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress, {"done": 1, "total": 1})
+        self.assertEqual(job.result["created"], 2)
+        self.assertEqual(self.card_set.cards.count(), 2)
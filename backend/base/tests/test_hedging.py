@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from base.hedging import HEDGE, PRIMARY, LatencyTracker, ahedged_call, hedged_call
+
+from .fakes import FakeResponse
+
+
+class StubTracker(LatencyTracker):
+    """A tracker with a fixed hedge delay, so tests don't wait on the real one."""
+
+    def __init__(self, delay=0.01):
+        super().__init__(window=10)
+        self.delay = delay
+        self.recorded = []
+
+    def hedge_delay(self):
+        return self.delay
+
+    def record(self, latency, winner):
+        super().record(latency, winner)
+        self.recorded.append(winner)
+
+
+@override_settings(GEMINI_HEDGE_MIN_SAMPLES=3, GEMINI_HEDGE_PERCENTILE=95, GEMINI_HEDGE_INITIAL_DELAY=6.0,
+                   GEMINI_HEDGE_MIN_DELAY=1.0, GEMINI_HEDGE_MAX_DELAY=15.0)
+class LatencyTrackerTests(SimpleTestCase):
+    def test_initial_delay_until_enough_samples(self):
+        tracker = LatencyTracker(window=10)
+        tracker.record(2.0, PRIMARY)
+        self.assertEqual(tracker.hedge_delay(), 6.0)
+
+    def test_delay_follows_the_percentile_within_bounds(self):
+        tracker = LatencyTracker(window=10)
+        for latency in (2.0, 3.0, 4.0):
+            tracker.record(latency, PRIMARY)
+        self.assertEqual(tracker.hedge_delay(), 4.0)
+        for _ in range(10):
+            tracker.record(0.1, HEDGE)
+        self.assertEqual(tracker.hedge_delay(), 1.0) # Old samples rolled out; clamped to the minimum
+        self.assertEqual(tracker.stats(), {"samples": 10, "wins": {PRIMARY: 3, HEDGE: 10}})
+
+
+class HedgedCallTests(SimpleTestCase):
+    def test_fast_primary_is_not_hedged(self):
+        tracker = StubTracker(delay=5)
+        hedge_calls = []
+        response = hedged_call(tracker, lambda: FakeResponse(), lambda: hedge_calls.append(1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(hedge_calls, [])
+        self.assertEqual(tracker.recorded, [PRIMARY])
+
+    def test_slow_primary_loses_to_the_hedge_and_is_closed(self):
+        release = threading.Event()
+        slow = FakeResponse()
+
+        def primary():
+            release.wait(5)
+            return slow
+
+        tracker = StubTracker()
+        hedge_response = FakeResponse(json_body={"from": "hedge"})
+        response = hedged_call(tracker, primary, lambda: hedge_response)
+        self.assertIs(response, hedge_response)
+        self.assertEqual(tracker.recorded, [HEDGE])
+        release.set()
+        for _ in range(500):
+            if slow.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(slow.closed) # The loser's connection is given back
+
+    def test_primary_outcome_is_reported_when_neither_succeeds(self):
+        release = threading.Event()
+
+        def primary():
+            release.wait(0.05)
+            return FakeResponse(status_code=503)
+
+        tracker = StubTracker()
+        response = hedged_call(tracker, primary, lambda: FakeResponse(status_code=429))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(tracker.recorded, [])
+
+    def test_without_a_hedge_the_primary_runs_inline(self):
+        self.assertEqual(hedged_call(StubTracker(), lambda: FakeResponse(status_code=500), None).status_code, 500)
+
+
+class AsyncHedgedCallTests(SimpleTestCase):
+    async def test_slow_primary_is_cancelled_when_the_hedge_wins(self):
+        cancelled = asyncio.Event()
+
+        async def primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def hedge():
+            return FakeResponse(json_body={"from": "hedge"})
+
+        tracker = StubTracker()
+        response = await ahedged_call(tracker, primary, hedge)
+        self.assertEqual(response.json(), {"from": "hedge"})
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(tracker.recorded, [HEDGE])
+
+    async def test_fast_primary_wins(self):
+        async def primary():
+            return FakeResponse()
+
+        async def hedge():
+            raise AssertionError("hedge should not be sent")
+
+        tracker = StubTracker(delay=5)
+        self.assertEqual((await ahedged_call(tracker, primary, hedge)).status_code, 200)
+        self.assertEqual(tracker.recorded, [PRIMARY])
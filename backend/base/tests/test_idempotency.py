@@ -0,0 +1,119 @@
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from base import idempotency
+from base.idempotency import idempotent
+
+
+class EchoView(APIView):
+    calls = 0
+
+    @idempotent
+    def post(self, request):
+        EchoView.calls += 1
+        if request.data.get("nested"):
+            # A retry arriving while this request is still running
+            nested = _post(EchoView, request.user, {"nested": True}, "key-1")
+            return Response({"nested_status": nested.status_code, "nested_retry_after": nested.get("Retry-After")})
+        if request.data.get("fail"):
+            return Response({"error": "Upstream unavailable"}, status=503)
+        return Response({"calls": EchoView.calls, "echo": request.data.get("text")}, status=201)
+
+
+def _post(view_class, user, data, key):
+    request = APIRequestFactory().post("/echo/", data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+    force_authenticate(request, user=user)
+    response = view_class.as_view()(request)
+    if hasattr(response, "render"):
+        response.render()
+    return response
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("idem", password="pw")
+        EchoView.calls = 0
+
+    def test_retry_replays_the_stored_response(self):
+        first = _post(EchoView, self.user, {"text": "hi"}, "key-1")
+        retry = _post(EchoView, self.user, {"text": "hi"}, "key-1")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(EchoView.calls, 1)
+
+    def test_key_reused_for_a_different_request_conflicts(self):
+        _post(EchoView, self.user, {"text": "hi"}, "key-1")
+        other = _post(EchoView, self.user, {"text": "bye"}, "key-1")
+        self.assertEqual(other.status_code, 422)
+        self.assertEqual(EchoView.calls, 1)
+
+    def test_keys_are_per_user(self):
+        other_user = User.objects.create_user("other", password="pw")
+        _post(EchoView, self.user, {"text": "hi"}, "key-1")
+        self.assertEqual(_post(EchoView, other_user, {"text": "hi"}, "key-1").status_code, 201)
+        self.assertEqual(EchoView.calls, 2)
+
+    def test_server_errors_are_not_replayed(self):
+        _post(EchoView, self.user, {"fail": True}, "key-1")
+        self.assertEqual(_post(EchoView, self.user, {"fail": True}, "key-1").status_code, 503)
+        self.assertEqual(EchoView.calls, 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0.1)
+    def test_retry_gets_409_once_the_wait_runs_out(self):
+        with mock.patch("base.idempotency.time.sleep"):
+            response = _post(EchoView, self.user, {"nested": True}, "key-1")
+        self.assertEqual(response.data["nested_status"], 409)
+        self.assertEqual(response.data["nested_retry_after"], "2")
+        self.assertEqual(EchoView.calls, 1)
+
+
+class IdempotencyWaitTests(TestCase):
+    """A retry that arrives while the original is running waits on the original's record."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("idem", password="pw")
+        self.data = {"text": "hi"}
+        self.original, _ = idempotency.begin(self._request(), self.user, self.data)
+
+    def _request(self):
+        return RequestFactory().post("/echo/", self.data, content_type="application/json", HTTP_IDEMPOTENCY_KEY="key-1")
+
+    def _original_finishes(self, seconds):
+        idempotency._store(self.original, 201, "application/json", b'{"echo": "hi"}')
+
+    def test_retry_replays_the_response_stored_while_it_waited(self):
+        with mock.patch("base.idempotency.time.sleep", side_effect=self._original_finishes) as sleep:
+            record, replay = idempotency.begin(self._request(), self.user, self.data)
+        sleep.assert_called_once_with(idempotency.POLL_INTERVAL)
+        self.assertIsNone(record)
+        self.assertEqual((replay.status_code, replay.content), (201, b'{"echo": "hi"}'))
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+
+    def test_retry_runs_itself_if_the_original_released_the_key(self):
+        with mock.patch("base.idempotency.time.sleep", side_effect=lambda seconds: idempotency.release(self.original)):
+            record, replay = idempotency.begin(self._request(), self.user, self.data)
+        self.assertIsNone(replay)
+        self.assertNotEqual(record.pk, self.original.pk)
+
+    async def test_async_retry_waits_too(self):
+        async def original_finishes(seconds):
+            await sync_to_async(self._original_finishes)(seconds)
+
+        with mock.patch("base.idempotency.asyncio.sleep", side_effect=original_finishes):
+            record, replay = await idempotency.abegin(self._request(), self.user, self.data)
+        self.assertEqual(replay.status_code, 201)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_409_without_waiting_when_the_wait_is_off(self):
+        with mock.patch("base.idempotency.time.sleep") as sleep:
+            record, replay = idempotency.begin(self._request(), self.user, self.data)
+        sleep.assert_not_called()
+        self.assertEqual(replay.status_code, 409)
@@ -0,0 +1,154 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import jobs, tasks
+from base.models import Chat, Counter, Job
+
+
+@override_settings(JOB_TYPES={"test_job": {"concurrency": 1, "max_attempts": 3, "timeout": 30}})
+class JobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("worker", password="pw")
+        jobs.handler("test_job")(lambda job: {"echo": job.payload["n"]})
+        self.addCleanup(jobs._handlers.pop, "test_job")
+
+    def _expire_lease(self, job):
+        past = timezone.now() - timedelta(seconds=1)
+        Job.objects.filter(pk=job.pk).update(leased_until=past)
+        Counter.objects.filter(key=jobs._slot_key("test_job", 0)).update(expires_at=past)
+
+    def test_claim_leases_a_job_once(self):
+        queued = jobs.enqueue(self.user, "test_job", {"n": 1})
+        job, slot = jobs.claim("w1")
+        self.assertEqual((job.id, slot), (queued.id, 0))
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue(job.lease_token)
+        self.assertEqual(jobs.claim("w2"), (None, None))
+
+    def test_concurrency_slot_holds_back_other_jobs_until_released(self):
+        jobs.enqueue(self.user, "test_job", {"n": 1})
+        second = jobs.enqueue(self.user, "test_job", {"n": 2})
+        job, slot = jobs.claim("w1")
+        self.assertEqual(jobs.claim("w2"), (None, None))
+        jobs.run(job, slot)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.SUCCEEDED)
+        self.assertEqual(jobs.claim("w2")[0].id, second.id)
+
+    def test_expired_lease_is_taken_over_and_the_old_claim_loses(self):
+        jobs.enqueue(self.user, "test_job", {"n": 1})
+        stale, _ = jobs.claim("w1")
+        self._expire_lease(stale)
+        job, slot = jobs.claim("w2")
+        self.assertEqual(job.id, stale.id)
+        self.assertEqual(job.attempts, 2)
+        self.assertNotEqual(job.lease_token, stale.lease_token)
+
+        self.assertFalse(jobs.heartbeat(stale))
+        self.assertFalse(jobs.record(stale, n=2))
+        jobs.run(stale, 0) # Its result is dropped and the slot stays with the new claim
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+        self.assertEqual(Counter.objects.get(key=jobs._slot_key("test_job", 0)).value, job.id)
+
+        self.assertTrue(jobs.heartbeat(job))
+        jobs.run(job, slot)
+        finished = Job.objects.get(pk=job.pk)
+        self.assertEqual((finished.status, finished.result, finished.lease_token), (Job.SUCCEEDED, {"echo": 1}, ""))
+
+    def test_heartbeat_extends_the_lease(self):
+        jobs.enqueue(self.user, "test_job", {"n": 1})
+        job, _ = jobs.claim("w1")
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() + timedelta(seconds=1))
+        self.assertTrue(jobs.heartbeat(job))
+        self.assertGreater(Job.objects.get(pk=job.pk).leased_until, timezone.now() + timedelta(seconds=20))
+
+    def test_record_adds_to_the_payload(self):
+        jobs.enqueue(self.user, "test_job", {"n": 1})
+        job, _ = jobs.claim("w1")
+        self.assertTrue(jobs.record(job, done=[1]))
+        self.assertEqual(Job.objects.get(pk=job.pk).payload, {"n": 1, "done": [1]})
+
+    @override_settings(JOB_MAX_PENDING_PER_USER=1)
+    def test_full_queue_is_refused(self):
+        jobs.enqueue(self.user, "test_job", {"n": 1})
+        with self.assertRaises(jobs.QueueFull):
+            jobs.enqueue(self.user, "test_job", {"n": 2})
+
+    def test_failed_attempt_is_retried_later(self):
+        jobs._handlers["test_job"] = mock.Mock(side_effect=RuntimeError("Try again"))
+        queued = jobs.enqueue(self.user, "test_job", {"n": 1})
+        jobs.run(*jobs.claim("w1"))
+        retry = Job.objects.get(pk=queued.pk)
+        self.assertEqual((retry.status, retry.error), (Job.QUEUED, "Try again"))
+        self.assertGreater(retry.run_after, timezone.now())
+        self.assertEqual(jobs.claim("w1"), (None, None)) # Not before its backoff is over
+
+
+class ChatReplyJobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("talker", password="pw")
+        self.chat = Chat.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _queue(self):
+        response = self.client.post(f"/api/chats/{self.chat.id}/messages/?background=1", {"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Location"], f"/api/jobs/{response.data['job']['id']}/")
+        return jobs.claim("w1")
+
+    def _generate(self, *replies):
+        patcher = mock.patch("base.tasks._generate_content", side_effect=list(replies))
+        generate = patcher.start()
+        self.addCleanup(patcher.stop)
+        return generate
+
+    def test_reply_is_saved_and_its_id_recorded(self):
+        self._generate(("Hello!", True))
+        job, slot = self._queue()
+        jobs.run(job, slot)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        ai_message = self.chat.messages.get(sender="ai")
+        self.assertEqual(ai_message.content, "Hello!")
+        self.assertEqual(job.payload["ai_message_id"], ai_message.id)
+        self.assertEqual(self.client.get(f"/api/jobs/{job.id}/").data["result"]["ai_message"]["id"], ai_message.id)
+
+    def test_rerun_returns_the_recorded_reply(self):
+        generate = self._generate(("Hello!", True))
+        job, _ = self._queue()
+        first = tasks.chat_reply(job)
+        self.assertEqual(tasks.chat_reply(job), first) # e.g. the worker died before finishing the job
+        generate.assert_called_once()
+        self.assertEqual(self.chat.messages.filter(sender="ai").count(), 1)
+
+    def test_a_later_ai_message_is_not_taken_for_the_reply(self):
+        # Another turn answered after this user message isn't this job's reply
+        self._generate(("Hello!", True))
+        job, _ = self._queue()
+        self.chat.add_message("ai", "An answer to something else")
+        result = tasks.chat_reply(job)
+        self.assertEqual(result["ai_message"]["content"], "Hello!")
+
+    def test_reply_is_rolled_back_when_the_lease_was_lost(self):
+        self._generate(("Hello!", True))
+        job, _ = self._queue()
+        Job.objects.filter(pk=job.pk).update(lease_token="taken-over")
+        with self.assertRaises(RuntimeError):
+            tasks.chat_reply(job)
+        self.assertFalse(self.chat.messages.filter(sender="ai").exists())
+
+    def test_failed_generation_is_retried(self):
+        self._generate(("The AI is busy.", False))
+        job, slot = self._queue()
+        jobs.run(job, slot)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (Job.QUEUED, "The AI is busy."))
+        self.assertFalse(self.chat.messages.filter(sender="ai").exists())
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from base.models import Card, CardSet, Category, Chat
+
+
+class ListEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("lister", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(user=self.user, name="Languages")
+        self.card_set = CardSet.objects.create(user=self.user, name="French", category=self.category)
+        CardSet.objects.create(user=self.user, name="Finnish", category=self.category)
+        CardSet.objects.create(user=self.user, name="German")
+        for term in ("chat", "chien", "Cheval", "oiseau", "poisson"):
+            Card.objects.create(card_set=self.card_set, term=term, definition=f"{term} in English")
+
+    def _walk(self, url, params):
+        """Follows next cursors to the end, returning every row and the number of pages."""
+        rows, pages, cursor = [], 0, None
+        while True:
+            body = self.client.get(url, {**params, **({"cursor": cursor} if cursor else {})}).json()
+            rows += body["results"]
+            pages += 1
+            cursor = body["next"]
+            if cursor is None:
+                return rows, pages
+
+    def test_unpaginated_by_default(self):
+        body = self.client.get("/api/cards/", {"card_set": self.card_set.id}).json()
+        self.assertIsInstance(body, list)
+        self.assertEqual(len(body), 5)
+
+    def test_keyset_pages_in_the_requested_order(self):
+        rows, pages = self._walk("/api/cards/", {"card_set": self.card_set.id, "limit": 2, "ordering": "-term"})
+        expected = Card.objects.order_by("-term", "-id").values_list("term", flat=True) # The database's collation
+        self.assertEqual([row["term"] for row in rows], list(expected))
+        self.assertEqual(pages, 3)
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        first = self.client.get("/api/cards/", {"card_set": self.card_set.id, "limit": 2, "ordering": "term"}).json()
+        response = self.client.get("/api/cards/", {"card_set": self.card_set.id, "cursor": first["next"], "ordering": "id"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sparse_fields_trim_the_output_and_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get("/api/cards/", {"card_set": self.card_set.id, "fields": "term,bogus", "limit": 2}).json()
+        self.assertEqual(set(body["results"][0]), {"term"})
+        select = [q["sql"] for q in queries if "base_card" in q["sql"] and "base_cardset" not in q["sql"]][-1]
+        self.assertNotIn("definition", select)
+        rows, _ = self._walk("/api/cards/", {"card_set": self.card_set.id, "fields": "term", "limit": 2, "ordering": "term"})
+        self.assertEqual(len(rows), 5) # The cursor field is loaded even though it wasn't asked for
+
+    def test_card_filters(self):
+        body = self.client.get("/api/cards/", {"card_set": self.card_set.id, "term_prefix": "ch"}).json()
+        self.assertEqual(sorted(row["term"] for row in body), ["Cheval", "chat", "chien"])
+        Card.objects.filter(term="chat").update(term_image="cards/images/chat.png")
+        with_image = self.client.get("/api/cards/", {"card_set": self.card_set.id, "has_image": "1"}).json()
+        self.assertEqual([row["term"] for row in with_image], ["chat"])
+        self.assertEqual(len(self.client.get("/api/cards/", {"card_set": self.card_set.id, "has_image": "0"}).json()), 4)
+
+    def test_cards_of_another_users_set_are_not_listed(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("other", password="pw"))
+        self.assertEqual(other.get("/api/cards/", {"card_set": self.card_set.id}).json(), [])
+
+    def test_card_set_filters(self):
+        by_category = self.client.get("/api/cardsets/", {"category": self.category.id, "ordering": "name"}).json()
+        self.assertEqual([row["name"] for row in by_category], ["Finnish", "French"])
+        by_prefix = self.client.get("/api/cardsets/", {"name_prefix": "fr"}).json()
+        self.assertEqual([row["name"] for row in by_prefix], ["French"])
+
+    def test_chats_newest_first_with_title_filter(self):
+        old = Chat.objects.create(user=self.user, title="Travel phrases")
+        new = Chat.objects.create(user=self.user, title="Grammar")
+        old.add_message("user", "Hello") # Most recently updated now
+        rows = self.client.get("/api/chats/").json()
+        self.assertEqual([row["id"] for row in rows], [old.id, new.id])
+        filtered = self.client.get("/api/chats/", {"title_prefix": "gram"}).json()
+        self.assertEqual([row["title"] for row in filtered], ["Grammar"])
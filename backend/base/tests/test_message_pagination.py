@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from base.models import Chat, Message
+from base.pagination import MessageKeysetPagination
+
+
+class KeysetCursorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="pw")
+        self.chat = Chat.objects.create(user=self.user, title="Long chat")
+        for i in range(7):
+            self.chat.add_message("user" if i % 2 == 0 else "ai", f"message {i}")
+        # Same timestamp for all, so only the id tiebreaker orders them
+        Message.objects.filter(chat=self.chat).update(timestamp=timezone.now())
+
+    def _page(self, **params):
+        request = Request(APIRequestFactory().get("/messages/", params))
+        paginator = MessageKeysetPagination()
+        page = paginator.paginate_queryset(self.chat.messages.all(), request)
+        return [message.content for message in page], paginator
+
+    def test_paging_back_visits_every_message_once(self):
+        seen = []
+        contents, paginator = self._page(limit=3)
+        while True:
+            seen = contents + seen
+            if paginator.before_cursor is None:
+                break
+            # New messages arriving meanwhile don't shift the older pages
+            self.chat.add_message("user", "late arrival")
+            contents, paginator = self._page(limit=3, before=paginator.before_cursor)
+        self.assertEqual(seen, [f"message {i}" for i in range(7)])
+
+    def test_after_cursor_returns_only_newer_messages(self):
+        contents, paginator = self._page(limit=50)
+        self.assertEqual(len(contents), 7)
+        self.chat.add_message("ai", "newer")
+        newer, _ = self._page(after=paginator.after_cursor)
+        self.assertEqual(newer, ["newer"])
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self._page(before="not-a-cursor")
+
+    def test_endpoint_pages_the_chat(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f"/api/chats/{self.chat.id}/messages/"
+        newest = client.get(url, {"limit": 5}).json()
+        self.assertEqual([m["content"] for m in newest["results"]], [f"message {i}" for i in range(2, 7)])
+        self.assertFalse(newest["has_newer"])
+        older = client.get(url, {"limit": 5, "before": newest["before"]}).json()
+        self.assertEqual([m["content"] for m in older["results"]], ["message 0", "message 1"])
+        self.assertIsNone(older["before"])
+        self.assertTrue(older["has_newer"])
+        self.assertEqual(client.get(url, {"before": "x", "after": "y"}).status_code, 400)
+
+    def test_other_users_chat_is_not_found(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("other", password="pw"))
+        self.assertEqual(client.get(f"/api/chats/{self.chat.id}/messages/").status_code, 404)
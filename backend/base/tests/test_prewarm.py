@@ -0,0 +1,160 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from base import jobs, ratelimit, tasks, tts_cache
+from base.elevenlabs import TTS_MODEL_ID, TTS_VOICE_SETTINGS
+from base.models import Card, CardSet, Job
+
+from .fakes import FakeResponse, FakeSession, use_temp_tts_cache
+
+THREE_A_DAY = [{"algorithm": "quota", "limit": 3, "period": "day"}]
+
+
+def _cache_clip(text):
+    fill = tts_cache.begin_fill(tts_cache.cache_key(text, "voice", TTS_MODEL_ID, TTS_VOICE_SETTINGS))
+    list(fill.tee(iter([b"ID3" + b"x" * 100])))
+
+
+@override_settings(RATE_LIMITS={"tts_prewarm": THREE_A_DAY})
+class PrewarmTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit._policies.clear()
+        self.addCleanup(ratelimit._policies.clear)
+        use_temp_tts_cache(self)
+        for target in ("base.views.ELABS_API_KEY", "base.views.VOICE_ID", "base.tasks.VOICE_ID"):
+            patcher = mock.patch(target, "voice")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("student", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.card_set = CardSet.objects.create(user=self.user, name="German")
+        for term, definition in (("Hund", "dog"), ("Katze", "cat"), ("Maus", "mouse")):
+            Card.objects.create(card_set=self.card_set, term=term, definition=definition)
+
+    def _synthesize(self, result=True):
+        patcher = mock.patch("base.tasks.synthesize_to_cache", side_effect=result if callable(result) else None, return_value=result)
+        synthesize = patcher.start()
+        self.addCleanup(patcher.stop)
+        return synthesize
+
+    def _prepare(self, **body):
+        response = self.client.post(f"/api/cardsets/{self.card_set.id}/prepare-audio/", body, format="json")
+        self.assertEqual(response.status_code, 202)
+        return response
+
+    def _run(self):
+        job, slot = jobs.claim("w1")
+        jobs.run(job, slot)
+        job.refresh_from_db()
+        return job
+
+    def _quota_left(self):
+        result = ratelimit.check("tts_prewarm", self.user)
+        ratelimit.refund("tts_prewarm", self.user)
+        return result.remaining
+
+    def test_pending_job_is_returned_again(self):
+        first = self._prepare()
+        self.assertEqual(self._prepare().data["job"]["id"], first.data["job"]["id"])
+        self.assertEqual(Job.objects.filter(kind="tts_prewarm").count(), 1)
+
+    def test_preparing_needs_the_cache_and_an_owned_set(self):
+        with override_settings(TTS_CACHE_ENABLED=False):
+            response = self.client.post(f"/api/cardsets/{self.card_set.id}/prepare-audio/", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+        other = CardSet.objects.create(user=User.objects.create_user("other", password="pw"), name="Theirs")
+        response = self.client.post(f"/api/cardsets/{other.id}/prepare-audio/", {}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached_terms_are_skipped(self):
+        _cache_clip("Hund")
+        synthesize = self._synthesize()
+        self._prepare()
+        job = self._run()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(sorted(call.args[0] for call in synthesize.call_args_list), ["Katze", "Maus"])
+        self.assertEqual((job.result["already_cached"], job.result["synthesized"]), (1, 2))
+        self.assertEqual(job.progress, {"done": 3, "total": 3})
+        self.assertEqual(self._quota_left(), 0) # Two clips charged, plus our own check
+
+    @override_settings(RATE_LIMITS={"tts_prewarm": [{"algorithm": "quota", "limit": 10, "period": "day"}]})
+    def test_definitions_are_included_when_asked(self):
+        synthesize = self._synthesize()
+        self._prepare(definitions=True)
+        job = self._run()
+        self.assertEqual(job.result["total"], 6)
+        self.assertIn("cat", [call.args[0] for call in synthesize.call_args_list])
+
+    def test_job_stops_when_the_quota_runs_out(self):
+        Card.objects.create(card_set=self.card_set, term="Vogel", definition="bird")
+        self._synthesize()
+        self._prepare()
+        job = self._run()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual((job.result["synthesized"], job.result["quota_exhausted"]), (3, True))
+        self.assertEqual(job.progress, {"done": 3, "total": 4})
+
+    def test_clips_not_synthesized_are_refunded(self):
+        def synthesize(text, voice_settings):
+            if text == "Maus":
+                raise ConnectionError("ElevenLabs is down")
+            return text == "Hund" # Katze is being downloaded by another request
+
+        self._synthesize(synthesize)
+        self._prepare()
+        job = self._run()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(
+            (job.result["synthesized"], job.result["in_progress"], job.result["failed"]), (1, 1, 1)
+        )
+        self.assertEqual(self._quota_left(), 1)
+
+    def test_job_is_retried_when_every_clip_fails(self):
+        self._synthesize(mock.Mock(side_effect=ConnectionError("ElevenLabs is down")))
+        self._prepare()
+        job = self._run()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn("None of the 3 clips", job.error)
+        self.assertEqual(self._quota_left(), 2)
+
+
+class SynthesizeToCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_temp_tts_cache(self)
+
+    def _session(self, response):
+        session = FakeSession(response)
+        patcher = mock.patch("base.elevenlabs.http_session", return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session
+
+    def test_clip_is_downloaded_into_the_cache_once(self):
+        session = self._session(FakeResponse(content=b"ID3" + b"x" * 100))
+        self.assertTrue(tasks.synthesize_to_cache("Hund", TTS_VOICE_SETTINGS))
+        self.assertTrue(tasks.synthesize_to_cache("Hund", TTS_VOICE_SETTINGS))
+        self.assertEqual(len(session.calls), 1)
+        key = tts_cache.cache_key("Hund", tasks.VOICE_ID, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+        self.assertIsNotNone(tts_cache.lookup(key))
+
+    def test_clip_being_downloaded_elsewhere_is_left_to_that_download(self):
+        session = self._session(FakeResponse(content=b"ID3"))
+        key = tts_cache.cache_key("Hund", tasks.VOICE_ID, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+        fill = tts_cache.begin_fill(key)
+        self.assertFalse(tasks.synthesize_to_cache("Hund", TTS_VOICE_SETTINGS))
+        self.assertEqual(session.calls, [])
+        fill.abort()
+
+    def test_client_errors_are_not_retried(self):
+        self._session(FakeResponse(status_code=422, content=b"Bad text"))
+        with self.assertRaises(jobs.PermanentJobError):
+            tasks.synthesize_to_cache("Hund", TTS_VOICE_SETTINGS)
+        key = tts_cache.cache_key("Hund", tasks.VOICE_ID, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+        self.assertIsNotNone(tts_cache.begin_fill(key)) # The fill was given up
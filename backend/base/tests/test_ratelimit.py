@@ -0,0 +1,153 @@
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from base import async_views, ratelimit, tts_cache, views
+from base.models import Chat
+
+from .fakes import FakeResponse, FakeSession, use_temp_tts_cache
+
+ONE_A_DAY = [{"algorithm": "quota", "limit": 1, "period": "day"}]
+TWO_A_DAY = [{"algorithm": "quota", "limit": 2, "period": "day"}]
+
+
+class LimiterTests(TestCase):
+    def setUp(self):
+        ratelimit._policies.clear()
+        self.addCleanup(ratelimit._policies.clear)
+
+    def test_token_bucket_refills_over_time(self):
+        bucket = ratelimit.TokenBucket("test", "2/s", burst=2)
+        with mock.patch("base.ratelimit.time.time", return_value=1000.0) as clock:
+            self.assertTrue(bucket.acquire("u").allowed)
+            self.assertTrue(bucket.acquire("u").allowed)
+            refused = bucket.acquire("u")
+            self.assertFalse(refused.allowed)
+            self.assertAlmostEqual(refused.retry_after, 0.5)
+            clock.return_value = 1000.5 # One interval later, one token is back
+            self.assertTrue(bucket.acquire("u").allowed)
+            self.assertFalse(bucket.acquire("u").allowed)
+
+    def test_token_bucket_refund(self):
+        bucket = ratelimit.TokenBucket("test", "1/min", burst=1)
+        with mock.patch("base.ratelimit.time.time", return_value=1000.0):
+            self.assertTrue(bucket.acquire("u").allowed)
+            self.assertFalse(bucket.acquire("u").allowed)
+            bucket.refund("u")
+            self.assertTrue(bucket.acquire("u").allowed)
+
+    def test_sliding_window_counts_the_previous_window(self):
+        window = ratelimit.SlidingWindow("test", "2/min")
+        with mock.patch("base.ratelimit.time.time", return_value=60 * 1000 + 1) as clock:
+            self.assertTrue(window.acquire("u").allowed)
+            self.assertTrue(window.acquire("u").allowed)
+            self.assertFalse(window.acquire("u").allowed)
+            window.refund("u")
+            self.assertTrue(window.acquire("u").allowed)
+            # A quarter into the next window, 3/4 of the previous one still counts
+            clock.return_value = 60 * 1001 + 15
+            self.assertFalse(window.acquire("u").allowed)
+            # Past the next window, the old requests have slid out entirely
+            clock.return_value = 60 * 1002 + 1
+            self.assertTrue(window.acquire("u").allowed)
+
+    def test_quota_refund(self):
+        quota = ratelimit.Quota("test", limit=2, period="day")
+        first = quota.acquire("u")
+        self.assertEqual(first.remaining, 1)
+        self.assertEqual(first.kind, ratelimit.QUOTA)
+        self.assertTrue(quota.acquire("u").allowed)
+        self.assertFalse(quota.acquire("u").allowed)
+        quota.refund("u")
+        self.assertTrue(quota.acquire("u").allowed)
+
+    @override_settings(RATE_LIMITS={"test": [
+        {"algorithm": "token_bucket", "rate": "10/min", "burst": 10},
+        {"algorithm": "quota", "limit": 1, "period": "day"},
+    ]})
+    def test_check_gives_back_earlier_policies_when_a_later_one_refuses(self):
+        user = User.objects.create_user("limited", password="pw")
+        self.assertTrue(ratelimit.check("test", user).allowed)
+        for _ in range(3):
+            self.assertFalse(ratelimit.check("test", user).allowed)
+        # The refused checks gave their token back; only the allowed request still holds one
+        bucket = ratelimit._policies_for("test")[0]
+        self.assertEqual(bucket.acquire(user.id).remaining, 8)
+        bucket.refund(user.id)
+        ratelimit.refund("test", user)
+        self.assertTrue(ratelimit.check("test", user).allowed)
+
+    def test_rate_limit_headers(self):
+        response = ratelimit.RateLimit(False, 2, 0, 30.2, "2;w=60", retry_after=4.1).apply(HttpResponse())
+        self.assertEqual(response["RateLimit-Remaining"], "0")
+        self.assertEqual(response["RateLimit-Reset"], "31")
+        self.assertEqual(response["Retry-After"], "5")
+
+    @override_settings(RATE_LIMITS={"test": ONE_A_DAY})
+    def test_superusers_are_not_limited(self):
+        admin = User.objects.create_superuser("admin", password="pw")
+        for _ in range(3):
+            self.assertTrue(ratelimit.check("test", admin).allowed)
+
+
+@override_settings(RATE_LIMITS={"chat": TWO_A_DAY, "tts": TWO_A_DAY})
+class ViewLimitTests(TestCase):
+    """Requests that are refused or cost nothing upstream don't use up the user's allowance."""
+
+    def setUp(self):
+        cache.clear()
+        ratelimit._policies.clear()
+        self.addCleanup(ratelimit._policies.clear)
+        self.user = User.objects.create_user("limited", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat = Chat.objects.create(user=self.user)
+
+    def _remaining(self, endpoint):
+        result = ratelimit.check(endpoint, self.user)
+        ratelimit.refund(endpoint, self.user)
+        return result.remaining
+
+    def test_empty_chat_message_is_not_charged(self):
+        response = self.client.post(f"/api/chats/{self.chat.id}/messages/", {"content": "  "}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._remaining("chat"), 1) # Only our own check was taken
+
+    async def test_empty_chat_message_is_not_charged_async(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        request = AsyncRequestFactory().post(
+            f"/api/chats/{self.chat.id}/messages/", json.dumps({"content": ""}),
+            content_type="application/json", headers={"Authorization": f"Bearer {token}"},
+        )
+        response = await async_views.chat_message_create(request, self.chat.id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(await sync_to_async(self._remaining)("chat"), 1)
+
+    def test_following_a_download_is_not_charged(self):
+        use_temp_tts_cache(self)
+        key = tts_cache.cache_key("Bonjour", views.VOICE_ID, views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        fill = tts_cache.begin_fill(key)
+        response = self.client.post("/api/text-to-speech/", {"text": "Bonjour"}, format="json")
+        list(fill.tee(iter([b"ID3"])))
+        self.assertEqual(b"".join(response.streaming_content), b"ID3")
+        self.assertEqual(self._remaining("tts"), 1)
+
+    @override_settings(RATE_LIMITS={"tts": ONE_A_DAY})
+    def test_refused_tts_request_does_not_claim_the_fill(self):
+        use_temp_tts_cache(self)
+        ratelimit.check("tts", self.user) # The day's only clip
+        session = FakeSession(FakeResponse(content=b"ID3"))
+        with mock.patch("base.views.http_session", return_value=session):
+            response = self.client.post("/api/text-to-speech/", {"text": "Bonjour"}, format="json")
+        response.close()
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="freelimit.mp3"')
+        self.assertEqual(session.calls, [])
+        key = tts_cache.cache_key("Bonjour", views.VOICE_ID, views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        self.assertIsNotNone(tts_cache.begin_fill(key)) # Still free for a user who has quota
@@ -0,0 +1,62 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base.models import Card, CardSet, Chat
+
+
+@skipUnless(connection.vendor in ("sqlite", "postgresql"), "Full-text search needs SQLite FTS5 or PostgreSQL")
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("seeker", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.card_set = CardSet.objects.create(user=self.user, name="French verbs", description="Irregular <b>ones</b>")
+        self.etre = Card.objects.create(card_set=self.card_set, term="être", definition="to be")
+        self.avoir = Card.objects.create(card_set=self.card_set, term="avoir", definition="to have, to own")
+        chat = Chat.objects.create(user=self.user)
+        self.message = chat.add_message("user", "How do I conjugate avoir in the past tense?")
+        other = User.objects.create_user("other", password="pw")
+        Card.objects.create(card_set=CardSet.objects.create(user=other, name="Theirs"), term="avoir", definition="x")
+
+    def _search(self, q, **params):
+        return self.client.get("/api/search/", {"q": q, **params}).json()
+
+    def _hits(self, q):
+        return [(hit["type"], hit["id"]) for hit in self._search(q)["results"]]
+
+    def test_finds_cards_sets_and_messages_of_this_user_only(self):
+        hits = self._hits("avoir")
+        self.assertCountEqual(hits, [("card", self.avoir.id), ("message", self.message.id)])
+        card = next(hit for hit in self._search("avoir")["results"] if hit["type"] == "card")
+        self.assertEqual(card["parent"], self.card_set.id)
+
+    def test_last_word_matches_as_a_prefix_and_all_words_must_match(self):
+        self.assertEqual(self._hits("ver"), [("card_set", self.card_set.id)])
+        self.assertEqual(self._hits("to ow"), [("card", self.avoir.id)])
+        self.assertEqual(self._hits("to be have"), [])
+
+    def test_snippets_are_escaped_and_highlighted(self):
+        snippet = self._search("irregular")["results"][0]["snippet"]
+        self.assertIn("<mark>Irregular</mark>", snippet)
+        self.assertIn("&lt;b&gt;", snippet)
+
+    def test_index_follows_writes(self):
+        Card.objects.filter(id=self.etre.id).update(definition="to exist") # Bulk updates included
+        self.assertEqual(self._hits("exist"), [("card", self.etre.id)])
+        self.assertEqual(self._hits("be"), [])
+        self.card_set.delete()
+        self.assertEqual(self._hits("avoir"), [("message", self.message.id)])
+
+    def test_paging_and_empty_queries(self):
+        first = self._search("to", limit=1)
+        self.assertEqual(len(first["results"]), 1)
+        self.assertEqual(first["next_offset"], 1)
+        second = self._search("to", limit=1, offset=1)
+        self.assertIsNone(second["next_offset"])
+        self.assertNotEqual(first["results"][0]["id"], second["results"][0]["id"])
+        self.assertEqual(self._search("  !? ")["results"], [])
+        self.assertEqual(self.client.get("/api/search/", {"q": "x", "limit": "many"}).status_code, 400)
@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from base import singleflight
+from base.singleflight import asingle_flight, flight_key, single_flight
+
+KEY = flight_key("test", {"prompt": "Hi"})
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def _call(self, value="mine"):
+        def call():
+            self.calls.append(value)
+            return value
+        return call
+
+    def _hold_lock(self):
+        """Another request is the leader: its lock is taken and its result not yet published."""
+        token = "their-token"
+        cache.add(f"{KEY}:lock", token, timeout=60)
+        return token
+
+    def test_key_is_canonical(self):
+        self.assertEqual(flight_key("test", {"a": 1, "b": 2}), flight_key("test", {"b": 2, "a": 1}))
+        self.assertNotEqual(flight_key("test", {"a": 1}), flight_key("other", {"a": 1}))
+
+    def test_recent_result_is_reused(self):
+        self.assertEqual(single_flight(KEY, self._call("first"), lock_timeout=5), "first")
+        self.assertEqual(single_flight(KEY, self._call("second"), lock_timeout=5), "first")
+        self.assertEqual(self.calls, ["first"])
+
+    def test_without_reuse_result_a_finished_call_is_not_taken(self):
+        single_flight(KEY, self._call("first"), lock_timeout=5)
+        self.assertEqual(single_flight(KEY, self._call("second"), lock_timeout=5, reuse_result=False), "second")
+
+    def test_waiter_gets_the_in_flight_result(self):
+        token = self._hold_lock()
+
+        def leader_finishes(seconds):
+            singleflight._publish(KEY, token, "theirs")
+
+        with mock.patch("base.singleflight.time.sleep", side_effect=leader_finishes):
+            # Joining a call in flight is allowed even when finished results aren't reused
+            self.assertEqual(single_flight(KEY, self._call(), lock_timeout=5, reuse_result=False), "theirs")
+        self.assertEqual(self.calls, [])
+
+    def test_waiter_without_reuse_result_ignores_an_older_result(self):
+        singleflight._publish(KEY, "older-token", "stale")
+        self._hold_lock()
+        with mock.patch("base.singleflight.time.sleep"), mock.patch("base.singleflight.time.monotonic", side_effect=[0, 1, 10]):
+            self.assertEqual(single_flight(KEY, self._call(), lock_timeout=5, reuse_result=False), "mine")
+
+    def test_waiter_calls_itself_once_the_lock_times_out(self):
+        self._hold_lock()
+        with mock.patch("base.singleflight.time.sleep"), mock.patch("base.singleflight.time.monotonic", side_effect=[0, 1, 10]):
+            self.assertEqual(single_flight(KEY, self._call(), lock_timeout=5), "mine")
+        self.assertEqual(self.calls, ["mine"])
+
+    def test_failed_leader_frees_the_lock(self):
+        def fail():
+            raise RuntimeError("upstream down")
+
+        with self.assertRaises(RuntimeError):
+            single_flight(KEY, fail, lock_timeout=5)
+        self.assertIsNone(cache.get(f"{KEY}:lock"))
+        self.assertEqual(single_flight(KEY, self._call(), lock_timeout=5), "mine")
+
+    async def test_async_waiter_gets_the_in_flight_result(self):
+        token = self._hold_lock()
+
+        async def leader_finishes(seconds):
+            singleflight._publish(KEY, token, "theirs")
+
+        async def call():
+            raise AssertionError("should have joined the call in flight")
+
+        with mock.patch("base.singleflight.asyncio.sleep", side_effect=leader_finishes):
+            self.assertEqual(await asingle_flight(KEY, call, lock_timeout=5), "theirs")
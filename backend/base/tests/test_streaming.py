@@ -0,0 +1,96 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from base import gemini
+from base.models import Chat
+
+from .fakes import FakeResponse, FakeSession, gemini_sse
+
+
+def _events(response):
+    """The (event, data) pairs of an SSE response."""
+    body = b"".join(response.streaming_content).decode()
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event, data = frame.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+class StreamedChatReplyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("streamer", password="pw") # Not rate limited
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat = Chat.objects.create(user=self.user)
+        patcher = mock.patch("base.views.GOOGLE_API_KEY", "test-key")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, deltas):
+        # The body is generated lazily, so the patch has to outlive the request
+        patcher = mock.patch("base.views._stream_gemini_api_with_history", return_value=iter(deltas))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return self.client.post(f"/api/chats/{self.chat.id}/messages/?stream=1", {"content": "Hi there"}, format="json")
+
+    def test_streams_user_message_deltas_then_saved_reply(self):
+        response = self._post(["Hel", "lo"])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = _events(response)
+        self.assertEqual([event for event, _ in events], ["user_message", "delta", "delta", "ai_message"])
+        self.assertEqual(events[0][1]["content"], "Hi there")
+        self.assertEqual([data["text"] for event, data in events if event == "delta"], ["Hel", "lo"])
+        self.assertEqual(events[-1][1]["content"], "Hello")
+        self.assertEqual(list(self.chat.messages.values_list("sender", "content")), [("user", "Hi there"), ("ai", "Hello")])
+
+    def test_reply_so_far_is_saved_when_the_client_disconnects(self):
+        response = self._post(["Partial", " answer"])
+        stream = iter(response.streaming_content)
+        next(stream) # user_message
+        next(stream) # first delta
+        response.close() # What the server does when the client goes away
+        self.assertEqual(self.chat.messages.get(sender="ai").content, "Partial")
+
+    def test_without_stream_flag_the_reply_comes_back_whole(self):
+        with mock.patch("base.views._call_gemini_api_with_history", return_value="Hello") as call:
+            response = self.client.post(f"/api/chats/{self.chat.id}/messages/", {"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["ai_message"]["content"], "Hello")
+        call.assert_called_once()
+
+
+class StreamGeminiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _stream(self, *responses):
+        session = FakeSession(*responses)
+        with mock.patch("base.gemini.http_session", return_value=session):
+            deltas = list(gemini._stream_gemini_api_with_history([{"role": "user", "parts": [{"text": "Hi"}]}], "key"))
+        return deltas, session
+
+    def test_yields_each_sse_delta(self):
+        upstream = FakeResponse(lines=gemini_sse("Hel", "lo"))
+        deltas, session = self._stream(upstream)
+        self.assertEqual(deltas, ["Hel", "lo"])
+        self.assertIn("alt=sse", session.calls[0][0])
+        self.assertTrue(session.calls[0][1]["stream"])
+        self.assertTrue(upstream.closed)
+
+    def test_blocked_prompt_ends_the_stream_with_an_apology(self):
+        blocked = 'data: {"promptFeedback": {"blockReason": "SAFETY"}}'
+        deltas, _ = self._stream(FakeResponse(lines=[blocked, ""]))
+        self.assertEqual(len(deltas), 1)
+        self.assertIn("content restrictions (SAFETY)", deltas[0])
+
+    def test_upstream_error_is_a_single_user_facing_chunk(self):
+        deltas, _ = self._stream(FakeResponse(status_code=500, json_body={"error": "boom"}))
+        self.assertEqual(deltas, [gemini._error_reply(500)])
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import sync
+from base.models import Card, CardSet, Category, Chat, Tombstone
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("offline", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(user=self.user, name="Languages")
+        self.card_set = CardSet.objects.create(user=self.user, name="French", category=self.category)
+        self.cards = [Card.objects.create(card_set=self.card_set, term=t, definition=t) for t in ("un", "deux", "trois")]
+        self.chat = Chat.objects.create(user=self.user, title="Practice")
+        # Everything so far was synced an hour ago
+        hour_ago = timezone.now() - timedelta(hours=1)
+        for model in (Category, CardSet, Card, Chat):
+            model.objects.update(updated_at=hour_ago)
+        self.token = sync.encode_token(timezone.now() - timedelta(minutes=30))
+
+    def _sync(self, since=None):
+        return self.client.get("/api/sync/", {"since": since} if since else {}).json()
+
+    def _ids(self, body, collection):
+        return [row["id"] for row in body[collection]]
+
+    def test_first_sync_is_a_full_snapshot(self):
+        body = self._sync()
+        self.assertTrue(body["full"])
+        self.assertEqual(self._ids(body, "cards"), [card.id for card in self.cards])
+        self.assertEqual(self._ids(body, "chats"), [self.chat.id])
+        self.assertGreater(sync.decode_token(body["token"]), timezone.now() - timedelta(minutes=1))
+
+    def test_delta_has_only_what_changed(self):
+        self.cards[0].definition = "one"
+        self.cards[0].save()
+        body = self._sync(self.token)
+        self.assertFalse(body["full"])
+        self.assertEqual(self._ids(body, "cards"), [self.cards[0].id])
+        self.assertEqual(body["cardsets"], [])
+        self.assertEqual(body["deleted"], {"categories": [], "cardsets": [], "cards": [], "chats": []})
+
+    def test_deleted_rows_come_back_as_tombstones(self):
+        card_ids = [self.cards[1].id, self.cards[2].id]
+        chat_id = self.chat.id
+        self.cards[1].delete()
+        Card.objects.filter(id=card_ids[1]).delete() # A queryset delete records them too
+        self.chat.delete()
+        deleted = self._sync(self.token)["deleted"]
+        self.assertEqual(sorted(deleted["cards"]), card_ids)
+        self.assertEqual(deleted["chats"], [chat_id])
+
+    def test_cascaded_deletes_are_recorded(self):
+        category_id, set_id = self.category.id, self.card_set.id
+        self.category.delete()
+        deleted = self._sync(self.token)["deleted"]
+        self.assertEqual(deleted["categories"], [category_id])
+        self.assertEqual(deleted["cardsets"], [set_id])
+        self.assertEqual(sorted(deleted["cards"]), sorted(card.id for card in self.cards))
+        self.assertEqual(Tombstone.objects.filter(user=self.user).count(), 5)
+
+    def test_other_users_deletes_stay_private(self):
+        other = User.objects.create_user("other", password="pw")
+        CardSet.objects.create(user=other, name="Theirs").delete()
+        self.assertEqual(self._sync(self.token)["deleted"]["cardsets"], [])
+
+    def test_token_older_than_the_retention_gets_a_full_snapshot(self):
+        with self.settings(SYNC_TOMBSTONE_RETENTION_DAYS=1):
+            body = self._sync(sync.encode_token(timezone.now() - timedelta(days=2)))
+        self.assertTrue(body["full"])
+        self.assertEqual(len(body["cards"]), 3)
+
+    def test_invalid_token_is_rejected(self):
+        self.assertEqual(self.client.get("/api/sync/", {"since": "garbage"}).status_code, 400)
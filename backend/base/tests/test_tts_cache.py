@@ -0,0 +1,119 @@
+import os
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from base import tts_cache, views
+from base.counters import counters
+from base.models import AudioCacheEntry
+
+from .fakes import use_temp_tts_cache
+
+
+def _key(n):
+    return f"{n:064x}"
+
+
+class TTSCacheStoreTests(TestCase):
+    def setUp(self):
+        use_temp_tts_cache(self, TTS_CACHE_MAX_BYTES=1000)
+
+    def test_stored_clip_is_found_by_key(self):
+        key = tts_cache.cache_key("Hello  world", "voice", "model", {"stability": 0.5})
+        self.assertIsNone(tts_cache.lookup(key))
+        path = tts_cache.store(key, b"ID3audio")
+        self.assertEqual(tts_cache.lookup(key), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"ID3audio")
+
+    def test_key_ignores_whitespace_but_not_voice_settings(self):
+        key = tts_cache.cache_key("Hello  world", "voice", "model", {"stability": 0.5})
+        self.assertEqual(key, tts_cache.cache_key("Hello world ", "voice", "model", {"stability": 0.5}))
+        self.assertNotEqual(key, tts_cache.cache_key("Hello world", "voice", "model", {"stability": 0.3}))
+
+    def test_least_recently_used_clips_are_evicted(self):
+        for n in range(9):
+            tts_cache.store(_key(n), b"x" * 100)
+        # Clip 0 was played recently, so clip 1 is now the least recently used
+        AudioCacheEntry.objects.exclude(key=_key(0)).update(last_accessed_at=timezone.now() - timedelta(hours=1))
+        tts_cache.store(_key(9), b"x" * 150) # 1050 bytes: over the limit
+        self.assertIsNotNone(tts_cache.lookup(_key(0)))
+        self.assertIsNone(tts_cache.lookup(_key(1)))
+        self.assertFalse(os.path.exists(tts_cache._path_for(_key(1))))
+        total = sum(AudioCacheEntry.objects.values_list("size", flat=True))
+        self.assertLessEqual(total, 900) # Down to EVICT_LOW_WATER of the limit
+        self.assertEqual(counters().get(tts_cache.TOTAL_BYTES_KEY), total)
+
+    def test_running_total_follows_stores_without_summing_the_table(self):
+        tts_cache.store(_key(0), b"x" * 100) # Seeds the total
+        with mock.patch.object(AudioCacheEntry.objects, "aggregate", side_effect=AssertionError("summed")):
+            tts_cache.store(_key(1), b"x" * 200)
+            tts_cache.store(_key(0), b"x" * 50) # Replacing a clip counts the difference
+        self.assertEqual(counters().get(tts_cache.TOTAL_BYTES_KEY), 250)
+
+    def test_disabled_cache_stores_nothing(self):
+        with self.settings(TTS_CACHE_ENABLED=False):
+            self.assertIsNone(tts_cache.store(_key(0), b"x"))
+            self.assertIsNone(tts_cache.lookup(_key(0)))
+
+
+class TTSCacheRangeTests(TestCase):
+    def setUp(self):
+        use_temp_tts_cache(self)
+        self.path = tts_cache.store(_key(1), b"0123456789")
+
+    def _get(self, range_header=None):
+        extra = {"HTTP_RANGE": range_header} if range_header else {}
+        return tts_cache.file_response(RequestFactory().get("/", **extra), self.path)
+
+    def _body(self, response):
+        body = b"".join(response.streaming_content)
+        response.close()
+        return body
+
+    def test_whole_file(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["X-TTS-Cache"], "HIT")
+        self.assertEqual(self._body(response), b"0123456789")
+
+    def test_byte_range(self):
+        response = self._get("bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(self._body(response), b"2345")
+
+    def test_open_ended_and_suffix_ranges(self):
+        self.assertEqual(self._body(self._get("bytes=7-")), b"789")
+        self.assertEqual(self._body(self._get("bytes=-3")), b"789")
+        self.assertEqual(self._body(self._get("bytes=8-100")), b"89")
+
+    def test_unsatisfiable_range(self):
+        response = self._get("bytes=20-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+
+class TTSViewCacheHitTests(TestCase):
+    def setUp(self):
+        use_temp_tts_cache(self)
+        self.user = User.objects.create_user("listener", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cached_clip_is_served_without_an_upstream_call_or_quota(self):
+        key = tts_cache.cache_key("Bonjour", views.VOICE_ID, views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        tts_cache.store(key, b"ID3cached")
+        with mock.patch("base.views.http_session") as session, mock.patch("base.ratelimit.check") as check:
+            response = self.client.post("/api/text-to-speech/", {"text": "Bonjour"}, format="json", HTTP_RANGE="bytes=0-2")
+            body = b"".join(response.streaming_content)
+        response.close()
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b"ID3")
+        session.assert_not_called()
+        check.assert_not_called()
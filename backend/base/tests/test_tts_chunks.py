@@ -0,0 +1,188 @@
+from concurrent.futures import Future
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from base import ratelimit, tts_cache, tts_chunks
+from base.elevenlabs import TTS_MODEL_ID, TTS_VOICE_SETTINGS
+
+from .fakes import FakeResponse, FakeSession, use_temp_tts_cache
+
+SENTENCES = [
+    "The mitochondria is the powerhouse of the cell and makes most of its energy.",
+    "It has its own small genome, inherited only from the mother in most animals.",
+    "Cells that need a lot of energy, like muscle cells, have thousands of them.",
+    "Without them, a cell would have to live on glycolysis alone, like bacteria do.",
+]
+LONG_TEXT = " ".join(SENTENCES)
+
+
+def _audio(segment):
+    return f"<{SENTENCES.index(segment)}>".encode() * 2000
+
+
+class ManualExecutor:
+    """
+    Stands in for the shared download pool. SQLite's in-memory test database can't be
+    written from two threads at once, so downloads run in the test's thread: straight
+    away when inline, otherwise when run_next() is called.
+    """
+
+    def __init__(self, inline=True):
+        self.inline = inline
+        self.pending = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.pending.append((future, fn, args))
+        if self.inline:
+            self.run_next()
+        return future
+
+    def run_next(self):
+        future, fn, args = self.pending.pop(0)
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+
+def use_manual_executor(testcase, inline=True):
+    executor = ManualExecutor(inline)
+    patcher = mock.patch("base.tts_chunks._chunk_executor", return_value=executor)
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+    return executor
+
+
+class SegmentTests(TestCase):
+    def test_short_text_is_one_segment(self):
+        self.assertEqual(tts_chunks.segments("  Hello   world. Bye. "), ["Hello world. Bye."])
+
+    def test_long_text_is_split_at_sentence_ends(self):
+        self.assertEqual(tts_chunks.segments(LONG_TEXT), SENTENCES)
+
+    def test_abbreviations_followed_by_lowercase_are_not_sentence_ends(self):
+        text = "Use a buffer, e.g. a ring buffer, for this. " * 6
+        self.assertTrue(all(part.endswith("for this.") for part in tts_chunks.segments(text)))
+
+    def test_overlong_sentences_are_cut(self):
+        parts = tts_chunks.segments("word, " * 120)
+        self.assertGreater(len(parts), 1)
+        self.assertTrue(all(len(part) <= tts_chunks.MAX_SEGMENT_CHARS for part in parts))
+
+    def test_cjk_sentence_ends(self):
+        text = "这是第一句话。" * 40
+        self.assertEqual(tts_chunks.segments(text), ["这是第一句话。"] * 40)
+
+
+class ChunkedStreamingTests(TransactionTestCase):
+    """Downloads close their thread's DB connections, so these run outside a test transaction."""
+
+    def setUp(self):
+        cache.clear()
+        use_temp_tts_cache(self)
+        self.fetched = []
+
+    def _plan(self, text=LONG_TEXT):
+        return tts_chunks.plan(tts_chunks.segments(text), "voice", TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+
+    def _fetch(self, fail=()):
+        def fetch(segment):
+            self.fetched.append(segment)
+            if SENTENCES.index(segment) in fail:
+                return FakeResponse(status_code=500)
+            return FakeResponse(content=_audio(segment))
+        return fetch
+
+    def test_segments_stream_in_order_and_are_cached_separately(self):
+        use_manual_executor(self)
+        response = tts_chunks.streaming_response(self._plan(), self._fetch())
+        self.assertEqual(b"".join(response.streaming_content), b"".join(_audio(sentence) for sentence in SENTENCES))
+        self.assertEqual(self.fetched, SENTENCES)
+        self.assertTrue(all(cached for _, _, cached in self._plan()))
+
+    def test_cached_sentences_are_not_fetched_again(self):
+        use_manual_executor(self)
+        b"".join(tts_chunks.streaming_response(self._plan(" ".join(SENTENCES[:3])), self._fetch()).streaming_content)
+        self.fetched.clear()
+        # A different text that shares three of its sentences
+        body = b"".join(tts_chunks.streaming_response(self._plan(), self._fetch()).streaming_content)
+        self.assertEqual(self.fetched, [SENTENCES[3]])
+        self.assertEqual(body, b"".join(_audio(sentence) for sentence in SENTENCES))
+
+    @override_settings(TTS_CHUNK_CONCURRENCY=2)
+    def test_downloads_are_bounded_and_start_in_text_order(self):
+        executor = use_manual_executor(self, inline=False)
+        downloads = tts_chunks._Downloads(self._plan(), self._fetch())
+        self.assertEqual([args[1] for _, _, args in executor.pending], SENTENCES[:2])
+        executor.run_next() # Each finished download submits the next one
+        self.assertEqual([args[1] for _, _, args in executor.pending], SENTENCES[1:3])
+        self.assertEqual([event.is_set() for event in downloads.started], [True, False, False, False])
+
+        downloads.close() # The client went away: nothing more is started
+        while executor.pending:
+            executor.run_next()
+        self.assertEqual(self.fetched, SENTENCES[:1])
+
+    def test_failed_first_segment_gives_no_response(self):
+        use_manual_executor(self)
+        self.assertIsNone(tts_chunks.streaming_response(self._plan(), self._fetch(fail={0})))
+
+    def test_failed_later_segment_ends_the_audio_there(self):
+        use_manual_executor(self)
+        response = tts_chunks.streaming_response(self._plan(), self._fetch(fail={2}))
+        self.assertEqual(b"".join(response.streaming_content), _audio(SENTENCES[0]) + _audio(SENTENCES[1]))
+
+
+@override_settings(RATE_LIMITS={"tts": [{"algorithm": "quota", "limit": 5, "period": "day"}]})
+class ChunkedTTSViewTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit._policies.clear()
+        self.addCleanup(ratelimit._policies.clear)
+        use_temp_tts_cache(self)
+        use_manual_executor(self)
+        for target in ("base.views.ELABS_API_KEY", "base.views.VOICE_ID"):
+            patcher = mock.patch(target, "voice")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("listener", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _post(self, session):
+        with mock.patch("base.elevenlabs.http_session", return_value=session):
+            response = self.client.post("/api/text-to-speech/", {"text": LONG_TEXT}, format="json")
+            body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def _quota_left(self):
+        result = ratelimit.check("tts", self.user)
+        ratelimit.refund("tts", self.user)
+        return result.remaining
+
+    def test_long_text_is_synthesized_sentence_by_sentence(self):
+        session = FakeSession(FakeResponse(content=b"ID3" * 1000))
+        response, body = self._post(session)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b"ID3" * 4000)
+        self.assertEqual(sorted(kwargs["json"]["text"] for _, kwargs in session.calls), sorted(SENTENCES))
+        self.assertEqual(self._quota_left(), 3)
+
+        # Every sentence is cached now, so the same text again is free
+        session = FakeSession(FakeResponse(content=b"unused"))
+        response, body = self._post(session)
+        self.assertEqual(body, b"ID3" * 4000)
+        self.assertEqual(session.calls, [])
+        self.assertEqual(self._quota_left(), 3)
+
+    def test_first_segment_failure_is_a_bad_gateway(self):
+        response, _ = self._post(FakeSession(FakeResponse(status_code=500)))
+        self.assertEqual(response.status_code, 502)
+        key = tts_cache.cache_key(SENTENCES[0], "voice", TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+        self.assertIsNone(tts_cache.lookup(key))
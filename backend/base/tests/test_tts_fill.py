@@ -0,0 +1,141 @@
+import json
+import os
+import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from base import async_views, tts_cache, views
+from base.models import AudioCacheEntry
+
+from .fakes import FakeResponse, FakeSession, use_temp_tts_cache
+
+
+class CacheFillTests(TestCase):
+    def setUp(self):
+        use_temp_tts_cache(self)
+        self.key = tts_cache.cache_key("hello", "voice", "model", {})
+
+    def test_concurrent_request_follows_the_fill(self):
+        fill = tts_cache.begin_fill(self.key)
+        self.assertIsNotNone(fill)
+        self.assertIsNone(tts_cache.begin_fill(self.key)) # Already being downloaded
+
+        downloading = fill.tee(iter([b"abc", b"def"]))
+        self.assertEqual(next(downloading), b"abc")
+        follower = tts_cache.follow(self.key)
+        self.assertEqual(next(follower), b"abc")
+        self.assertEqual(list(downloading), [b"def"])
+        self.assertEqual(b"".join(follower), b"def")
+
+        with open(tts_cache.lookup(self.key), "rb") as f:
+            self.assertEqual(f.read(), b"abcdef")
+        self.assertTrue(AudioCacheEntry.objects.filter(key=self.key, size=6).exists())
+
+    def test_failed_fill_is_discarded(self):
+        fill = tts_cache.begin_fill(self.key)
+        downloading = fill.tee(iter([b"abc"]))
+        next(downloading)
+        downloading.close() # The client went away
+        self.assertIsNone(tts_cache.lookup(self.key))
+        self.assertEqual(list(tts_cache.follow(self.key)), [])
+        self.assertIsNotNone(tts_cache.begin_fill(self.key)) # Free to claim again
+
+    def test_stale_fill_is_taken_over(self):
+        tts_cache.begin_fill(self.key) # Its downloader never finishes
+        part_path = tts_cache._path_for(self.key) + tts_cache.PART_SUFFIX
+        old = time.time() - tts_cache.STALE_FILL_SECONDS - 1
+        os.utime(part_path, (old, old))
+        self.assertIsNotNone(tts_cache.begin_fill(self.key))
+
+    async def test_async_tee_and_follow(self):
+        fill = tts_cache.begin_fill(self.key)
+
+        async def chunks():
+            yield b"ab"
+            yield b"cd"
+
+        downloading = fill.atee(chunks())
+        self.assertEqual(await downloading.__anext__(), b"ab")
+        follower = tts_cache.afollow(self.key)
+        self.assertEqual(await follower.__anext__(), b"ab")
+        self.assertEqual([chunk async for chunk in downloading], [b"cd"])
+        self.assertEqual(b"".join([chunk async for chunk in follower]), b"cd")
+        self.assertTrue(os.path.exists(tts_cache._path_for(self.key)))
+
+
+class TTSViewFillTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_temp_tts_cache(self)
+        self.user = User.objects.create_user("listener", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for name, value in (("ELABS_API_KEY", "el-key"), ("VOICE_ID", "voice")):
+            patcher = mock.patch(f"base.views.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _post(self, session):
+        patcher = mock.patch("base.views.http_session", return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return self.client.post("/api/text-to-speech/", {"text": "Bonjour"}, format="json")
+
+    def test_miss_streams_the_upstream_clip_into_the_cache(self):
+        response = self._post(FakeSession(FakeResponse(content=b"ID3" + b"x" * 20000)))
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), 20003)
+        key = tts_cache.cache_key("Bonjour", "voice", views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        self.assertIsNotNone(tts_cache.lookup(key))
+
+        repeat = self.client.post("/api/text-to-speech/", {"text": "Bonjour"}, format="json")
+        self.assertEqual(repeat["X-TTS-Cache"], "HIT")
+        repeat.close()
+
+    def test_request_during_a_download_follows_it(self):
+        key = tts_cache.cache_key("Bonjour", "voice", views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        fill = tts_cache.begin_fill(key)
+        downloading = fill.tee(iter([b"ID3", b"rest"]))
+        next(downloading)
+        session = FakeSession(FakeResponse(content=b"should not be requested"))
+        response = self._post(session)
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b"ID3")
+        list(downloading)
+        self.assertEqual(b"".join(stream), b"rest")
+        self.assertEqual(session.calls, [])
+
+    def test_upstream_error_leaves_nothing_in_the_cache(self):
+        response = self._post(FakeSession(FakeResponse(status_code=401, content=b"bad key")))
+        self.assertEqual(response.status_code, 401)
+        key = tts_cache.cache_key("Bonjour", "voice", views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        self.assertIsNone(tts_cache.lookup(key))
+        self.assertIsNotNone(tts_cache.begin_fill(key))
+
+
+class AsyncTTSViewFillTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        use_temp_tts_cache(self)
+        self.user = User.objects.create_user("async-listener", password="pw")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def test_request_during_a_download_follows_it(self):
+        key = tts_cache.cache_key("Bonjour", views.VOICE_ID, views.TTS_MODEL_ID, views.TTS_VOICE_SETTINGS)
+        fill = await sync_to_async(tts_cache.begin_fill)(key)
+        request = AsyncRequestFactory().post(
+            "/api/text-to-speech/", json.dumps({"text": "Bonjour"}),
+            content_type="application/json", headers={"Authorization": f"Bearer {self.token}"},
+        )
+        with mock.patch("base.async_views.async_http_client") as client:
+            response = await async_views.text_to_speech(request)
+        await sync_to_async(list)(fill.tee(iter([b"ID3", b"rest"]))) # The other request's download
+        self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), b"ID3rest")
+        client.assert_not_called()
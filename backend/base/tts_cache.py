@@ -0,0 +1,390 @@
+# base/tts_cache.py
+"""
+Content-addressed on-disk cache for ElevenLabs TTS audio.
+
+Audio is keyed on a hash of (normalized text, voice id, model id, voice_settings) and
+stored as MP3 under TTS_CACHE_DIR (inside MEDIA_ROOT). AudioCacheEntry rows track size
+and last access so every worker shares one LRU order, and the least recently used files
+are evicted once the cache grows past TTS_CACHE_MAX_BYTES. The cache's total size is
+kept as a running shared counter (TOTAL_BYTES_KEY), so storing a clip doesn't sum the
+whole table; the table is only summed when eviction is due, which also corrects any drift.
+
+Misses are filled while the audio streams to the first listener (CacheFill), and
+concurrent requests for the same clip follow that download instead of starting another.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import OperationalError
+from django.db.models import Sum
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .counters import counters
+from .models import AudioCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Don't write last_accessed_at on every hit of a hot clip; LRU only needs rough order
+TOUCH_INTERVAL = timedelta(minutes=1)
+# Evict down to this fraction of the limit so we don't evict again on the next insert
+EVICT_LOW_WATER = 0.9
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+READ_CHUNK_SIZE = 8192
+PART_SUFFIX = ".part"
+FOLLOW_POLL_INTERVAL = 0.05 # seconds between reads while following an in-progress fill
+STALE_FILL_SECONDS = 60 # A fill that hasn't grown for this long is treated as dead
+REGISTER_ATTEMPTS = 3 # e.g. SQLite's "database is locked" while another thread writes
+REGISTER_BACKOFF = 0.2 # seconds, doubled after each failed attempt
+TOTAL_BYTES_KEY = "tts_cache:bytes"
+
+# Fills finishing on several threads at once (base/tts_chunks.py) index one at a time
+_register_lock = threading.Lock()
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text, voice_id, model_id, voice_settings):
+    material = json.dumps(
+        [normalize_text(text), voice_id, model_id, voice_settings],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _path_for(key):
+    # Fan out over 256 subdirectories so no single directory gets huge
+    return os.path.join(settings.TTS_CACHE_DIR, key[:2], f"{key}.mp3")
+
+
+def lookup(key):
+    """Returns the path of the cached audio for key and marks it as used, or None."""
+    if not settings.TTS_CACHE_ENABLED:
+        return None
+    path = _path_for(key)
+    if not os.path.exists(path):
+        return None
+    now = timezone.now()
+    AudioCacheEntry.objects.filter(key=key, last_accessed_at__lt=now - TOUCH_INTERVAL).update(last_accessed_at=now)
+    return path
+
+
+def store(key, data):
+    """Writes data as the cached audio for key, then evicts if the cache is over its limit."""
+    if not settings.TTS_CACHE_ENABLED or not data:
+        return None
+    path = _path_for(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file in the same directory and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Could not write TTS cache file {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    _register(key, len(data))
+    return path
+
+
+def _register(key, size):
+    """
+    Indexes a published clip for LRU eviction. The file is already being served, so a
+    database error is retried and then logged rather than raised into the download.
+    """
+    for attempt in range(REGISTER_ATTEMPTS):
+        try:
+            with _register_lock:
+                previous = AudioCacheEntry.objects.filter(key=key).values_list("size", flat=True).first() or 0
+                AudioCacheEntry.objects.update_or_create(
+                    key=key, defaults={"size": size, "last_accessed_at": timezone.now()}
+                )
+                if _running_total(size - previous) > settings.TTS_CACHE_MAX_BYTES:
+                    evict()
+            return True
+        except OperationalError as e:
+            if attempt + 1 < REGISTER_ATTEMPTS:
+                time.sleep(REGISTER_BACKOFF * (2 ** attempt))
+                continue
+            logger.error(f"Could not index TTS cache file for {key} ({size} bytes): {e}")
+    return False
+
+
+def _running_total(delta):
+    """Adds delta to the shared byte total and returns it, seeding it from the table if unset."""
+    total = counters().get(TOTAL_BYTES_KEY)
+    if not total:
+        # First store since the counter was created or lost; the table already includes delta
+        actual = AudioCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+        if counters().compare_and_set(TOTAL_BYTES_KEY, None, actual):
+            return actual
+    return counters().incr(TOTAL_BYTES_KEY, delta)
+
+
+def _sync_total(actual):
+    # Other workers may have moved the counter meanwhile; close enough, the next eviction re-syncs
+    counters().incr(TOTAL_BYTES_KEY, actual - counters().get(TOTAL_BYTES_KEY))
+
+
+def evict():
+    total = AudioCacheEntry.objects.aggregate(total=Sum("size"))["total"] or 0
+    if total <= settings.TTS_CACHE_MAX_BYTES:
+        _sync_total(total)
+        return
+    target = settings.TTS_CACHE_MAX_BYTES * EVICT_LOW_WATER
+    evicted = 0
+    for entry in AudioCacheEntry.objects.order_by("last_accessed_at").only("id", "key", "size").iterator():
+        if total <= target:
+            break
+        try:
+            os.remove(_path_for(entry.key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not evict TTS cache file for {entry.key}: {e}")
+            continue
+        entry.delete()
+        total -= entry.size
+        evicted += 1
+    _sync_total(total)
+    logger.info(f"Evicted {evicted} TTS cache entries, cache is now {total} bytes.")
+
+
+class CacheFill:
+    """
+    An in-progress download of one clip. Chunks are passed through to the client and
+    written to <key>.mp3.part at the same time; the part file is renamed into place once
+    the upstream stream completes, or deleted if it fails or the client goes away.
+    While it exists, other requests for the same clip follow() the part file instead of
+    opening their own upstream connection.
+    """
+
+    def __init__(self, key, part_file=None):
+        self.key = key
+        self.part_file = part_file # None when caching is disabled
+        self.size = 0
+
+    def _write(self, chunk):
+        if self.part_file is not None and chunk:
+            self.part_file.write(chunk)
+            self.part_file.flush() # Followers read the part file as it grows
+            self.size += len(chunk)
+
+    def tee(self, chunks):
+        completed = False
+        try:
+            for chunk in chunks:
+                self._write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            self._finish(completed)
+
+    async def atee(self, chunks):
+        completed = False
+        try:
+            async for chunk in chunks:
+                self._write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            published = self._publish_file(completed)
+        if published:
+            await sync_to_async(_register)(self.key, self.size)
+
+    def abort(self):
+        self._finish(False)
+
+    def _finish(self, completed):
+        if self._publish_file(completed):
+            _register(self.key, self.size)
+
+    def _publish_file(self, completed):
+        """Renames or removes the part file; returns True if the clip was published."""
+        if self.part_file is None:
+            return False
+        part_file, self.part_file = self.part_file, None
+        part_file.close()
+        path = _path_for(self.key)
+        try:
+            if completed and self.size:
+                os.replace(path + PART_SUFFIX, path)
+                return True
+            os.remove(path + PART_SUFFIX)
+            logger.info(f"Discarded partial TTS cache fill for {self.key} ({self.size} bytes).")
+        except OSError as e:
+            logger.error(f"Could not finish TTS cache fill for {self.key}: {e}")
+        return False
+
+
+def begin_fill(key):
+    """
+    Claims the download of key's audio. Returns a CacheFill, or None if another request
+    (in any worker) is already downloading it, in which case use follow(key).
+    The claim is the .part file itself, so with TTS_CACHE_ENABLED off there is nothing to
+    follow and every request gets its own (non-caching) fill: identical TTS requests are
+    only coalesced while the cache is on.
+    """
+    if not settings.TTS_CACHE_ENABLED:
+        return CacheFill(key)
+    part_path = _path_for(key) + PART_SUFFIX
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    for _ in range(2):
+        try:
+            # O_EXCL makes the claim atomic across processes sharing the cache directory
+            fd = os.open(part_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            return CacheFill(key, os.fdopen(fd, "wb"))
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(part_path) > STALE_FILL_SECONDS
+            except FileNotFoundError:
+                # The other fill just finished: follow() serves the published file,
+                # otherwise it was discarded and we can claim it ourselves
+                if os.path.exists(_path_for(key)):
+                    return None
+                continue
+            if not stale:
+                return None
+            logger.warning(f"Removing stale TTS cache fill for {key}.")
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+        except OSError as e:
+            logger.error(f"Could not start TTS cache fill for {key}: {e}")
+            return CacheFill(key)
+    return CacheFill(key)
+
+
+def _follow_step(key, part_file, idle_since):
+    """
+    One read from an in-progress fill. Returns (chunk, done): an empty chunk with done
+    False means no new data yet and the caller should wait and try again.
+    """
+    chunk = part_file.read(READ_CHUNK_SIZE)
+    if chunk:
+        return chunk, False
+    path = _path_for(key)
+    if os.path.exists(path + PART_SUFFIX):
+        if time.monotonic() - idle_since > STALE_FILL_SECONDS:
+            logger.warning(f"TTS cache fill for {key} stalled; giving up on it.")
+            return b"", True
+        return b"", False
+    # The part file is gone: either renamed into place (our handle now points at the
+    # published file, so drain it) or discarded after a failure.
+    try:
+        published = os.fstat(part_file.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        published = False
+    if published:
+        return part_file.read(), True
+    logger.warning(f"TTS cache fill for {key} was abandoned by its downloader.")
+    return b"", True
+
+
+def _open_fill_for_reading(key):
+    path = _path_for(key)
+    try:
+        return open(path + PART_SUFFIX, "rb")
+    except FileNotFoundError:
+        try:
+            return open(path, "rb") # Finished between the claim attempt and now
+        except FileNotFoundError:
+            return None
+
+
+def follow(key):
+    """Streams the audio another request is downloading for key, as it arrives."""
+    part_file = _open_fill_for_reading(key)
+    if part_file is None:
+        return
+    with part_file:
+        idle_since = time.monotonic()
+        while True:
+            chunk, done = _follow_step(key, part_file, idle_since)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+            if done:
+                return
+            if not chunk:
+                time.sleep(FOLLOW_POLL_INTERVAL)
+
+
+async def afollow(key):
+    """Async twin of follow()."""
+    part_file = _open_fill_for_reading(key)
+    if part_file is None:
+        return
+    with part_file:
+        idle_since = time.monotonic()
+        while True:
+            chunk, done = _follow_step(key, part_file, idle_since)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+            if done:
+                return
+            if not chunk:
+                await asyncio.sleep(FOLLOW_POLL_INTERVAL)
+
+
+def file_response(request, path):
+    """Serves a cached clip, honouring a single-range Range header."""
+    size = os.path.getsize(path)
+    match = RANGE_RE.match(request.META.get("HTTP_RANGE", "").strip())
+    if match and (match.group(1) or match.group(2)):
+        start_str, end_str = match.groups()
+        if start_str:
+            start = int(start_str)
+            end = min(int(end_str), size - 1) if end_str else size - 1
+        else: # Suffix range: the last N bytes
+            start = max(0, size - int(end_str))
+            end = size - 1
+        if start > end:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        audio_file = open(path, "rb")
+        audio_file.seek(start)
+        response = StreamingHttpResponse(
+            _read_range(audio_file, end - start + 1), status=206, content_type="audio/mpeg"
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, "rb"), content_type="audio/mpeg")
+    response["Accept-Ranges"] = "bytes"
+    response["X-TTS-Cache"] = "HIT"
+    return response
+
+
+def _read_range(audio_file, length):
+    try:
+        while length > 0:
+            chunk = audio_file.read(min(READ_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        audio_file.close()
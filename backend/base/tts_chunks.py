@@ -0,0 +1,225 @@
+# base/tts_chunks.py
+"""
+Sentence-by-sentence synthesis for long TTS texts.
+
+Texts longer than SPLIT_MIN_CHARS are split at sentence boundaries (segments()). Each
+segment is its own clip in the TTS cache, keyed on its own text, so definitions that share
+a sentence share its audio. The uncached segments are downloaded concurrently, at most
+settings.TTS_CHUNK_CONCURRENCY at once per response and in text order, on one pool of
+settings.TTS_CHUNK_WORKERS threads shared by the process, and the response streams them
+back in order: segment 1 plays while the rest are still being generated, so the first
+audio arrives about as fast as for a single sentence, and no single upstream call has to
+fit a whole long text in the timeout.
+
+Downloads go through the cache's fills (base/tts_cache.py), and the response follows each
+segment's fill as it grows, the same way concurrent requests for one clip share a download.
+MP3 frames are self-contained, so the segments' audio plays back to back as one stream.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+from . import tts_cache
+
+logger = logging.getLogger(__name__)
+
+SPLIT_MIN_CHARS = 200 # shorter texts are synthesized in one call, as before
+MAX_SEGMENT_CHARS = 300 # longer sentences are cut at a comma or space
+SEGMENT_START_TIMEOUT = 60 # seconds to wait for a segment's download to begin
+# Sentence ends: . ! ? … followed by space and not a lowercase letter (e.g. "i.e. this"), or CJK ones
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+(?![a-z])|(?<=[。！？])")
+
+
+def _cut(sentence):
+    while len(sentence) > MAX_SEGMENT_CHARS:
+        cut = max(sentence.rfind(", ", 0, MAX_SEGMENT_CHARS) + 1, sentence.rfind(" ", 0, MAX_SEGMENT_CHARS))
+        cut = cut if cut > 0 else MAX_SEGMENT_CHARS
+        yield sentence[:cut].strip()
+        sentence = sentence[cut:].strip()
+    if sentence:
+        yield sentence
+
+
+def segments(text):
+    """The parts text is synthesized in: [text] itself unless it is long enough to split."""
+    text = tts_cache.normalize_text(text)
+    if len(text) < SPLIT_MIN_CHARS:
+        return [text]
+    return [part for sentence in SENTENCE_END_RE.split(text) for part in _cut(sentence.strip())]
+
+
+def plan(parts, voice_id, model_id, voice_settings):
+    """[(segment, cache key, cached)] for the segments of a text."""
+    result = []
+    for part in parts:
+        key = tts_cache.cache_key(part, voice_id, model_id, voice_settings)
+        result.append((part, key, tts_cache.lookup(key) is not None))
+    return result
+
+
+def _fill(key, segment, fetch, started):
+    """Downloads one segment into the cache. fetch(segment) opens the upstream audio stream."""
+    try:
+        try:
+            fill = tts_cache.begin_fill(key)
+        finally:
+            started.set() # From here the segment can be followed (or it has failed)
+        if fill is None:
+            return # Another request is downloading it; the response follows that fill
+        response = None
+        try:
+            response = fetch(segment)
+            response.raise_for_status()
+            for _chunk in fill.tee(response.iter_content(chunk_size=8192)):
+                pass
+        except Exception as e:
+            fill.abort() # A no-op if tee() already discarded the partial clip
+            logger.error(f"ElevenLabs error for a TTS segment ({len(segment)} chars): {e}")
+        finally:
+            if response is not None:
+                response.close()
+    finally:
+        connections.close_all() # This thread's own connections (the cache index is in the DB)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _chunk_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.TTS_CHUNK_WORKERS, thread_name_prefix="tts-chunk")
+    return _executor
+
+
+class _Downloads:
+    """
+    The uncached segments of one response, downloading in the background in text order.
+    At most TTS_CHUNK_CONCURRENCY are submitted to the shared pool at a time; each one
+    that finishes submits the next.
+    """
+
+    def __init__(self, segments_plan, fetch):
+        self.fetch = fetch
+        self.started = [threading.Event() for _ in segments_plan]
+        self.waiting = deque()
+        self.futures = []
+        self.closed = False
+        self.lock = threading.Lock()
+        for (segment, key, cached), started in zip(segments_plan, self.started):
+            if cached:
+                started.set()
+            else:
+                self.waiting.append((key, segment, started))
+        for _ in range(settings.TTS_CHUNK_CONCURRENCY):
+            self._submit_next()
+
+    def _submit_next(self, _finished=None):
+        with self.lock:
+            if self.closed or not self.waiting:
+                return
+            key, segment, started = self.waiting.popleft()
+            future = _chunk_executor().submit(_fill, key, segment, self.fetch, started)
+            self.futures.append(future)
+        future.add_done_callback(self._submit_next)
+
+    def close(self):
+        # If the client went away, don't start the segments still waiting; running ones
+        # finish into the cache
+        with self.lock:
+            self.closed = True
+            futures = list(self.futures)
+        # Outside the lock: cancel() runs the future's done callback (_submit_next) right here
+        for future in futures:
+            future.cancel()
+
+
+def _stream(segments_plan, fetch):
+    downloads = _Downloads(segments_plan, fetch)
+    try:
+        for index, (_segment, key, _cached) in enumerate(segments_plan):
+            if not downloads.started[index].wait(SEGMENT_START_TIMEOUT):
+                logger.error(f"TTS segment {index + 1}/{len(segments_plan)} never started; ending the stream.")
+                return
+            sent = 0
+            for chunk in tts_cache.follow(key):
+                sent += len(chunk)
+                yield chunk
+            # A segment that failed, or broke off part way, ends the audio here
+            if not sent or tts_cache.lookup(key) is None:
+                logger.error(f"TTS segment {index + 1}/{len(segments_plan)} failed; ending the stream.")
+                return
+    finally:
+        downloads.close()
+
+
+async def _astream(segments_plan, fetch):
+    downloads = _Downloads(segments_plan, fetch)
+    try:
+        for index, (_segment, key, _cached) in enumerate(segments_plan):
+            waited = 0
+            while not downloads.started[index].is_set():
+                if waited > SEGMENT_START_TIMEOUT:
+                    logger.error(f"TTS segment {index + 1}/{len(segments_plan)} never started; ending the stream.")
+                    return
+                await asyncio.sleep(tts_cache.FOLLOW_POLL_INTERVAL)
+                waited += tts_cache.FOLLOW_POLL_INTERVAL
+            sent = 0
+            async for chunk in tts_cache.afollow(key):
+                sent += len(chunk)
+                yield chunk
+            if not sent or await sync_to_async(tts_cache.lookup)(key) is None:
+                logger.error(f"TTS segment {index + 1}/{len(segments_plan)} failed; ending the stream.")
+                return
+    finally:
+        downloads.close()
+
+
+def streaming_response(segments_plan, fetch):
+    """
+    Streams the segments' audio in order, downloading the uncached ones as it goes.
+    Returns None if the first segment fails, so the caller can answer with an error.
+    """
+    chunks = _stream(segments_plan, fetch)
+    first = next(chunks, None)
+    if first is None:
+        return None
+
+    def audio_stream():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            chunks.close() # Stops the downloads not yet started if the client goes away
+
+    return StreamingHttpResponse(audio_stream(), content_type="audio/mpeg")
+
+
+async def astreaming_response(segments_plan, fetch):
+    """Async twin of streaming_response."""
+    chunks = _astream(segments_plan, fetch)
+    first = await anext(chunks, None)
+    if first is None:
+        return None
+
+    async def audio_stream():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return StreamingHttpResponse(audio_stream(), content_type="audio/mpeg")
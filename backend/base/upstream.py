@@ -0,0 +1,73 @@
+# base/upstream.py
+"""
+Shared, pooled HTTP clients for the upstream APIs (Gemini, ElevenLabs).
+
+Opening a new TLS connection per request costs a few hundred milliseconds, so both the
+sync views and the async views go through the clients here and reuse keep-alive
+connections instead of calling requests.post / httpx directly.
+"""
+
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+_session = None
+_session_lock = threading.Lock()
+
+# One AsyncClient per event loop: an httpx pool can't be shared across loops. Under ASGI
+# there is a single loop per worker process, so in practice this is one shared pool.
+_async_clients = weakref.WeakKeyDictionary()
+
+# httpx 0.13 raises transport failures (timeouts, connection errors) as httpcore exceptions
+# that don't subclass httpx.HTTPError, so catch this tuple around async upstream calls.
+ASYNC_HTTP_ERRORS = (
+    httpx.HTTPError,
+    httpx.NetworkError,
+    httpx.ProtocolError,
+    httpx.ProxyError,
+    httpx.ConnectTimeout,
+    httpx.ReadTimeout,
+    httpx.WriteTimeout,
+    httpx.PoolTimeout,
+)
+
+
+def http_session():
+    """Process-wide requests.Session used by the sync (WSGI) views."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=10,
+                    pool_maxsize=settings.UPSTREAM_KEEPALIVE_CONNECTIONS,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def async_http_client():
+    """
+    Shared httpx.AsyncClient for the running event loop.
+    Must be called from inside a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.UPSTREAM_TIMEOUT),
+            pool_limits=httpx.PoolLimits(
+                soft_limit=settings.UPSTREAM_KEEPALIVE_CONNECTIONS,
+                hard_limit=settings.UPSTREAM_MAX_CONNECTIONS,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
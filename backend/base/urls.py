@@ -1,4 +1,5 @@
 # base/urls.py
+from django.conf import settings
 from django.urls import path
 # from rest_framework_simplejwt.views import TokenRefreshView # If you use refresh tokens explicitly
 from .views import (
@@ -12,8 +13,17 @@ from .views import (
     CategoryDetailView,
     CardSetListCreateView,
     CardSetDetailView,
+    CardSetImportView,
+    CardSetExportView,
+    CardSetGenerateView,
+    CardSetPrepareAudioView,
     CardListCreateView,
     CardDetailView,
+    CardBulkView,
+    DashboardView,
+    SyncView,
+    SearchView,
+    JobDetailView,
     google_login,
     google_register,
 
@@ -22,6 +32,17 @@ from .views import (
     ChatSessionDetailView,
     ChatMessageCreateView,
 )
+from . import async_views
+
+if settings.ASYNC_UPSTREAM_VIEWS:
+    # Non-blocking versions for ASGI deployments (see base/async_views.py)
+    chat_message_create_view = async_views.chat_message_create
+    text_to_speech_view = async_views.text_to_speech
+    text_to_speech_slow_view = async_views.text_to_speech_slow
+else:
+    chat_message_create_view = ChatMessageCreateView.as_view()
+    text_to_speech_view = TextToSpeechView.as_view()
+    text_to_speech_slow_view = SlowTextToSpeechView.as_view()
 
 urlpatterns = [
     # Auth
@@ -33,19 +54,28 @@ urlpatterns = [
     # New Chat History Endpoints
     path('chats/', ChatSessionListCreateView.as_view(), name='chat-session-list-create'),
     path('chats/<int:session_id>/', ChatSessionDetailView.as_view(), name='chat-session-detail'),
-    path('chats/<int:session_id>/messages/', ChatMessageCreateView.as_view(), name='chat-message-create'),
+    path('chats/<int:session_id>/messages/', chat_message_create_view, name='chat-message-create'),
 
     # Your existing TTS and Card/Category endpoints
     # path("gemini/", GeminiView.as_view(), name="gemini_view"), # Keep if used for non-chat purposes
-    path("text-to-speech/", TextToSpeechView.as_view(), name="text_to_speech_view"),
-    path("text-to-speech-slow/", SlowTextToSpeechView.as_view(), name="text_to_speech_slow"),
+    path("text-to-speech/", text_to_speech_view, name="text_to_speech_view"),
+    path("text-to-speech-slow/", text_to_speech_slow_view, name="text_to_speech_slow"),
 
     path("categories/", CategoryListCreateView.as_view(), name="category-list-create"),
     path("categories/<int:pk>/", CategoryDetailView.as_view(), name="category-detail"),
     path("cardsets/", CardSetListCreateView.as_view(), name="cardset-list-create"),
     path("cardsets/<int:pk>/", CardSetDetailView.as_view(), name="cardset-detail"),
+    path("cardsets/import/", CardSetImportView.as_view(), name="cardset-import"),
+    path("cardsets/<int:pk>/export/", CardSetExportView.as_view(), name="cardset-export"),
+    path("cardsets/<int:pk>/generate/", CardSetGenerateView.as_view(), name="cardset-generate"),
+    path("cardsets/<int:pk>/prepare-audio/", CardSetPrepareAudioView.as_view(), name="cardset-prepare-audio"),
     path("cards/", CardListCreateView.as_view(), name="card-list-create"),
     path("cards/<int:pk>/", CardDetailView.as_view(), name="card-detail"),
+    path("cards/bulk/", CardBulkView.as_view(), name="card-bulk"),
+    path("dashboard/", DashboardView.as_view(), name="dashboard"),
+    path("sync/", SyncView.as_view(), name="sync"),
+    path("search/", SearchView.as_view(), name="search"),
+    path("jobs/<int:pk>/", JobDetailView.as_view(), name="job-detail"),
 
     # Remove or comment out old chat history if replaced
     # path("chat-history/", ChatHistoryView.as_view(), name="chat_history"),
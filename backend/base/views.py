@@ -1,5 +1,6 @@
 # backend/base/views.py
 
+import json
 import logging
 import os
 import time
@@ -8,14 +9,20 @@ import random
 import requests # For calling external APIs like Gemini, ElevenLabs
 from dotenv import load_dotenv
 
-from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import JsonResponse, FileResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q
+from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.urls import reverse
+from django.utils.text import slugify
 from django.conf import settings
 
-from rest_framework import status, generics, permissions
+from rest_framework import status, generics, permissions, serializers
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -30,15 +37,44 @@ from google.oauth2 import id_token
 # If not, adjust the import path accordingly.
 # from .decorators import log_request, require_permissions, class_log_request
 
-from .models import Chat, Message, Category, CardSet, Card
+from .models import Chat, Category, CardSet, Card, Job
+from .gemini import (
+    GOOGLE_API_KEY,
+    RATE_LIMIT_MESSAGES,
+    CIRCUIT_OPEN_MESSAGE,
+    gemini_breaker,
+    _call_gemini_api_with_history,
+    _stream_gemini_api_with_history,
+)
+from .chat import build_prompt_history, save_ai_reply
+from .elevenlabs import (
+    ELABS_API_KEY,
+    VOICE_ID,
+    TTS_MODEL_ID,
+    TTS_TIMEOUT,
+    TTS_VOICE_SETTINGS,
+    SLOW_TTS_VOICE_SETTINGS,
+    open_stream,
+    tts_request,
+)
+from . import ratelimit
+from .idempotency import idempotent
+from .pagination import KeysetPagination, MessageKeysetPagination
+from . import decks, generation, jobs, search, sync, tts_cache, tts_chunks
+from .upstream import http_session
+from .versions import VersionedCollectionMixin, bump
 from .serializers import (
     CategorySerializer,
     CardSetSerializer,
     CardSerializer,
+    CardBulkItemSerializer,
     UserRegistrationSerializer,
     MessageSerializer,
     ChatSessionListSerializer,
     ChatSessionDetailSerializer,
+    DashboardCardSetSerializer,
+    DashboardCategorySerializer,
+    JobSerializer,
     MyTokenObtainPairSerializer # Make sure this is defined in your serializers.py
 )
 
@@ -46,10 +82,7 @@ from .serializers import (
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-# Fetch API Keys from .env
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-ELABS_API_KEY = os.getenv("ELABS_API_KEY")
-VOICE_ID = os.getenv("VOICE_ID")
+# The Gemini / ElevenLabs keys are read in base/gemini.py and base/elevenlabs.py
 # GOOGLE_CLIENT_ID is usually accessed via settings.GOOGLE_CLIENT_ID
 
 # --- Existing Authentication and Registration Views ---
@@ -148,7 +181,8 @@ def register(request):
 
 
 # --- Existing Category, CardSet, Card Views ---
-class CategoryListCreateView(generics.ListCreateAPIView):
+class CategoryListCreateView(VersionedCollectionMixin, generics.ListCreateAPIView):
+    version_collection = "categories"
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
@@ -156,7 +190,9 @@ class CategoryListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CategoryDetailView(VersionedCollectionMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_collection = "categories"
+    cascade_collections = ("cardsets", "cards") # Deleting a category deletes its sets and their cards
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
@@ -164,29 +200,72 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     # Your custom destroy logic for Category can remain if needed,
     # or rely on model's on_delete=models.CASCADE if set up correctly.
 
-class CardSetListCreateView(generics.ListCreateAPIView):
+def _truthy(value):
+    return value.lower() in ("1", "true", "yes")
+
+
+def _only_requested_fields(queryset, serializer_class, request):
+    # ?fields= trims the serializer; select only those columns too (see SparseFieldsMixin)
+    requested = serializer_class.requested_fields(request)
+    return queryset.only("id", *requested) if requested else queryset
+
+
+# List endpoints: ?ordering=, ?fields=, the filters in get_queryset, and keyset pages
+# with ?limit= / ?cursor= (see base/pagination.py). All of it is resolved in SQL.
+# Category, set and card views answer If-None-Match from a per-user version (base/versions.py).
+class CardSetListCreateView(VersionedCollectionMixin, generics.ListCreateAPIView):
+    version_collection = "cardsets"
     serializer_class = CardSetSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["id", "name"]
+    ordering = ["id"]
+
     def get_queryset(self):
-        return CardSet.objects.filter(user=self.request.user)
+        queryset = CardSet.objects.filter(user=self.request.user)
+        params = self.request.query_params
+        if params.get("category"):
+            queryset = queryset.filter(category_id=params["category"])
+        if params.get("name_prefix"):
+            queryset = queryset.filter(name__istartswith=params["name_prefix"])
+        return _only_requested_fields(queryset, self.serializer_class, self.request)
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class CardSetDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CardSetDetailView(VersionedCollectionMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_collection = "cardsets"
+    cascade_collections = ("cards",)
     serializer_class = CardSetSerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
         return CardSet.objects.filter(user=self.request.user)
 
-class CardListCreateView(generics.ListCreateAPIView):
+class CardListCreateView(VersionedCollectionMixin, generics.ListCreateAPIView):
+    version_collection = "cards"
     serializer_class = CardSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["id", "term"]
+    ordering = ["id"]
+
     def get_queryset(self):
-        card_set_id = self.request.query_params.get("card_set")
+        params = self.request.query_params
+        card_set_id = params.get("card_set")
         if card_set_id:
             # Ensure the card_set belongs to the user
             if CardSet.objects.filter(id=card_set_id, user=self.request.user).exists():
-                return Card.objects.filter(card_set_id=card_set_id)
+                queryset = Card.objects.filter(card_set_id=card_set_id)
+                if params.get("term_prefix"):
+                    queryset = queryset.filter(term__istartswith=params["term_prefix"])
+                if params.get("has_image"):
+                    with_image = (
+                        (Q(term_image__isnull=False) & ~Q(term_image=""))
+                        | (Q(definition_image__isnull=False) & ~Q(definition_image=""))
+                    )
+                    queryset = queryset.filter(with_image) if _truthy(params["has_image"]) else queryset.exclude(with_image)
+                return _only_requested_fields(queryset, self.serializer_class, self.request)
             return Card.objects.none() # Card set not found or doesn't belong to user
         # If you want to list all cards for a user (not typical without a set context):
         # return Card.objects.filter(card_set__user=self.request.user)
@@ -199,27 +278,424 @@ class CardListCreateView(generics.ListCreateAPIView):
         serializer.save()
 
 
-class CardDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CardDetailView(VersionedCollectionMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_collection = "cards"
     serializer_class = CardSerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
         return Card.objects.filter(card_set__user=self.request.user)
 
 
+class CardBulkView(APIView):
+    """
+    Creates, updates and deletes many cards in one request and one transaction:
+
+        POST /api/cards/bulk/
+        {"create": [{"card_set": 1, "term": "...", "definition": "..."}, ...],
+         "update": [{"id": 7, "term": "..."}, ...],
+         "delete": [8, 9]}
+
+    All or nothing: if any item is invalid, nothing is applied and the response is 400.
+    Each list in the response has one result per item, in request order: a "status" and
+    the "card" (or "errors"). Items that were valid but not applied because of another
+    item's error get 424. Set ownership is checked once for all the sets involved.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, dict):
+            return Response(
+                {"error": "Expected an object with create, update and delete lists."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        creates = request.data.get("create") or []
+        updates = request.data.get("update") or []
+        deletes = request.data.get("delete") or []
+        if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+            return Response({"error": "create, update and delete must be lists."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(creates) + len(updates) + len(deletes) > settings.CARD_BULK_MAX_OPERATIONS:
+            return Response(
+                {"error": f"At most {settings.CARD_BULK_MAX_OPERATIONS} operations per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        creates, create_errors = self._validate(creates)
+        updates, update_errors = self._validate(updates, partial=True)
+        delete_errors = [{} if isinstance(card_id, int) else {"id": ["A valid integer is required."]} for card_id in deletes]
+        for item, errors in zip(updates, update_errors):
+            if not errors and "id" not in item:
+                errors["id"] = ["This field is required."]
+
+        # One query for every card touched, one for every set written to
+        targets = [(item["id"], errors) for item, errors in zip(updates, update_errors) if not errors]
+        targets += [(card_id, errors) for card_id, errors in zip(deletes, delete_errors) if not errors]
+        cards = Card.objects.filter(card_set__user=request.user).in_bulk([card_id for card_id, _ in targets])
+        seen = set()
+        for card_id, errors in targets:
+            if card_id not in cards:
+                errors["id"] = ["Card not found."]
+            elif card_id in seen:
+                errors["id"] = ["Card appears more than once in this request."]
+            seen.add(card_id)
+
+        writes = [
+            (item, errors) for item, errors in zip(creates + updates, create_errors + update_errors)
+            if not errors and "card_set" in item
+        ]
+        owned_sets = set(
+            CardSet.objects.filter(user=request.user, id__in={item["card_set"] for item, _ in writes})
+            .values_list("id", flat=True)
+        )
+        for item, errors in writes:
+            if item["card_set"] not in owned_sets:
+                errors["card_set"] = ["Invalid card_set or permission denied."]
+
+        if any(errors for errors in create_errors + update_errors + delete_errors):
+            return Response({
+                "create": [self._failed(errors) for errors in create_errors],
+                "update": [self._failed(errors) for errors in update_errors],
+                "delete": [self._failed(errors, card_id) for card_id, errors in zip(deletes, delete_errors)],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        created = [
+            Card(card_set_id=item["card_set"], term=item["term"], definition=item["definition"]) for item in creates
+        ]
+        now = timezone.now()
+        updated = []
+        changed_fields = {"updated_at"} # bulk_update doesn't apply auto_now
+        for item in updates:
+            card = cards[item["id"]]
+            for field, value in item.items():
+                if field == "card_set":
+                    card.card_set_id = value
+                elif field != "id":
+                    setattr(card, field, value)
+                changed_fields.add(field)
+            card.updated_at = now
+            updated.append(card)
+        changed_fields.discard("id")
+
+        with transaction.atomic():
+            Card.objects.bulk_create(created, batch_size=500)
+            if updated:
+                Card.objects.bulk_update(updated, sorted(changed_fields), batch_size=500)
+            if deletes:
+                Card.objects.filter(id__in=deletes).delete()
+        bump(request.user.id, "cards")
+
+        context = {"request": request}
+        return Response({
+            "create": [{"status": 201, "card": data} for data in CardSerializer(created, many=True, context=context).data],
+            "update": [{"status": 200, "card": data} for data in CardSerializer(updated, many=True, context=context).data],
+            "delete": [{"status": 204, "id": card_id} for card_id in deletes],
+        })
+
+    def _validate(self, items, partial=False):
+        """Returns (validated items, field errors per item); an item's errors are {} when it is valid."""
+        validated, errors = [], []
+        for item in items:
+            serializer = CardBulkItemSerializer(data=item, partial=partial)
+            valid = serializer.is_valid()
+            validated.append(serializer.validated_data if valid else {})
+            errors.append({} if valid else dict(serializer.errors))
+        return validated, errors
+
+    def _failed(self, errors, card_id=None):
+        result = {"status": 400 if errors else 424}
+        if card_id is not None:
+            result["id"] = card_id
+        if errors:
+            result["errors"] = errors
+        return result
+
+
+class CardSetImportView(APIView):
+    """
+    Imports a deck file (multipart "file") into an existing set ("card_set") or a new one
+    ("name", optionally "category"). The format comes from ?type=csv|tsv|json or the file
+    extension; see base/decks.py. Malformed rows are skipped and reported.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Attach the deck as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fmt = decks.detect_format(upload.name, request.query_params.get("type"))
+        except decks.DeckFormatError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        card_set_id = request.data.get("card_set")
+        if card_set_id:
+            card_set = CardSet.objects.filter(id=card_set_id, user=request.user).first()
+            if card_set is None:
+                return Response({"error": "Invalid card_set or permission denied."}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            serializer = CardSetSerializer(data={
+                "name": request.data.get("name") or os.path.splitext(upload.name)[0],
+                "description": request.data.get("description"),
+                "category": request.data.get("category"),
+            })
+            serializer.is_valid(raise_exception=True)
+            category = serializer.validated_data.get("category")
+            if category is not None and category.user_id != request.user.id:
+                return Response({"error": "Invalid category or permission denied."}, status=status.HTTP_400_BAD_REQUEST)
+            card_set = None
+
+        try:
+            # The new set, if any, only exists if the import goes through
+            with transaction.atomic():
+                if card_set is None:
+                    card_set = serializer.save(user=request.user)
+                created, skipped, errors = decks.import_cards(card_set, decks.iter_rows(upload, fmt))
+        except decks.DeckFormatError as e:
+            return Response({"error": f"Could not read the {fmt.upper()} file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        bump(request.user.id, "cards", *([] if card_set_id else ["cardsets"]))
+        return Response(
+            {"card_set": card_set.id, "created": created, "skipped": skipped, "errors": errors},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class CardSetExportView(APIView):
+    """Streams a set's cards as ?type=csv (default), tsv or json, image URLs included."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, format=None):
+        card_set = CardSet.objects.filter(id=pk, user=request.user).only("id", "name").first()
+        if card_set is None:
+            return Response({"error": "Card set not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            fmt = decks.detect_format("", request.query_params.get("type") or "csv")
+        except decks.DeckFormatError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            decks.export_chunks(Card.objects.filter(card_set=card_set), fmt, request),
+            content_type=f"{decks.FORMATS[fmt]}; charset=utf-8",
+        )
+        filename = slugify(card_set.name) or f"set-{card_set.id}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+        return response
+
+
+CARD_GENERATION_DEFAULT_COUNT = 20
+CARD_GENERATION_MAX_COUNT = 100
+CARD_GENERATION_MAX_NOTES = 60000 # characters
+GENERATION_LIMIT_MESSAGES = {
+    ratelimit.RATE: "You're generating cards too quickly. Please wait a moment.",
+    ratelimit.QUOTA: "You've used today's card generations. Come back tomorrow!",
+}
+
+
+class CardSetGenerateView(APIView):
+    """
+    POST {"notes": "...", "count": 20}: Gemini writes up to count cards from the notes into
+    the set, in one call per chunk of notes (see base/generation.py). With ?background=1
+    the work is queued as a "generate_cards" job and the response is 202.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, format=None):
+        card_set = CardSet.objects.filter(id=pk, user=request.user).first()
+        if card_set is None:
+            return Response({"error": "Card set not found."}, status=status.HTTP_404_NOT_FOUND)
+        notes = request.data.get("notes")
+        if not isinstance(notes, str) or not notes.strip():
+            return Response({"error": "Paste some notes to generate cards from."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(notes) > CARD_GENERATION_MAX_NOTES:
+            return Response(
+                {"error": f"Notes can be at most {CARD_GENERATION_MAX_NOTES} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            count = int(request.data.get("count") or CARD_GENERATION_DEFAULT_COUNT)
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= CARD_GENERATION_MAX_COUNT:
+            return Response(
+                {"error": f"count must be between 1 and {CARD_GENERATION_MAX_COUNT}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not GOOGLE_API_KEY:
+            logger.error("GOOGLE_API_KEY is not configured.")
+            return Response({"error": "AI service configuration error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if gemini_breaker.is_open():
+            return Response(
+                {"error": CIRCUIT_OPEN_MESSAGE},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(gemini_breaker.retry_after())},
+            )
+        rate_limit = ratelimit.check("generate", request.user)
+        if not rate_limit.allowed:
+            return rate_limit.apply(Response(
+                {"error": GENERATION_LIMIT_MESSAGES[rate_limit.kind]}, status=status.HTTP_429_TOO_MANY_REQUESTS
+            ))
+
+        if _wants_background(request):
+            try:
+                job = jobs.enqueue(request.user, "generate_cards", {"card_set_id": card_set.id, "notes": notes, "count": count})
+            except jobs.QueueFull:
+                return rate_limit.apply(Response({"error": QUEUE_FULL_MESSAGE}, status=status.HTTP_429_TOO_MANY_REQUESTS))
+            return rate_limit.apply(Response(
+                {"job": JobSerializer(job).data}, status=status.HTTP_202_ACCEPTED, headers=_accepted_headers(job)
+            ))
+
+        try:
+            cards, skipped, errors = generation.generate_cards(card_set, notes, count, GOOGLE_API_KEY)
+        except generation.GenerationFailed as e:
+            return rate_limit.apply(Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY))
+        return rate_limit.apply(Response({
+            "card_set": card_set.id,
+            "created": len(cards),
+            "skipped": skipped,
+            "errors": errors,
+            "cards": CardSerializer(cards, many=True, context={"request": request}).data,
+        }, status=status.HTTP_201_CREATED))
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+
+class SearchView(APIView):
+    """
+    GET /api/search/?q=...&limit=&offset= : ranked hits across the user's cards, sets and
+    chat messages, with highlighted snippets (see base/search.py).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        q = request.query_params.get("q", "").strip()
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+            offset = max(0, int(request.query_params.get("offset", 0)))
+        except ValueError:
+            return Response({"error": "limit and offset must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # One extra row tells whether there is a next page
+            hits = search.search(request.user, q, limit + 1, offset)
+        except search.SearchUnavailable as e:
+            logger.error(str(e))
+            return Response({"error": "Search is not available right now."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({
+            "results": hits[:limit],
+            "next_offset": offset + limit if len(hits) > limit else None,
+        })
+
+
+DASHBOARD_RECENT_CHATS = 5
+
+
+class DashboardView(APIView):
+    """
+    Everything the home screen shows in one response: categories with their sets and
+    per-set card counts, sets without a category, and the most recent chats. Four
+    queries however many sets the user has (card counts come from one GROUP BY).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        user = request.user
+        sets = CardSet.objects.annotate(card_count=Count("cards")).order_by("name", "id")
+        categories = list(
+            Category.objects.filter(user=user).order_by("name", "id").prefetch_related(Prefetch("sets", queryset=sets))
+        )
+        uncategorized = list(sets.filter(user=user, category__isnull=True))
+        recent_chats = (
+            Chat.objects.filter(user=user)
+            .only(*ChatSessionListSerializer.Meta.fields) # Leaves out the rolling summary text
+            .order_by("-updated_at", "-id")[:DASHBOARD_RECENT_CHATS]
+        )
+
+        all_sets = uncategorized + [card_set for category in categories for card_set in category.sets.all()]
+        return Response({
+            "categories": DashboardCategorySerializer(categories, many=True).data,
+            "uncategorized_sets": DashboardCardSetSerializer(uncategorized, many=True).data,
+            "recent_chats": ChatSessionListSerializer(recent_chats, many=True).data,
+            "totals": {
+                "categories": len(categories),
+                "sets": len(all_sets),
+                "cards": sum(card_set.card_count for card_set in all_sets),
+            },
+        })
+
+
+class SyncView(APIView):
+    """
+    Delta sync: rows created, updated or deleted since ?since=<token>, and the token for
+    the next call. Without a token it returns everything (see base/sync.py).
+    """
+    permission_classes = [IsAuthenticated]
+    serializers = {
+        "categories": CategorySerializer,
+        "cardsets": CardSetSerializer,
+        "cards": CardSerializer,
+        "chats": ChatSessionListSerializer,
+    }
+
+    def get(self, request, format=None):
+        started_at = timezone.now() # Taken before reading, so nothing written meanwhile is skipped next time
+        since = request.query_params.get("since")
+        querysets, deleted, full = sync.changes(request.user, sync.decode_token(since) if since else None)
+        data = {"token": sync.encode_token(started_at), "full": full}
+        for collection, queryset in querysets.items():
+            data[collection] = self.serializers[collection](queryset, many=True, context={"request": request}).data
+        data["deleted"] = deleted
+        return Response(data)
+
+
+# --- Background jobs (base/jobs.py) ---
+JOB_POLL_INTERVAL = 2 # seconds; the Retry-After of 202 responses
+QUEUE_FULL_MESSAGE = "You have too many requests waiting already. Please try again in a moment."
+
+
+def _wants_background(request):
+    # ?background=1 queues the work and answers 202 Accepted with a job to poll
+    return request.GET.get("background") in ("1", "true", "yes")
+
+
+def _accepted_headers(job):
+    return {"Location": reverse("job-detail", args=[job.id]), "Retry-After": str(JOB_POLL_INTERVAL)}
+
+
+class JobDetailView(generics.RetrieveAPIView):
+    """Status, progress and, once it has finished, the result or error of a queued job."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+
 # ---- CHAT HISTORY AND MESSAGING VIEWS ----
 
 class ChatSessionListCreateView(generics.ListCreateAPIView):
     serializer_class = ChatSessionListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["id", "updated_at", "created_at"]
+    ordering = ["-updated_at"]
 
     def get_queryset(self):
-        return Chat.objects.filter(user=self.request.user).order_by('-updated_at')
+        queryset = Chat.objects.filter(user=self.request.user)
+        if self.request.query_params.get("title_prefix"):
+            queryset = queryset.filter(title__istartswith=self.request.query_params["title_prefix"])
+        return _only_requested_fields(queryset, self.serializer_class, self.request)
 
     def perform_create(self, serializer):
         # Title can be optional at creation, will be set by first message
         serializer.save(user=self.request.user)
 
 class ChatSessionDetailView(generics.RetrieveAPIView):
+    """
+    The session plus its newest page of messages; "messages_before" is the cursor for
+    loading older ones from ChatMessageCreateView.get. ?messages=0 leaves messages out.
+    """
     serializer_class = ChatSessionDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_url_kwarg = 'session_id' # Ensure this matches your URL conf (e.g., <int:session_id>)
@@ -227,112 +703,97 @@ class ChatSessionDetailView(generics.RetrieveAPIView):
     def get_queryset(self):
         return Chat.objects.filter(user=self.request.user)
 
+    def retrieve(self, request, *args, **kwargs):
+        chat_session = self.get_object()
+        data = self.get_serializer(chat_session).data
+        if request.query_params.get('messages') != '0':
+            paginator = MessageKeysetPagination()
+            page = paginator.paginate_queryset(chat_session.messages.all(), request, view=self)
+            data['messages'] = MessageSerializer(page, many=True).data
+            data['messages_before'] = paginator.before_cursor
+        return Response(data)
 
-# --- Helper for Gemini API Call ---
-RATE_LIMIT_MESSAGES = [
-    "You're going too fast! Try again in a few seconds.",
-    "Hold on! You're sending messages too quickly. Try again in 5-10 seconds.",
-    "Slow down! The AI needs a moment to respond properly.",
-]
+
+# --- Helpers for the chat views ---
 FREE_LIMIT_MESSAGES = [
     "You have reached your free usage limit for this feature.",
     "Upgrade to premium to continue using this feature.",
 ]
+MAX_MESSAGES_SESSION_FREE = 50 # Example: Max 50 messages per session for free tier
+QUOTA_MESSAGES = [
+    "You've used today's AI messages. Come back tomorrow!",
+    "That's all the AI messages for now. Your allowance resets soon.",
+]
+
 
-def _call_gemini_api_with_history(prompt_history, api_key):
+def _check_chat_limits(user, chat_session):
     """
-    Calls the Gemini API with a history of messages.
-    prompt_history should be a list of dicts:
-    e.g., [{'role': 'user', 'parts': [{'text': 'Hello'}]}, {'role': 'model', 'parts': [{'text': 'Hi!'}]}]
+    Returns (error, rate_limit). error is an (error message, HTTP status) tuple if the
+    user may not send another message in chat_session right now, otherwise None;
+    rate_limit carries the RateLimit-* headers for the response (see base/ratelimit.py).
     """
-    # Use the v1beta endpoint for more features like system instructions if needed,
-    # or v1 for general use. Flash is faster, Pro is more capable.
-    API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
-    # API_URL = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-pro-latest:generateContent"
-
-    MAX_RETRIES = 3
-    BASE_BACKOFF = 2  # seconds
-
-    payload = {
-        "contents": prompt_history,
-        # Optional: Add generationConfig for temperature, max tokens, etc.
-        # "generationConfig": {
-        #     "temperature": 0.7,
-        #     "topP": 1.0,
-        #     "maxOutputTokens": 2048,
-        # },
-        # Optional: Add safetySettings
-        # "safetySettings": [
-        #     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        #     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        #     # ... other settings
-        # ]
-    }
+    if user.is_superuser:
+        return None, ratelimit.UNLIMITED
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            resp = requests.post(
-                f"{API_URL}?key={api_key}",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=45  # Increased timeout
-            )
-        except requests.RequestException as e:
-            logger.error(f"Gemini API Network error on attempt {attempt + 1}: {e}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(BASE_BACKOFF * (2 ** attempt))
-                continue
-            return f"Sorry, I couldn't reach the AI service due to a network issue: {e}"
-
-        if resp.status_code == 200:
-            try:
-                data = resp.json()
-                candidates = data.get("candidates", [])
-                if candidates and candidates[0].get("content") and candidates[0]["content"].get("parts"):
-                    text_parts = candidates[0]["content"]["parts"]
-                    # Concatenate if multiple parts, usually just one for text
-                    full_text = "".join(part.get("text", "") for part in text_parts)
-                    return full_text if full_text else "I received an empty response from the AI."
-
-                # Check for blocked prompt
-                prompt_feedback = data.get("promptFeedback")
-                if prompt_feedback and prompt_feedback.get("blockReason"):
-                    reason = prompt_feedback["blockReason"]
-                    details = prompt_feedback.get("safetyRatings")
-                    logger.warning(f"Gemini API blocked prompt: {reason}. Details: {details}")
-                    return f"My apologies, I cannot respond to that due to content restrictions ({reason})."
-                
-                logger.error(f"Unexpected Gemini API response structure: {data}")
-                return "I received an unexpected response from the AI."
-            except (ValueError, KeyError, IndexError, TypeError) as e: # Added TypeError
-                logger.error(f"Error parsing Gemini response: {e}. Response: {resp.text[:500]}")
-                return "Sorry, I had trouble understanding the AI's response."
-
-        elif resp.status_code == 429: # Rate limit / Quota exceeded
-            logger.warning(f"Gemini API quota hit (429) on attempt {attempt + 1}. Response: {resp.text[:200]}")
-            if attempt < MAX_RETRIES - 1:
-                retry_after_str = resp.headers.get("Retry-After")
-                wait_time = BASE_BACKOFF * (2 ** attempt)
-                if retry_after_str and retry_after_str.isdigit():
-                    wait_time = max(wait_time, int(retry_after_str))
-                logger.info(f"Retrying Gemini call after {wait_time} seconds.")
-                time.sleep(wait_time)
-                continue
-            return random.choice(RATE_LIMIT_MESSAGES) # Or "AI service is currently busy."
-
-        else: # Other errors
-            logger.error(f"Gemini API error {resp.status_code} on attempt {attempt + 1}. Body: {resp.text[:200]}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(BASE_BACKOFF * (2 ** attempt))
-                continue
-            return f"Sorry, I encountered an error trying to reach the AI service (Code: {resp.status_code})."
-            
-    return "The AI service seems to be unavailable after multiple retries."
+    # Checked first: it only reads, so a refused request doesn't use up any of the user's rate
+    if chat_session.message_count >= MAX_MESSAGES_SESSION_FREE:
+        logger.warning(f"User {user.username} exceeded message limit for session {chat_session.id}.")
+        return (random.choice(FREE_LIMIT_MESSAGES), status.HTTP_403_FORBIDDEN), ratelimit.UNLIMITED
+
+    rate_limit = ratelimit.check("chat", user)
+    if not rate_limit.allowed:
+        messages = QUOTA_MESSAGES if rate_limit.kind == ratelimit.QUOTA else RATE_LIMIT_MESSAGES
+        return (random.choice(messages), status.HTTP_429_TOO_MANY_REQUESTS), rate_limit
+    return None, rate_limit
+
+
+def _queue_chat_reply(user, chat_session, content, fresh=False):
+    """
+    Saves the user's message and queues the AI reply as a "chat_reply" job. Both happen in
+    one transaction, so a full queue (jobs.QueueFull) doesn't leave a message unanswered.
+    Returns (user message, job).
+    """
+    with transaction.atomic():
+        user_message = chat_session.add_message('user', content)
+        job = jobs.enqueue(user, "chat_reply", {
+            "chat_id": chat_session.id, "user_message_id": user_message.id, "fresh": fresh,
+        })
+    return user_message, job
+
+
+def _sse_event(event, data):
+    # One Server-Sent Events frame; data is JSON so clients can parse each event separately
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _wants_stream(request):
+    # Streaming is opt-in with ?stream=1 (an Accept: text/event-stream header would be
+    # rejected by DRF's content negotiation before the view runs)
+    return request.GET.get("stream") in ("1", "true", "yes")
+
+
+def _wants_fresh(request):
+    # ?fresh=1 or Cache-Control: no-cache skips the Gemini response cache (base/gemini_cache.py)
+    return (
+        request.GET.get("fresh") in ("1", "true", "yes")
+        or "no-cache" in request.headers.get("Cache-Control", "").lower()
+    )
 
 
 class ChatMessageCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get(self, request, session_id, format=None):
+        """A page of the session's messages, oldest first (?before= / ?after= cursors, ?limit=)."""
+        try:
+            chat_session = Chat.objects.get(pk=session_id, user=request.user)
+        except Chat.DoesNotExist:
+            return Response({"error": "Chat session not found or access denied."}, status=status.HTTP_404_NOT_FOUND)
+        paginator = MessageKeysetPagination()
+        page = paginator.paginate_queryset(chat_session.messages.all(), request, view=self)
+        return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+
+    @idempotent # Retries with the same Idempotency-Key get the first response back
     def post(self, request, session_id, format=None):
         user = request.user
         try:
@@ -340,157 +801,319 @@ class ChatMessageCreateView(APIView):
         except Chat.DoesNotExist:
             return Response({"error": "Chat session not found or access denied."}, status=status.HTTP_404_NOT_FOUND)
 
-        # --- Rate Limiting & Usage Limits (Adapt as needed) ---
-        if not user.is_superuser:
-            # Example: Max 50 messages per session for free tier
-            MAX_MESSAGES_SESSION_FREE = 50
-            if chat_session.messages.count() >= MAX_MESSAGES_SESSION_FREE:
-                logger.warning(f"User {user.username} exceeded message limit for session {session_id}.")
-                return Response({"error": random.choice(FREE_LIMIT_MESSAGES)}, status=status.HTTP_403_FORBIDDEN)
-
-            # Example: Cooldown of 3 seconds between messages in a session
-            COOLDOWN_SECONDS = 3
-            cache_key_cooldown = f"chat_msg_cooldown_{user.id}_{session_id}"
-            last_request_time = cache.get(cache_key_cooldown)
-            if last_request_time:
-                if time.time() - last_request_time < COOLDOWN_SECONDS:
-                    logger.warning(f"User {user.username} sending messages too quickly for session {session_id}.")
-                    return Response({"error": random.choice(RATE_LIMIT_MESSAGES)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
-            cache.set(cache_key_cooldown, time.time(), timeout=COOLDOWN_SECONDS + 2)
-        # --- End Rate Limiting ---
+        # Gemini is failing: reject before saving a message that would get no reply
+        if gemini_breaker.is_open():
+            return Response(
+                {"error": CIRCUIT_OPEN_MESSAGE},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(gemini_breaker.retry_after())},
+            )
 
+        # Validated before the limits, so a malformed request isn't charged to the quota
         user_message_content = request.data.get('content')
         if not user_message_content or not user_message_content.strip():
             return Response({"error": "Message content cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 1. Save user's message
-        user_message = Message.objects.create(
-            chat=chat_session,
-            sender='user',
-            content=user_message_content.strip()
-        )
-        user_message_serializer = MessageSerializer(user_message)
+        # --- Rate Limiting & Usage Limits (settings.RATE_LIMITS["chat"]) ---
+        limit_error, rate_limit = _check_chat_limits(user, chat_session)
+        if limit_error:
+            error_message, error_status = limit_error
+            return rate_limit.apply(Response({"error": error_message}, status=error_status))
+        # --- End Rate Limiting ---
 
-        # 2. Prepare history for Gemini
-        messages_qs = chat_session.messages.order_by('timestamp').all() # Includes the new user message
-        gemini_prompt_history = []
-        for msg in messages_qs:
-            # Gemini expects 'user' for user messages and 'model' for AI's previous responses
-            role = "model" if msg.sender == "ai" else "user"
-            gemini_prompt_history.append({'role': role, 'parts': [{'text': msg.content}]})
+        if _wants_background(request):
+            # The reply is generated by a worker; the client polls the job for it
+            try:
+                user_message, job = _queue_chat_reply(
+                    user, chat_session, user_message_content.strip(), fresh=_wants_fresh(request)
+                )
+            except jobs.QueueFull:
+                return rate_limit.apply(Response({"error": QUEUE_FULL_MESSAGE}, status=status.HTTP_429_TOO_MANY_REQUESTS))
+            return rate_limit.apply(Response(
+                {"user_message": MessageSerializer(user_message).data, "job": JobSerializer(job).data},
+                status=status.HTTP_202_ACCEPTED,
+                headers=_accepted_headers(job),
+            ))
+
+        # 1. Save user's message (also updates the chat's counters, and its title on the first one)
+        user_message = chat_session.add_message('user', user_message_content.strip())
+        user_message_serializer = MessageSerializer(user_message)
 
-        # 3. Get AI response
         # Ensure GOOGLE_API_KEY is available
         if not GOOGLE_API_KEY:
             logger.error("GOOGLE_API_KEY is not configured.")
             return Response({"error": "AI service configuration error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        ai_response_content = _call_gemini_api_with_history(gemini_prompt_history, GOOGLE_API_KEY)
+        # 2. Prepare history for Gemini (summary + recent turns within the token budget)
+        gemini_prompt_history = build_prompt_history(chat_session)
+
+        # 3. Get AI response
+        use_cache = not _wants_fresh(request)
+        if _wants_stream(request):
+            return rate_limit.apply(
+                self._stream_response(chat_session, user_message_serializer.data, gemini_prompt_history, use_cache)
+            )
+
+        ai_response_content = _call_gemini_api_with_history(gemini_prompt_history, GOOGLE_API_KEY, use_cache=use_cache)
 
         # 4. Save AI's message
-        ai_message = Message.objects.create(
-            chat=chat_session,
-            sender='ai',
-            content=ai_response_content
-        )
+        ai_message = save_ai_reply(chat_session, ai_response_content)
         ai_message_serializer = MessageSerializer(ai_message)
 
-        # 5. Update chat session's updated_at timestamp and try to set title if it's the first user message
-        chat_session.save() # This will trigger updated_at and also title logic in Chat.save()
-
-        return Response({
+        return rate_limit.apply(Response({
             "user_message": user_message_serializer.data,
             "ai_message": ai_message_serializer.data
-        }, status=status.HTTP_201_CREATED)
+        }, status=status.HTTP_201_CREATED))
+
+    def _stream_response(self, chat_session, user_message_data, gemini_prompt_history, use_cache=True):
+        """
+        SSE variant of the reply: the saved user message first, then "delta" events as
+        Gemini produces text, then the persisted AI message once the upstream stream closes.
+        """
+        def event_stream():
+            yield _sse_event("user_message", user_message_data)
+            chunks = []
+            try:
+                for delta in _stream_gemini_api_with_history(gemini_prompt_history, GOOGLE_API_KEY, use_cache):
+                    chunks.append(delta)
+                    yield _sse_event("delta", {"text": delta})
+            finally:
+                # Runs even if the client disconnects mid-stream so the reply isn't lost
+                ai_message = save_ai_reply(chat_session, "".join(chunks))
+            yield _sse_event("ai_message", MessageSerializer(ai_message).data)
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream", status=status.HTTP_201_CREATED)
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no" # Stop proxies from buffering the stream
+        return response
 
 
 # --- Existing TextToSpeech Views ---
 # Path to the local "freelimit.mp3" file
 FREELIMIT_MP3_PATH = os.path.join(settings.BASE_DIR, "base", "static", "freelimit.mp3") # Make sure this path is correct
-MAX_TTS_REQUESTS = 4 # Example limit
 
 def handle_tts_usage_limit(request):
+    """
+    Applies settings.RATE_LIMITS["tts"] to an audio request that will call ElevenLabs.
+    Returns (limit_response, rate_limit): limit_response is the response to send
+    instead when the user is over a limit, otherwise None.
+    """
     user = request.user
-    if user.is_superuser:
-        return None
-
-    cache_key = f"tts_usage_count_{user.id}"
-    current_usage = cache.get(cache_key, 0)
-
-    if current_usage >= MAX_TTS_REQUESTS:
-        logger.warning(f"User {user.username} exceeded the TTS usage limit.")
-        if not os.path.exists(FREELIMIT_MP3_PATH):
-            logger.error(f"CRITICAL: freelimit.mp3 not found at {FREELIMIT_MP3_PATH}")
-            return JsonResponse({"error": "Usage limit audio feedback is unavailable."}, status=500)
-        try:
-            return FileResponse(open(FREELIMIT_MP3_PATH, "rb"), as_attachment=True, filename="freelimit.mp3")
-        except Exception as e:
-            logger.error(f"Error serving freelimit.mp3: {e}")
-            return JsonResponse({"error": "Error providing usage limit feedback."}, status=500)
+    rate_limit = ratelimit.check("tts", user)
+    if rate_limit.allowed:
+        return None, rate_limit
+
+    if rate_limit.kind != ratelimit.QUOTA:
+        return rate_limit.apply(JsonResponse(
+            {"error": "You're requesting audio too quickly. Please wait a moment."}, status=429
+        )), rate_limit
+
+    # Out of quota: the frontend plays this clip instead
+    if not os.path.exists(FREELIMIT_MP3_PATH):
+        logger.error(f"CRITICAL: freelimit.mp3 not found at {FREELIMIT_MP3_PATH}")
+        return JsonResponse({"error": "Usage limit audio feedback is unavailable."}, status=500), rate_limit
+    try:
+        return rate_limit.apply(
+            FileResponse(open(FREELIMIT_MP3_PATH, "rb"), as_attachment=True, filename="freelimit.mp3")
+        ), rate_limit
+    except Exception as e:
+        logger.error(f"Error serving freelimit.mp3: {e}")
+        return JsonResponse({"error": "Error providing usage limit feedback."}, status=500), rate_limit
 
-    cache.set(cache_key, current_usage + 1, timeout=None) # Persists, or set a timeout (e.g., 24*60*60 for daily)
-    return None
+def _chunked_tts_plan(text, voice_settings):
+    """
+    The sentence segments of a long text (see base/tts_chunks.py), or None to synthesize
+    it in one call: it is short, or there is no cache to assemble the segments in.
+    """
+    parts = tts_chunks.segments(text)
+    if len(parts) < 2 or not settings.TTS_CACHE_ENABLED:
+        return None
+    return tts_chunks.plan(parts, VOICE_ID, TTS_MODEL_ID, voice_settings)
+
+def _chunked_tts_response(request, segments_plan, voice_settings):
+    """Streams a long text sentence by sentence, synthesizing the segments in parallel."""
+    rate_limit = ratelimit.UNLIMITED
+    if not all(cached for _, _, cached in segments_plan):
+        # Like a cache hit, a text whose every sentence is cached doesn't count against the limit
+        limit_response, rate_limit = handle_tts_usage_limit(request)
+        if limit_response:
+            return limit_response
+        if not ELABS_API_KEY or not VOICE_ID:
+            logger.error("ElevenLabs API Key or Voice ID is not configured.")
+            return JsonResponse({"error": "TTS service configuration error."}, status=500)
+    response = tts_chunks.streaming_response(
+        segments_plan, lambda segment: open_stream(segment, voice_settings)
+    )
+    if response is None:
+        return JsonResponse({"error": "Error generating the audio"}, status=502)
+    return rate_limit.apply(response)
+
+def _queue_tts(request, text, slow):
+    """
+    ?background=1 on the TTS endpoints: queues a "tts" job that puts the clip in the cache,
+    and answers 202. Once the job has succeeded, the same POST without ?background returns
+    the cached clip, which doesn't count against the usage limit again.
+    """
+    if not settings.TTS_CACHE_ENABLED:
+        return JsonResponse({"error": "Background audio generation needs the TTS cache."}, status=400)
+    limit_response, rate_limit = handle_tts_usage_limit(request)
+    if limit_response:
+        return limit_response
+    try:
+        job = jobs.enqueue(request.user, "tts", {"text": text, "slow": slow})
+    except jobs.QueueFull:
+        return rate_limit.apply(JsonResponse({"error": QUEUE_FULL_MESSAGE}, status=429))
+    response = JsonResponse({"job": JobSerializer(job).data}, status=202)
+    for header, value in _accepted_headers(job).items():
+        response[header] = value
+    return rate_limit.apply(response)
 
 class TextToSpeechView(APIView):
     permission_classes = [IsAuthenticated]
-    def post(self, request):
-        limit_response = handle_tts_usage_limit(request)
-        if limit_response:
-            return limit_response
 
+    @idempotent
+    def post(self, request):
         text = request.data.get("text")
         if not text:
             return JsonResponse({"error": "Text is required"}, status=400)
+
+        audio_cache_key = tts_cache.cache_key(text, VOICE_ID, TTS_MODEL_ID, TTS_VOICE_SETTINGS)
+        cached_path = tts_cache.lookup(audio_cache_key)
+        if cached_path:
+            # Cache hits are free, so they don't count against the usage limit
+            return tts_cache.file_response(request, cached_path)
+
+        if _wants_background(request):
+            return _queue_tts(request, text, slow=False)
+
+        segments_plan = _chunked_tts_plan(text, TTS_VOICE_SETTINGS)
+        if segments_plan:
+            return _chunked_tts_response(request, segments_plan, TTS_VOICE_SETTINGS)
+
+        # Checked before claiming the fill, so a refused request never holds it
+        limit_response, rate_limit = handle_tts_usage_limit(request)
+        if limit_response:
+            return limit_response
+
+        fill = tts_cache.begin_fill(audio_cache_key)
+        if fill is None:
+            # Someone is already downloading this clip; stream along with their download, which is free
+            ratelimit.refund("tts", request.user)
+            return StreamingHttpResponse(tts_cache.follow(audio_cache_key), content_type="audio/mpeg")
+
         if not ELABS_API_KEY or not VOICE_ID:
+            fill.abort()
             logger.error("ElevenLabs API Key or Voice ID is not configured.")
             return JsonResponse({"error": "TTS service configuration error."}, status=500)
 
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
-        headers = {"xi-api-key": ELABS_API_KEY, "Content-Type": "application/json", "Accept": "audio/mpeg"}
-        data = {"text": text, "model_id": "eleven_multilingual_v2", "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}}
+        url, headers, data = tts_request(text, TTS_VOICE_SETTINGS)
 
         try:
-            response = requests.post(url, json=data, headers=headers, stream=True, timeout=20)
+            response = http_session().post(url, json=data, headers=headers, stream=True, timeout=TTS_TIMEOUT)
             response.raise_for_status()
-            # Using StreamingHttpResponse is generally better for audio files
-            return StreamingHttpResponse(response.iter_content(chunk_size=8192), content_type="audio/mpeg")
+            # Using StreamingHttpResponse is generally better for audio files. The clip is
+            # written to the cache as it streams and published only if it arrives in full.
+            audio_stream = fill.tee(response.iter_content(chunk_size=8192))
+            return rate_limit.apply(StreamingHttpResponse(audio_stream, content_type="audio/mpeg"))
         except requests.exceptions.HTTPError as http_err:
+            fill.abort()
             logger.error(f"ElevenLabs HTTP error: {http_err} - {response.text}")
             return JsonResponse({"error": f"TTS service error: {http_err}"}, status=response.status_code)
         except Exception as e:
+            fill.abort()
             logger.error(f"Error generating audio with ElevenLabs: {e}")
             return JsonResponse({"error": "Error generating the audio"}, status=500)
 
 class SlowTextToSpeechView(APIView):
     permission_classes = [IsAuthenticated]
-    def post(self, request):
-        limit_response = handle_tts_usage_limit(request)
-        if limit_response:
-            return limit_response
 
+    @idempotent
+    def post(self, request):
         text = request.data.get("text")
         if not text:
             return JsonResponse({"error": "Text is required"}, status=400)
+
+        audio_cache_key = tts_cache.cache_key(text, VOICE_ID, TTS_MODEL_ID, SLOW_TTS_VOICE_SETTINGS)
+        cached_path = tts_cache.lookup(audio_cache_key)
+        if cached_path:
+            # Cache hits are free, so they don't count against the usage limit
+            return tts_cache.file_response(request, cached_path)
+
+        if _wants_background(request):
+            return _queue_tts(request, text, slow=True)
+
+        segments_plan = _chunked_tts_plan(text, SLOW_TTS_VOICE_SETTINGS)
+        if segments_plan:
+            return _chunked_tts_response(request, segments_plan, SLOW_TTS_VOICE_SETTINGS)
+
+        # Checked before claiming the fill, so a refused request never holds it
+        limit_response, rate_limit = handle_tts_usage_limit(request)
+        if limit_response:
+            return limit_response
+
+        fill = tts_cache.begin_fill(audio_cache_key)
+        if fill is None:
+            # Someone is already downloading this clip; stream along with their download, which is free
+            ratelimit.refund("tts", request.user)
+            return StreamingHttpResponse(tts_cache.follow(audio_cache_key), content_type="audio/mpeg")
+
         if not ELABS_API_KEY or not VOICE_ID:
+            fill.abort()
             logger.error("ElevenLabs API Key or Voice ID is not configured.")
             return JsonResponse({"error": "TTS service configuration error."}, status=500)
 
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
-        headers = {"xi-api-key": ELABS_API_KEY, "Content-Type": "application/json", "Accept": "audio/mpeg"}
-        data = {"text": text, "model_id": "eleven_multilingual_v2", "voice_settings": {"stability": 0.3, "similarity_boost": 0.5, "style": 0.5, "use_speaker_boost": False, "speed": 0.7}}
+        url, headers, data = tts_request(text, SLOW_TTS_VOICE_SETTINGS)
 
         try:
-            response = requests.post(url, json=data, headers=headers, stream=True, timeout=20)
+            response = http_session().post(url, json=data, headers=headers, stream=True, timeout=TTS_TIMEOUT)
             response.raise_for_status()
-            return StreamingHttpResponse(response.iter_content(chunk_size=8192), content_type="audio/mpeg")
+            audio_stream = fill.tee(response.iter_content(chunk_size=8192))
+            return rate_limit.apply(StreamingHttpResponse(audio_stream, content_type="audio/mpeg"))
         except requests.exceptions.HTTPError as http_err:
+            fill.abort()
             logger.error(f"Slow TTS ElevenLabs HTTP error: {http_err} - {response.text}")
             return JsonResponse({"error": f"TTS service error: {http_err}"}, status=response.status_code)
         except Exception as e:
+            fill.abort()
             logger.error(f"Error generating slow audio with ElevenLabs: {e}")
             return JsonResponse({"error": "Error generating the slow audio"}, status=500)
 
 
+class CardSetPrepareAudioView(APIView):
+    """
+    POST {"definitions": false, "slow": false}: queues a "tts_prewarm" job that puts the
+    audio of every card's term (and definition, if asked) in the TTS cache, so study mode
+    can play it straight away. Answers 202 with the job; its progress counts the clips.
+    Asking again while one is pending for the set returns the pending job.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, format=None):
+        card_set = CardSet.objects.filter(id=pk, user=request.user).only("id").first()
+        if card_set is None:
+            return Response({"error": "Card set not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not settings.TTS_CACHE_ENABLED:
+            return Response({"error": "Preparing audio needs the TTS cache."}, status=status.HTTP_400_BAD_REQUEST)
+        if not ELABS_API_KEY or not VOICE_ID:
+            logger.error("ElevenLabs API Key or Voice ID is not configured.")
+            return Response({"error": "TTS service configuration error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        options = {
+            name: request.data.get(name) is True or str(request.data.get(name, "")).lower() in ("1", "true", "yes")
+            for name in ("definitions", "slow")
+        }
+        job = Job.objects.filter(
+            user=request.user, kind="tts_prewarm", status__in=[Job.QUEUED, Job.RUNNING],
+            payload__card_set_id=card_set.id,
+        ).first()
+        if job is None:
+            try:
+                job = jobs.enqueue(request.user, "tts_prewarm", {"card_set_id": card_set.id, **options})
+            except jobs.QueueFull:
+                return Response({"error": QUEUE_FULL_MESSAGE}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        return Response({"job": JobSerializer(job).data}, status=status.HTTP_202_ACCEPTED, headers=_accepted_headers(job))
+
+
 # Remove or comment out the old GeminiView if ChatMessageCreateView replaces its primary function for chat.
 # If GeminiView was used for non-chat related Gemini calls, you might need to keep it or refactor its logic.
 # class GeminiView(APIView):
@@ -5,6 +5,7 @@ import logging
 from datetime import timedelta
 from django.core.cache import cache
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -85,6 +86,10 @@ TEMPLATES = [
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Or configure allowed origins as needed
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key", "if-none-match")
+# Let the frontend read the rate limit headers (base/ratelimit.py), list ETags (base/versions.py)
+# and the job status URL of 202 responses (base/jobs.py)
+CORS_EXPOSE_HEADERS = ["RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After", "ETag", "Location"]
 
 LOGGING = {
     "version": 1,
@@ -132,15 +137,121 @@ LOGGING = {
 
 load_dotenv()
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "unique-snowflake",
+# With REDIS_URL set, the cache (circuit breaker state, etc.) and the rate-limit counters
+# are shared by every worker; without it they fall back to per-process memory and the
+# database (base_counter table) respectively.
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+    COUNTER_BACKEND = {
+        "BACKEND": "base.counters.RedisCounterBackend",
+        "LOCATION": REDIS_URL,
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "unique-snowflake",
+        }
+    }
+    COUNTER_BACKEND = {
+        "BACKEND": "base.counters.DatabaseCounterBackend",
     }
-}
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 
+# Upstream (Gemini / ElevenLabs) HTTP clients, see base/upstream.py
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "45"))  # seconds
+UPSTREAM_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_KEEPALIVE_CONNECTIONS", "50"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "500"))
+
+# Per-user limits for each endpoint (base/ratelimit.py). Algorithms: token_bucket
+# (rate + burst), sliding_window (rate) and quota (limit per calendar day or month, UTC).
+RATE_LIMITS = {
+    "chat": [
+        {"algorithm": "token_bucket", "rate": "20/min", "burst": 1}, # one message every 3 seconds
+        {"algorithm": "quota", "limit": 200, "period": "day"},
+    ],
+    "tts": [
+        {"algorithm": "sliding_window", "rate": "10/min"},
+        {"algorithm": "quota", "limit": 4, "period": "day"}, # Free tier
+    ],
+    "generate": [ # AI card generation (base/generation.py); one request is up to a few Gemini calls
+        {"algorithm": "sliding_window", "rate": "5/min"},
+        {"algorithm": "quota", "limit": 20, "period": "day"},
+    ],
+    # Clips synthesized by "prepare audio" jobs (base/tasks.py), one per new clip. Kept apart
+    # from "tts" so pre-warming a set doesn't use up the day's interactive playback.
+    "tts_prewarm": [
+        {"algorithm": "quota", "limit": 300, "period": "day"},
+    ],
+}
+
+# Idempotency-Key support on chat and TTS POSTs (base/idempotency.py)
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60 # How long a key's response is replayed
+IDEMPOTENCY_MAX_BODY_BYTES = 512 * 1024 # Larger responses (long TTS clips) aren't stored
+IDEMPOTENCY_WAIT_SECONDS = 15 # How long a retry waits on its still-running original before a 409
+
+# Most create + update + delete items accepted by one POST /api/cards/bulk/
+CARD_BULK_MAX_OPERATIONS = 1000
+
+# Delta sync (base/sync.py): clients whose token is older than this get a full snapshot
+SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
+# Gemini calls made at once by one card generation request, one per chunk of notes
+CARD_GENERATION_CONCURRENCY = 4
+
+# Background jobs (base/jobs.py), run by `manage.py run_jobs`. concurrency is across all
+# workers; timeout is the lease after which a job whose worker died is run again.
+JOB_TYPES = {
+    "chat_reply": {"concurrency": 4, "max_attempts": 3, "timeout": 120},
+    "tts": {"concurrency": 2, "max_attempts": 3, "timeout": 60},
+    "generate_cards": {"concurrency": 2, "max_attempts": 2, "timeout": 180},
+    "tts_prewarm": {"concurrency": 1, "max_attempts": 2, "timeout": 600}, # a whole set's audio
+}
+JOB_MAX_PENDING_PER_USER = 20 # Queued + running; more gets a 429 instead of a longer backlog
+JOB_RETRY_BASE_DELAY = 5 # seconds, doubled after each failed attempt
+JOB_RETRY_MAX_DELAY = 300
+JOB_RETENTION_DAYS = 7 # Finished jobs (and their results) are deleted after this
+
+# Gemini retries must all fit in the deadline; the circuit breaker (base/circuit.py) fails
+# chat requests fast after repeated upstream failures
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "30"))
+GEMINI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("GEMINI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+GEMINI_CIRCUIT_RECOVERY_SECONDS = int(os.getenv("GEMINI_CIRCUIT_RECOVERY_SECONDS", "30"))
+
+# Hedging (base/hedging.py): a Gemini call still pending after the primary's recent p95
+# latency is duplicated to GEMINI_HEDGE_MODEL, and the first answer wins. Each hedge is a
+# second paid request, so it is off by default (empty); set it to a model other than the primary.
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL", "")
+GEMINI_HEDGE_PERCENTILE = 95
+GEMINI_HEDGE_WINDOW = 200 # latency samples kept per process
+GEMINI_HEDGE_MIN_SAMPLES = 20 # use GEMINI_HEDGE_INITIAL_DELAY until there are this many
+GEMINI_HEDGE_INITIAL_DELAY = 6.0 # seconds
+GEMINI_HEDGE_MIN_DELAY = 1.0
+GEMINI_HEDGE_MAX_DELAY = 15.0
+
+# Opt-in cache of Gemini replies to identical prompts (base/gemini_cache.py). Chat requests
+# can skip it with ?fresh=1 or Cache-Control: no-cache.
+GEMINI_RESPONSE_CACHE_ENABLED = os.getenv("GEMINI_RESPONSE_CACHE_ENABLED", "False") == "True"
+GEMINI_RESPONSE_CACHE_TTL = int(os.getenv("GEMINI_RESPONSE_CACHE_TTL", str(24 * 60 * 60))) # seconds, per entry
+GEMINI_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("GEMINI_RESPONSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Chat context budget, see base/context.py. Token counts are estimates (~4 chars/token).
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "8000"))
+CHAT_CONTEXT_RECENT_MESSAGES = int(os.getenv("CHAT_CONTEXT_RECENT_MESSAGES", "12"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "500"))
+
+# Route chat and TTS to the async views in base/async_views.py. Only useful when serving
+# myproj.asgi, e.g. gunicorn myproj.asgi:application -k uvicorn.workers.UvicornWorker
+ASYNC_UPSTREAM_VIEWS = os.getenv("ASYNC_UPSTREAM_VIEWS", "False") == "True"
+
 
 WSGI_APPLICATION = "myproj.wsgi.application"
 
@@ -193,6 +304,17 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# On-disk TTS audio cache with LRU eviction, see base/tts_cache.py
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "True") == "True"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(MEDIA_ROOT, "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# ElevenLabs calls made at once by one "prepare audio" job for a card set
+TTS_PREWARM_CONCURRENCY = 3
+# ElevenLabs calls made at once for the sentences of one long text (base/tts_chunks.py)
+TTS_CHUNK_CONCURRENCY = 3
+# Threads shared by all those calls in one process, however many responses are streaming
+TTS_CHUNK_WORKERS = int(os.getenv("TTS_CHUNK_WORKERS", "12"))
+
 # Static files
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"